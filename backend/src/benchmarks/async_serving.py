@@ -0,0 +1,218 @@
+"""Exam start under the ASGI mode versus WSGI worker threads.
+
+Every virtual student logs in, starts the test, autosaves each answer and
+submits, all students at once. The clients are coroutines on one event loop
+in both modes; only the server side differs:
+
+    wsgi  each request waits for one of --threads worker threads, which then
+          run the Flask app to completion (a sync server with that many workers)
+    asgi  each request is a call into asgi.application, whose coroutines hold
+          the request and borrow I/O threads only for SQL (see asgi.py)
+
+Both run in this process without sockets, so the numbers compare the
+serving models, not HTTP parsing. For each mode it prints throughput, latency
+percentiles per request, responses by status, peak thread count and RSS.
+--think-ms adds a pause between a student's requests, which is where held
+connections pile up.
+
+    cd backend/src/routes && python ../benchmarks/async_serving.py --students 1000 --threads 16
+
+Without --database a fresh database is seeded first; its shared password is
+hashed with --hash-method, which the app then uses too, so logins measure
+the serving path rather than pbkdf2's cost.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'routes'))
+
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+from user_management import app
+from db import close_pools
+from seed_data import seed, counts_for, PASSWORD
+from load_test import Context, auth, percentile, rss_mb
+
+MODES = ('wsgi', 'asgi')
+DEFAULT_HASH_METHOD = 'pbkdf2:sha256:1000'
+RETRY_DELAY = 0.05
+
+# --- Transports ---
+async def asgi_request(application, method, path, headers=None, body=None):
+    """One in-process request to an ASGI app; returns (status, lower-cased headers, body bytes)."""
+    path, _, query = path.partition('?')
+    payload = json.dumps(body).encode() if body is not None else b''
+    raw_headers = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in (headers or {}).items()]
+    if body is not None:
+        raw_headers += [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode())]
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method, 'scheme': 'http',
+             'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '',
+             'headers': raw_headers, 'client': ('127.0.0.1', 0), 'server': ('localhost', 80)}
+    received = False
+    async def receive():
+        nonlocal received
+        if received:
+            return {'type': 'http.disconnect'}
+        received = True
+        return {'type': 'http.request', 'body': payload, 'more_body': False}
+    response = {'status': None, 'headers': {}, 'body': []}
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+            response['headers'] = {k.decode('latin-1'): v.decode('latin-1') for k, v in message.get('headers', [])}
+        elif message['type'] == 'http.response.body':
+            response['body'].append(message.get('body', b''))
+    await application(scope, receive, send)
+    return response['status'], response['headers'], b''.join(response['body'])
+
+def wsgi_request(method, path, headers, body):
+    environ = EnvironBuilder(path=path, method=method, headers=headers, json=body).get_environ()
+    app_iter, status, response_headers = run_wsgi_app(app, environ)
+    try:
+        content = b''.join(app_iter)
+    finally:
+        if hasattr(app_iter, 'close'):
+            app_iter.close()
+    return int(status.split(' ', 1)[0]), {k.lower(): v for k, v in response_headers}, content
+
+class WsgiServer:
+    name = 'wsgi'
+
+    def __init__(self, threads):
+        self.workers = ThreadPoolExecutor(threads, thread_name_prefix='wsgi-worker')
+
+    async def request(self, method, path, headers=None, body=None):
+        return await asyncio.get_running_loop().run_in_executor(self.workers, wsgi_request, method, path, headers, body)
+
+    def close(self):
+        self.workers.shutdown(wait=True)
+
+class AsgiServer:
+    name = 'asgi'
+
+    def __init__(self, threads):
+        from asgi import create_asgi_app
+        self.application = create_asgi_app(app)
+
+    async def request(self, method, path, headers=None, body=None):
+        return await asgi_request(self.application, method, path, headers, body)
+
+    def close(self):
+        self.application.close()
+
+# --- The exam ---
+async def student(server, ctx, uid, test_id, think, latencies, statuses):
+    async def call(method, path, headers=None, body=None):
+        while True:
+            started = time.perf_counter()
+            status, response_headers, content = await server.request(method, path, headers, body)
+            latencies.append(time.perf_counter() - started)
+            statuses[status] += 1
+            if status not in (429, 503):
+                return status, content
+            # Shed load the way a client would see it: back off and retry
+            await asyncio.sleep(float(response_headers.get('retry-after', RETRY_DELAY)) if status == 429 else RETRY_DELAY)
+    async def pause():
+        if think:
+            await asyncio.sleep(think)
+    status, content = await call('POST', '/auth/login', body={'email': f'user{uid}@bench.test', 'password': PASSWORD})
+    if status != 200:
+        return
+    headers = auth(json.loads(content)['token'])
+    await pause()
+    await call('POST', f'/api/v1/tests/{test_id}/start', headers, {})
+    for revision, qid in enumerate(ctx.paper, 1):
+        await pause()
+        await call('POST', f'/api/v1/tests/{test_id}/answer', headers, ctx.answer(qid, revision))
+    await pause()
+    await call('POST', f'/api/v1/tests/{test_id}/submit', headers, {})
+
+async def exam(server, ctx, test_id, think):
+    latencies, statuses = [], Counter()
+    peak = {'threads': threading.active_count()}
+    done = asyncio.Event()
+    async def watch_threads():
+        while not done.is_set():
+            peak['threads'] = max(peak['threads'], threading.active_count())
+            await asyncio.sleep(0.05)
+    watcher = asyncio.create_task(watch_threads())
+    started = time.perf_counter()
+    await asyncio.gather(*(student(server, ctx, uid, test_id, think, latencies, statuses) for uid, _ in ctx.students))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await watcher
+    latencies.sort()
+    served = sum(n for status, n in statuses.items() if status not in (429, 503))
+    return {
+        'mode': server.name,
+        'students': len(ctx.students),
+        'requests': len(latencies),
+        'seconds': round(elapsed, 3),
+        # Refused requests (429/503, retried by the student) are not throughput
+        'throughput_rps': round(served / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'statuses': dict(sorted(statuses.items())),
+        'peak_threads': peak['threads'],
+        'rss_mb': round(rss_mb()[0] or 0, 1) or None,
+    }
+
+def run_mode(mode, ctx, threads, think):
+    server = (AsgiServer if mode == 'asgi' else WsgiServer)(threads)
+    try:
+        return asyncio.run(exam(server, ctx, ctx.live_test(), think))
+    finally:
+        server.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', help='seeded SQLite database to run against (default: seed a fresh one)')
+    parser.add_argument('--scale', type=float, default=0.02, help='seed volume when --database is not given')
+    parser.add_argument('--students', type=int, default=1000, help='concurrent virtual students')
+    parser.add_argument('--threads', type=int, default=16, help='WSGI worker threads')
+    parser.add_argument('--think-ms', type=float, default=0, help="pause between a student's requests")
+    parser.add_argument('--hash-method', default=DEFAULT_HASH_METHOD, help='PASSWORD_HASH_METHOD of the seeded users')
+    parser.add_argument('--mode', action='append', choices=MODES, help='run only these (repeatable)')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    database = args.database
+    if database is None:
+        database = os.path.join(tempfile.mkdtemp(), 'async.db')
+        counts = counts_for(args.scale)
+        counts['users'] = max(counts['users'], args.students * 102 // 100 + 2)
+        written = seed(database, hash_method=args.hash_method, **counts)
+        print(f'seeded {sum(written.values()):,} rows', file=sys.stderr)
+    app.config.update(DATABASE=database, JOB_WORKERS=0, DB_POOL_SIZE=args.threads + 4, TESTING=False,
+                      PASSWORD_HASH_METHOD=args.hash_method)
+    with app.app_context():
+        from user_management import init_db
+        init_db()
+    ctx = Context(args.students)
+    results = []
+    try:
+        for mode in args.mode or MODES:
+            results.append(run_mode(mode, ctx, args.threads, args.think_ms / 1000))
+    finally:
+        close_pools()
+    if args.json:
+        print(json.dumps({'threads': args.threads, 'results': results}, indent=2))
+        return
+    print(f"{'mode':<6} {'students':>8} {'requests':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'threads':>7} {'rss MB':>7}  statuses")
+    for r in results:
+        print(f"{r['mode']:<6} {r['students']:>8} {r['requests']:>8} {r['throughput_rps']:>8} {r['p50_ms']:>8} "
+              f"{r['p95_ms']:>8} {r['p99_ms']:>8} {r['peak_threads']:>7} {r['rss_mb'] or '-':>7}  {r['statuses']}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Per-request authentication overhead, with and without the verified-token cache.
+
+Measures verify_token() on its own and a minimal protected request
+(GET /admin/db/pool) end to end, first with AUTH_TOKEN_CACHE_SIZE=0 (every
+request decodes and verifies the JWT, as before the cache) and then with the
+cache on, and prints microseconds per call for each.
+
+    cd backend/src/routes && python ../benchmarks/auth_overhead.py --calls 20000
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'routes'))
+
+from user_management import app, init_db, generate_jwt
+from auth import verify_token, token_cache
+from db import close_pools
+
+def per_call(fn, calls):
+    started = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - started) / calls * 1e6
+
+def measure(calls, cache_size, token):
+    app.config['AUTH_TOKEN_CACHE_SIZE'] = cache_size
+    token_cache.clear()
+    headers = {'Authorization': f'Bearer {token}'}
+    with app.test_request_context():
+        verify = per_call(lambda: verify_token(token), calls)
+    with app.test_client() as client:
+        request = per_call(lambda: client.get('/admin/db/pool', headers=headers), max(1, calls // 10))
+    return verify, request
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=20000)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+    app.config.update(DATABASE=os.path.join(tempfile.mkdtemp(), 'auth.db'), JOB_WORKERS=0)
+    with app.app_context():
+        init_db()
+        token = generate_jwt({'id': 1, 'role': 'admin'})
+    results = {}
+    for label, cache_size in (('uncached', 0), ('cached', 10000)):
+        results[label] = measure(args.calls, cache_size, token)
+        print(f'{label:>9}: verify_token {results[label][0]:8.2f} us/call, protected request {results[label][1]:8.2f} us/request')
+    saved = results['uncached'][0] - results['cached'][0]
+    print(f'cache saves {saved:.2f} us of auth per request ({results["uncached"][0] / results["cached"][0]:.1f}x faster verification)')
+    close_pools()
+
+if __name__ == '__main__':
+    main()
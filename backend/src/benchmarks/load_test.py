@@ -0,0 +1,378 @@
+"""End-to-end load test: latency percentiles, queries per request and RSS per scenario.
+
+Drives the app through the traffic an exam day produces, with one thread per
+concurrent client and every virtual student holding its own token:
+
+    exam_start         students open the paper and start their attempt
+    autosave_storm     every student autosaves every answer
+    submit_burst       every student submits at the same moment
+    dashboard_polling  students and teachers poll test lists, results and analytics
+
+--driver client calls the app through Flask's test client in this process;
+--driver server runs it behind a threaded local WSGI server and talks HTTP, so
+request parsing and the socket layer are included. Each scenario reports
+p50/p95/p99 latency, throughput, SQL statements per request (counted on pooled
+connections) and the process RSS after it ran.
+
+Results can be stored as a baseline (benchmarks/baselines.json, keyed by
+driver and scenario) and later runs checked against it; --check exits 1 if
+latency, statements per request or RSS regressed beyond --tolerance.
+Latency and RSS baselines are only comparable on the machine that recorded
+them; statements per request are comparable anywhere.
+
+    cd backend/src/routes && python ../benchmarks/seed_data.py /tmp/bench.db --scale 0.05
+    python ../benchmarks/load_test.py --database /tmp/bench.db --driver server --students 500 --threads 32
+    python ../benchmarks/load_test.py --save-baseline
+    python ../benchmarks/load_test.py --check
+
+Without --database a fresh database is seeded at --scale (0.01) first. Write
+scenarios create their own test over a seeded paper, so a seeded database can
+be reused across runs.
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'routes'))
+
+from user_management import app, generate_jwt
+from db import ConnectionPool, close_pools
+from seed_data import seed, counts_for
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SCENARIOS = ('exam_start', 'autosave_storm', 'submit_burst', 'dashboard_polling')
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+DEFAULT_TOLERANCE = 0.5
+QUERY_TOLERANCE = 1.1
+
+# --- Measurement ---
+class QueryCounter:
+    """Counts statements run on pooled connections, from any thread."""
+
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def hit(self, sql):
+        with self._lock:
+            self.count += 1
+
+    def install(self):
+        # Pools clear the trace callback on release, so set it on every acquire
+        acquire = ConnectionPool.acquire
+        counter = self
+        def counted_acquire(pool):
+            db = acquire(pool)
+            db.set_trace_callback(counter.hit)
+            return db
+        ConnectionPool.acquire = counted_acquire
+
+def rss_mb():
+    """(current, peak) resident set size in MB; current is None off Linux."""
+    current = None
+    try:
+        with open('/proc/self/statm') as f:
+            current = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        pass
+    peak = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+    return current, peak
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+# --- Drivers ---
+class ClientDriver:
+    """In-process requests through Flask's test client."""
+    name = 'client'
+
+    def session(self):
+        return app.test_client()
+
+    def request(self, session, method, path, headers, body):
+        resp = session.open(path, method=method, headers=headers, json=body)
+        resp.get_data()
+        return resp.status_code
+
+    def close_session(self, session):
+        pass
+
+    def stop(self):
+        pass
+
+class ServerDriver:
+    """HTTP/1.1 keep-alive requests to the app on a threaded local WSGI server."""
+    name = 'server'
+
+    def __init__(self):
+        from werkzeug.serving import make_server
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.port = self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def session(self):
+        return http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+
+    def request(self, session, method, path, headers, body):
+        headers = dict(headers)
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        try:
+            session.request(method, path, body=payload, headers=headers)
+            resp = session.getresponse()
+        except (http.client.HTTPException, OSError):
+            # The server closed the kept-alive connection; retry once on a new one
+            session.close()
+            session.request(method, path, body=payload, headers=headers)
+            resp = session.getresponse()
+        resp.read()
+        return resp.status
+
+    def close_session(self, session):
+        session.close()
+
+    def stop(self):
+        self.server.shutdown()
+
+# --- Scenarios ---
+def auth(token):
+    return {'Authorization': f'Bearer {token}'}
+
+class Context:
+    """Tokens, a seeded paper with its answer options, and helpers shared by the scenarios."""
+
+    def __init__(self, students):
+        with app.app_context():
+            from user_management import get_db
+            db = get_db()
+            self.admin = generate_jwt({'id': 1, 'role': 'admin'})
+            teachers = [r[0] for r in db.execute("SELECT id FROM users WHERE role = 'teacher' ORDER BY id LIMIT 20")]
+            self.teachers = [generate_jwt({'id': uid, 'role': 'teacher'}) for uid in teachers or [1]]
+            ids = [r[0] for r in db.execute("SELECT id FROM users WHERE role = 'student' ORDER BY id LIMIT ?", (students,))]
+            self.students = [(uid, generate_jwt({'id': uid, 'role': 'student'})) for uid in ids]
+            # The busiest seeded test stands in for the one teachers watch
+            self.watched_test = db.execute('SELECT test_id FROM test_stats ORDER BY attempts DESC, test_id LIMIT 1').fetchone()[0]
+            self.paper = [r[0] for r in db.execute('SELECT question_id FROM test_questions WHERE test_id = ?'
+                                                   ' ORDER BY question_order', (self.watched_test,))]
+            options = {}
+            for r in db.execute(f"SELECT id, question_id FROM question_options WHERE question_id IN "
+                                f"({', '.join('?' * len(self.paper))}) ORDER BY id", self.paper):
+                options.setdefault(r[1], []).append(r[0])
+            self.options = options
+
+    def live_test(self):
+        """A new test over the seeded paper, assigned to every student in the run."""
+        with app.test_client() as client:
+            test_id = client.post('/api/v1/tests', headers=auth(self.admin), json={
+                'name': f'Load test {time.time()}', 'duration_minutes': 60, 'question_ids': self.paper}).get_json()['id']
+            client.post(f'/api/v1/tests/{test_id}/assign', headers=auth(self.admin),
+                        json={'user_ids': [uid for uid, _ in self.students]})
+        return test_id
+
+    def answer(self, question_id, revision):
+        options = self.options.get(question_id)
+        if options:
+            return {'question_id': question_id, 'selected_option_ids': [options[revision % len(options)]], 'revision': revision}
+        return {'question_id': question_id, 'answer_text': f'answer {revision}', 'revision': revision}
+
+def exam_start(ctx):
+    test_id = ctx.live_test()
+    return [[('GET', f'/api/v1/tests/{test_id}', auth(token), None),
+             ('GET', f'/api/v1/tests/{test_id}/questions', auth(token), None),
+             ('POST', f'/api/v1/tests/{test_id}/start', auth(token), {})] for _, token in ctx.students]
+
+def autosave_storm(ctx):
+    test_id = ctx.live_test()
+    return [[('POST', f'/api/v1/tests/{test_id}/answer', auth(token), ctx.answer(qid, 1)) for qid in ctx.paper]
+            for _, token in ctx.students]
+
+def submit_burst(ctx):
+    test_id = ctx.live_test()
+    # Untimed: every student has an open attempt with answers saved
+    with app.test_client() as client:
+        for _, token in ctx.students:
+            client.post(f'/api/v1/tests/{test_id}/start', headers=auth(token), json={})
+            for qid in ctx.paper[:5]:
+                client.post(f'/api/v1/tests/{test_id}/answer', headers=auth(token), json=ctx.answer(qid, 1))
+    return [[('POST', f'/api/v1/tests/{test_id}/submit', auth(token), {})] for _, token in ctx.students]
+
+def dashboard_polling(ctx):
+    watched = ctx.watched_test
+    users = [[('GET', '/api/v1/tests?limit=20', auth(token), None),
+              ('GET', f'/api/v1/tests/{watched}/results', auth(token), None)] for _, token in ctx.students]
+    for token in ctx.teachers:
+        users.append([('GET', '/api/v1/tests?limit=50', auth(token), None),
+                      ('GET', f'/api/v1/tests/{watched}/analytics', auth(token), None),
+                      ('GET', f'/api/v1/tests/{watched}/results?limit=100', auth(token), None)] * 5)
+    return users
+
+SCENARIO_BUILDERS = {'exam_start': exam_start, 'autosave_storm': autosave_storm, 'submit_burst': submit_burst,
+                     'dashboard_polling': dashboard_polling}
+
+def run_scenario(name, ctx, driver, threads, counter):
+    users = SCENARIO_BUILDERS[name](ctx)
+    latencies = []
+    errors = {}
+    lock = threading.Lock()
+    start = threading.Barrier(threads + 1)
+
+    def worker(offset):
+        session = driver.session()
+        mine = []
+        failed = {}
+        start.wait()
+        for script in users[offset::threads]:
+            for method, path, headers, body in script:
+                began = time.perf_counter()
+                status = driver.request(session, method, path, headers, body)
+                mine.append(time.perf_counter() - began)
+                if status >= 400:
+                    failed[status] = failed.get(status, 0) + 1
+        driver.close_session(session)
+        with lock:
+            latencies.extend(mine)
+            for status, n in failed.items():
+                errors[status] = errors.get(status, 0) + n
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for w in workers:
+        w.start()
+    queries = counter.count
+    start.wait()
+    began = time.perf_counter()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - began
+    queries = counter.count - queries
+    latencies.sort()
+    current, peak = rss_mb()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'queries_per_request': round(queries / len(latencies), 2) if latencies else None,
+        'rss_mb': round(current, 1) if current is not None else None,
+        'peak_rss_mb': round(peak, 1) if peak is not None else None,
+    }
+
+# --- Baselines ---
+def load_baselines(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_baselines(path, baselines):
+    with open(path, 'w') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+def regressions(result, baseline, tolerance):
+    """Human-readable list of what got worse than the baseline allows."""
+    found = []
+    for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'rss_mb'):
+        old, new = baseline.get(metric), result.get(metric)
+        if old and new is not None and new > old * (1 + tolerance):
+            found.append(f'{metric} {old} -> {new}')
+    # Statement counts barely vary between runs (cache fills and group commits
+    # race a little), so they get a fixed 10% allowance whatever the tolerance
+    old, new = baseline.get('queries_per_request'), result.get('queries_per_request')
+    if old is not None and new is not None and new > old * QUERY_TOLERANCE + 0.1:
+        found.append(f'queries_per_request {old} -> {new}')
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', help='seeded SQLite database to run against (default: seed a fresh one)')
+    parser.add_argument('--scale', type=float, default=0.01, help='seed volume when --database is not given')
+    parser.add_argument('--driver', choices=('client', 'server'), default='client')
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS, help='run only these (repeatable)')
+    parser.add_argument('--students', type=int, default=200, help='concurrent virtual students')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--baselines', default=BASELINES)
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the baseline')
+    parser.add_argument('--check', action='store_true', help='exit 1 if a result regressed against the baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='allowed relative growth of latency and RSS (default 0.5 = 50%%)')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+    # Request and slow-query logging would drown the report
+    logging.disable(logging.WARNING)
+
+    database = args.database
+    if database is None:
+        database = os.path.join(tempfile.mkdtemp(), 'load.db')
+        started = time.perf_counter()
+        written = seed(database, **counts_for(args.scale))
+        print(f'seeded {sum(written.values()):,} rows in {time.perf_counter() - started:.1f}s', file=sys.stderr)
+    app.config.update(DATABASE=database, JOB_WORKERS=0, DB_POOL_SIZE=args.threads + 4, TESTING=False)
+    with app.app_context():
+        from user_management import init_db
+        init_db()
+
+    counter = QueryCounter()
+    counter.install()
+    ctx = Context(args.students)
+    driver = ServerDriver() if args.driver == 'server' else ClientDriver()
+    params = {'students': len(ctx.students), 'threads': args.threads}
+    results = {}
+    try:
+        for name in args.scenario or SCENARIOS:
+            results[name] = dict(run_scenario(name, ctx, driver, args.threads, counter), params=params)
+    finally:
+        driver.stop()
+        close_pools()
+
+    baselines = load_baselines(args.baselines)
+    stored = baselines.get(args.driver, {})
+    failed = {}
+    if args.json:
+        print(json.dumps({'driver': args.driver, 'results': results}, indent=2))
+    else:
+        print(f"{'scenario':<18} {'requests':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+              f"{'queries':>8} {'rss MB':>7}  errors")
+        for name, r in results.items():
+            print(f"{name:<18} {r['requests']:>8} {r['throughput_rps']:>8} {r['p50_ms']:>8} {r['p95_ms']:>8} "
+                  f"{r['p99_ms']:>8} {r['queries_per_request']:>8} {r['rss_mb'] or '-':>7}  {r['errors'] or ''}")
+    for name, r in results.items():
+        if name in stored:
+            if stored[name].get('params') != r['params']:
+                print(f'{name}: baseline was recorded with {stored[name].get("params")}, not comparable', file=sys.stderr)
+                continue
+            found = regressions(r, stored[name], args.tolerance)
+            if found:
+                failed[name] = found
+                print(f'{name} regressed: ' + ', '.join(found), file=sys.stderr)
+    if args.save_baseline:
+        stored.update(results)
+        baselines[args.driver] = stored
+        save_baselines(args.baselines, baselines)
+        print(f'baseline saved to {args.baselines}', file=sys.stderr)
+    if args.check and failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
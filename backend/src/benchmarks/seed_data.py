@@ -0,0 +1,220 @@
+"""Fast synthetic data generator for benchmarks and load tests.
+
+Fills a fresh database, migrated to the latest schema, with users, subjects,
+topics, a question bank with options, tests with their papers, assignments and
+submitted attempts, plus the materialized test stats those attempts imply.
+Rows are written with executemany in large transactions and explicit ids, so
+the full default volume (100k users, 500k questions, 2M attempts with about
+36M answer rows) takes minutes, not hours. --scale shrinks every count proportionally.
+
+All users share one password (--password), hashed once with
+PASSWORD_HASH_METHOD (--hash-method). User 1 is an admin; every hundredth
+user is a teacher.
+
+    cd backend/src/routes && python ../benchmarks/seed_data.py /tmp/bench.db --scale 0.1
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'routes'))
+
+from db import connect
+from migrate import migrate
+from passwords import _hash, normalize_method
+
+FULL_SCALE = {'users': 100000, 'questions': 500000, 'tests': 2000, 'attempts': 2000000}
+SUBJECTS = 10
+TOPICS_PER_SUBJECT = 10
+QUESTIONS_PER_TEST = 20
+DIFFICULTIES = ('easy', 'medium', 'hard')
+# (question_type, options, correct options); weights follow a typical bank
+QUESTION_TYPES = (('mcq_single', 4, 1), ('mcq_single', 4, 1), ('mcq_single', 4, 1), ('mcq_multiple', 4, 2),
+                  ('true_false', 2, 1), ('short_answer', 0, 0))
+BATCH = 50000
+PASSWORD = 'bench-password'
+EPOCH = datetime(2025, 1, 1)
+
+def counts_for(scale):
+    return {k: max(1, int(v * scale)) for k, v in FULL_SCALE.items()}
+
+def write(db, table, columns, rows, progress=None):
+    """executemany rows in BATCH-sized transactions; returns how many were written."""
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    written = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= BATCH:
+            db.executemany(sql, batch)
+            db.commit()
+            written += len(batch)
+            batch = []
+            if progress:
+                progress(table, written)
+    if batch:
+        db.executemany(sql, batch)
+        db.commit()
+        written += len(batch)
+    if progress:
+        progress(table, written)
+    return written
+
+def user_rows(count, password_hash):
+    for uid in range(1, count + 1):
+        role = 'admin' if uid == 1 else 'teacher' if uid % 100 == 0 else 'student'
+        created = EPOCH + timedelta(minutes=uid)
+        yield (uid, f'user{uid}@bench.test', password_hash, f'User {uid}', role, 1, created, created)
+
+def student_ids(count):
+    return [uid for uid in range(2, count + 1) if uid % 100]
+
+def question_rows(count, rng, options_out):
+    """Question rows; option rows are appended to options_out as questions are made."""
+    option_id = 0
+    for qid in range(1, count + 1):
+        qtype, n_options, n_correct = rng.choice(QUESTION_TYPES)
+        subject = rng.randint(1, SUBJECTS)
+        topic = (subject - 1) * TOPICS_PER_SUBJECT + rng.randint(1, TOPICS_PER_SUBJECT)
+        correct = set(rng.sample(range(n_options), n_correct)) if n_options else set()
+        for i in range(n_options):
+            option_id += 1
+            options_out.append((option_id, qid, f'Option {i + 1}', i in correct))
+        yield (qid, subject, topic, qtype, f'Question {qid} about topic {topic}: ' + 'lorem ipsum ' * rng.randint(3, 20),
+               rng.choice(DIFFICULTIES), f'Explanation for question {qid}', 1)
+
+def seed(db_name, users, questions, tests, attempts, seed=0, hash_method=None, password=PASSWORD, progress=None):
+    """Populate db_name and return {table: rows written}."""
+    rng = random.Random(seed)
+    db = connect(db_name, {'DB_SYNCHRONOUS': 'OFF'})
+    try:
+        migrate(db)
+        written = {}
+        password_hash = _hash(password, normalize_method(hash_method))
+        written['users'] = write(db, 'users', ('id', 'email', 'password_hash', 'name', 'role', 'is_email_verified',
+                                               'created_at', 'updated_at'), user_rows(users, password_hash), progress)
+        write(db, 'subjects', ('id', 'name'), ((s, f'Subject {s}') for s in range(1, SUBJECTS + 1)))
+        write(db, 'topics', ('id', 'subject_id', 'name'),
+              (((s - 1) * TOPICS_PER_SUBJECT + t, s, f'Topic {s}.{t}')
+               for s in range(1, SUBJECTS + 1) for t in range(1, TOPICS_PER_SUBJECT + 1)))
+
+        # Options are collected while questions stream out, then written in bulk
+        options = []
+        written['questions'] = write(db, 'questions', ('id', 'subject_id', 'topic_id', 'question_type', 'content',
+                                                       'difficulty', 'explanation', 'created_by'),
+                                     question_rows(questions, rng, options), progress)
+        written['question_options'] = write(db, 'question_options', ('id', 'question_id', 'option_text', 'is_correct'),
+                                            options, progress)
+        correct = {}
+        for option_id, qid, _, is_correct in options:
+            if is_correct:
+                correct.setdefault(qid, []).append(option_id)
+        del options
+
+        by_subject = {}
+        for r in db.execute('SELECT id, subject_id FROM questions'):
+            by_subject.setdefault(r[1], []).append(r[0])
+        papers = {}
+        test_rows = []
+        for tid in range(1, tests + 1):
+            subject = rng.randint(1, SUBJECTS)
+            pool = by_subject.get(subject) or [q for ids in by_subject.values() for q in ids]
+            papers[tid] = rng.sample(pool, min(QUESTIONS_PER_TEST, len(pool)))
+            test_rows.append((tid, f'Test {tid}', subject, 60, 1, 1, True, EPOCH + timedelta(hours=tid)))
+        written['tests'] = write(db, 'tests', ('id', 'name', 'subject_id', 'duration_minutes', 'attempt_limit',
+                                               'created_by', 'is_published', 'created_at'), test_rows, progress)
+        written['test_questions'] = write(db, 'test_questions', ('test_id', 'question_id', 'question_order'),
+                                          ((tid, qid, n) for tid, ids in papers.items() for n, qid in enumerate(ids, 1)),
+                                          progress)
+
+        # Each test is taken by a random cohort of students; one assignment per attempt
+        students = student_ids(users) or [1]
+        per_test = max(1, min(len(students), attempts // max(1, tests)))
+        cohorts = {tid: rng.sample(students, per_test) for tid in papers}
+        written['test_assignments'] = write(db, 'test_assignments', ('id', 'test_id', 'user_id', 'assigned_at', 'status'),
+                                            ((n, tid, uid, EPOCH, 'completed') for n, (tid, uid) in enumerate(
+                                                ((tid, uid) for tid, cohort in cohorts.items() for uid in cohort), 1)),
+                                            progress)
+
+        # Attempts and their answer rows are flushed together, so memory stays flat
+        attempt_sql = ('INSERT INTO test_attempts (id, assignment_id, test_id, user_id, started_at, submitted_at, score,'
+                       ' is_graded) VALUES (?, ?, ?, ?, ?, ?, ?, ?)')
+        answer_sql = ('INSERT INTO attempt_answers (id, attempt_id, question_id, selected_option_ids, answer_text, is_correct,'
+                      ' answered_at) VALUES (?, ?, ?, ?, ?, ?, ?)')
+        attempt_batch, answer_batch = [], []
+        n = answer_id = 0
+        for tid, cohort in cohorts.items():
+            paper = papers[tid]
+            for uid in cohort:
+                n += 1
+                started = EPOCH + timedelta(hours=tid, seconds=rng.randint(0, 600))
+                submitted = started + timedelta(minutes=rng.randint(5, 60))
+                score = 0
+                for qid in paper:
+                    if rng.random() < 0.9:
+                        is_correct = qid in correct and rng.random() < 0.6
+                        score += is_correct
+                        answer_id += 1
+                        answer_batch.append((answer_id, n, qid, json.dumps(correct[qid][:1] if is_correct else []),
+                                             None, is_correct, submitted))
+                attempt_batch.append((n, n, tid, uid, started, submitted, score, True))
+                if len(answer_batch) >= BATCH:
+                    db.executemany(attempt_sql, attempt_batch)
+                    db.executemany(answer_sql, answer_batch)
+                    db.commit()
+                    attempt_batch, answer_batch = [], []
+                    if progress:
+                        progress('test_attempts', n)
+        db.executemany(attempt_sql, attempt_batch)
+        db.executemany(answer_sql, answer_batch)
+        db.commit()
+        written['test_attempts'] = n
+        written['attempt_answers'] = answer_id
+        if progress:
+            progress('test_attempts', n)
+
+        # What the analytics writer would have accumulated for these attempts
+        now = datetime.utcnow()
+        db.execute('INSERT INTO test_stats (test_id, attempts, score_sum, updated_at)'
+                   ' SELECT test_id, COUNT(*), SUM(score), ? FROM test_attempts GROUP BY test_id', (now,))
+        db.execute('INSERT INTO test_score_histogram (test_id, score, attempts)'
+                   ' SELECT test_id, CAST(ROUND(score) AS INTEGER), COUNT(*) FROM test_attempts'
+                   ' GROUP BY test_id, CAST(ROUND(score) AS INTEGER)')
+        db.commit()
+        db.execute('ANALYZE')
+        db.commit()
+        return written
+    finally:
+        db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('database', help='SQLite file to create (must not exist)')
+    parser.add_argument('--scale', type=float, default=1.0, help='fraction of the full volume')
+    for name in FULL_SCALE:
+        parser.add_argument(f'--{name}', type=int, help=f'override the {name} count')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--password', default=PASSWORD)
+    parser.add_argument('--hash-method', default=None, help='PASSWORD_HASH_METHOD for the shared password')
+    args = parser.parse_args()
+    if os.path.exists(args.database):
+        parser.error(f'{args.database} already exists')
+    counts = counts_for(args.scale)
+    counts.update({k: getattr(args, k) for k in FULL_SCALE if getattr(args, k) is not None})
+    started = time.perf_counter()
+    def progress(table, rows):
+        print(f'\r{table:>18}: {rows:>10,} rows  ({time.perf_counter() - started:6.1f}s)', end='', flush=True)
+    written = seed(args.database, seed=args.seed, hash_method=args.hash_method, password=args.password,
+                   progress=progress, **counts)
+    print()
+    elapsed = time.perf_counter() - started
+    total = sum(written.values())
+    print(f'{total:,} rows in {elapsed:.1f}s ({total / elapsed:,.0f} rows/s): '
+          + ', '.join(f'{k} {v:,}' for k, v in written.items()))
+
+if __name__ == '__main__':
+    main()
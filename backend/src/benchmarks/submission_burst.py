@@ -0,0 +1,82 @@
+"""Exam-end submission burst: many students POST /attempt at once.
+
+Runs the burst against a fresh SQLite database twice, once with direct
+per-request commits and once through the write-behind submission buffer,
+and prints sustained submissions per second for each.
+
+    cd backend/src/routes && python ../benchmarks/submission_burst.py --students 2000 --threads 32
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'routes'))
+
+from user_management import app, init_db, generate_jwt
+import test_management
+from submissions import SubmissionBuffer
+from db import close_pools
+
+def make_paper(client, headers, questions):
+    ids = []
+    for i in range(questions):
+        q = client.post('/api/v1/questions', headers=headers, json={
+            'subject_id': 1, 'topic_id': 1, 'question_type': 'mcq_single', 'content': f'Q{i}', 'difficulty': 'easy',
+            'explanation': '', 'options': [{'option_text': 'right', 'is_correct': True}, {'option_text': 'wrong'}]}).get_json()
+        ids.append((q['id'], q['options'][0]['id']))
+    test_id = client.post('/api/v1/tests', headers=headers, json={
+        'name': 'Burst', 'duration_minutes': 60, 'question_ids': [qid for qid, _ in ids]}).get_json()['id']
+    return test_id, [{'question_id': qid, 'selected_option_ids': [right]} for qid, right in ids]
+
+def burst(students, threads, questions, write_behind):
+    workdir = tempfile.mkdtemp()
+    app.config.update(DATABASE=os.path.join(workdir, 'burst.db'), SUBMISSION_WRITE_BEHIND=write_behind,
+                      DB_POOL_SIZE=threads, JOB_WORKERS=0)
+    test_management.submission_buffer = SubmissionBuffer()
+    with app.app_context():
+        init_db()
+        admin = {'Authorization': f"Bearer {generate_jwt({'id': 1, 'role': 'admin'})}"}
+        tokens = [generate_jwt({'id': 1000 + i, 'role': 'student'}) for i in range(students)]
+    with app.test_client() as client:
+        test_id, answers = make_paper(client, admin, questions)
+    failures = []
+    def run(offset):
+        with app.test_client() as c:
+            for token in tokens[offset::threads]:
+                resp = c.post(f'/api/v1/tests/{test_id}/attempt', headers={'Authorization': f'Bearer {token}'},
+                              json={'answers': answers})
+                if resp.status_code not in (200, 202):
+                    failures.append(resp.status_code)
+    workers = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    acked = time.perf_counter() - started
+    buffer = test_management.submission_buffer
+    buffer.stop()
+    committed = time.perf_counter() - started
+    close_pools()
+    return acked, committed, failures, buffer.batches
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--students', type=int, default=1000)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--questions', type=int, default=20)
+    args = parser.parse_args()
+    # Request/response debug logging would drown the report
+    logging.disable(logging.INFO)
+    for write_behind in (False, True):
+        acked, committed, failures, batches = burst(args.students, args.threads, args.questions, write_behind)
+        mode = 'write-behind' if write_behind else 'direct'
+        print(f'{mode:>12}: {args.students / acked:8.0f} acks/s, {args.students / committed:8.0f} committed/s, '
+              f'{len(failures)} failed' + (f', {batches} batches' if write_behind else ''))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+# Bring databases created from the baseline in line with what the routes write.
+
+SERIAL_TABLES = ('tests', 'questions', 'question_options', 'test_assignments', 'test_attempts', 'attempt_answers')
+
+ATTEMPT_COLUMNS = (
+    ('test_id', 'INTEGER REFERENCES tests(id) ON DELETE CASCADE'),
+    ('user_id', 'INTEGER REFERENCES users(id) ON DELETE CASCADE'),
+    ('answers', 'TEXT'),
+)
+
+def columns(db, backend, table):
+    if backend.name == 'sqlite':
+        return {r['name'] for r in db.execute(f'PRAGMA table_info({table})')}
+    rows = db.execute('SELECT column_name FROM information_schema.columns WHERE table_name = ?', (table,))
+    return {r[0] for r in rows}
+
+def upgrade(db, backend):
+    existing = columns(db, backend, 'test_attempts')
+    for name, ddl in ATTEMPT_COLUMNS:
+        if name not in existing:
+            db.execute(f'ALTER TABLE test_attempts ADD COLUMN {name} {ddl}')
+    if backend.name == 'sqlite':
+        # "id SERIAL" is not a rowid alias in SQLite; rows written before the
+        # storage layer filled ids in may still have NULL ids.
+        for table in SERIAL_TABLES:
+            db.execute(f'UPDATE {table} SET id = rowid WHERE id IS NULL')
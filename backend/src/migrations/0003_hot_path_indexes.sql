@@ -0,0 +1,23 @@
+-- Secondary indexes for the queries behind the list, paper and attempt endpoints
+
+-- test papers by question (invalidation, usage checks); test_id lookups use the primary key
+CREATE INDEX IF NOT EXISTS idx_test_questions_question ON test_questions(question_id);
+
+-- option hydration: WHERE question_id IN (...) ORDER BY question_id, id
+CREATE INDEX IF NOT EXISTS idx_question_options_question ON question_options(question_id, id);
+
+-- student test list and assignment checks
+CREATE INDEX IF NOT EXISTS idx_test_assignments_user ON test_assignments(user_id, test_id);
+CREATE INDEX IF NOT EXISTS idx_test_assignments_test ON test_assignments(test_id);
+
+-- attempt lookup per student and results per test
+CREATE INDEX IF NOT EXISTS idx_test_attempts_test_user ON test_attempts(test_id, user_id);
+
+-- question bank filters
+CREATE INDEX IF NOT EXISTS idx_questions_filters ON questions(subject_id, topic_id, difficulty, question_type);
+
+-- answers per attempt
+CREATE INDEX IF NOT EXISTS idx_attempt_answers_attempt ON attempt_answers(attempt_id, question_id);
+
+-- password reset lookups by token
+CREATE INDEX IF NOT EXISTS idx_password_resets_token ON password_resets(reset_token);
@@ -0,0 +1,29 @@
+# Full-text index over question content and explanation.
+# SQLite gets an external-content FTS5 table kept in sync by triggers, so every
+# write path (single inserts, bulk upload batches, updates, deletes) is covered.
+# PostgreSQL gets a generated tsvector column with a GIN index instead.
+
+SQLITE_STATEMENTS = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5("
+    "content, explanation, content='questions', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS questions_fts_insert AFTER INSERT ON questions BEGIN "
+    "INSERT INTO questions_fts (rowid, content, explanation) VALUES (new.rowid, new.content, new.explanation); END",
+    "CREATE TRIGGER IF NOT EXISTS questions_fts_delete AFTER DELETE ON questions BEGIN "
+    "INSERT INTO questions_fts (questions_fts, rowid, content, explanation) VALUES ('delete', old.rowid, old.content, old.explanation); END",
+    "CREATE TRIGGER IF NOT EXISTS questions_fts_update AFTER UPDATE OF content, explanation ON questions BEGIN "
+    "INSERT INTO questions_fts (questions_fts, rowid, content, explanation) VALUES ('delete', old.rowid, old.content, old.explanation); "
+    "INSERT INTO questions_fts (rowid, content, explanation) VALUES (new.rowid, new.content, new.explanation); END",
+    # Index the rows that already exist
+    "INSERT INTO questions_fts (questions_fts) VALUES ('rebuild')",
+)
+
+POSTGRES_STATEMENTS = (
+    "ALTER TABLE questions ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('simple', coalesce(content, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(explanation, '')), 'B')) STORED",
+    "CREATE INDEX IF NOT EXISTS idx_questions_search ON questions USING GIN (search_vector)",
+)
+
+def upgrade(db, backend):
+    for sql in (SQLITE_STATEMENTS if backend.name == 'sqlite' else POSTGRES_STATEMENTS):
+        db.execute(sql)
@@ -0,0 +1,35 @@
+-- Materialized per-test analytics, updated as each attempt is scored
+
+CREATE TABLE IF NOT EXISTS test_stats (
+    test_id INTEGER PRIMARY KEY REFERENCES tests(id) ON DELETE CASCADE,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    score_sum NUMERIC NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP
+);
+
+-- Score histogram; scores are bucketed to whole points
+CREATE TABLE IF NOT EXISTS test_score_histogram (
+    test_id INTEGER REFERENCES tests(id) ON DELETE CASCADE,
+    score INTEGER NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (test_id, score)
+);
+
+CREATE TABLE IF NOT EXISTS test_question_stats (
+    test_id INTEGER REFERENCES tests(id) ON DELETE CASCADE,
+    question_id INTEGER REFERENCES questions(id) ON DELETE CASCADE,
+    answered INTEGER NOT NULL DEFAULT 0,
+    graded INTEGER NOT NULL DEFAULT 0,
+    correct INTEGER NOT NULL DEFAULT 0,
+    time_seconds_sum NUMERIC NOT NULL DEFAULT 0,
+    PRIMARY KEY (test_id, question_id)
+);
+
+-- How often each option was picked, correct or not (distractor analysis)
+CREATE TABLE IF NOT EXISTS test_option_stats (
+    test_id INTEGER REFERENCES tests(id) ON DELETE CASCADE,
+    question_id INTEGER REFERENCES questions(id) ON DELETE CASCADE,
+    option_id INTEGER REFERENCES question_options(id) ON DELETE CASCADE,
+    picks INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (test_id, option_id)
+);
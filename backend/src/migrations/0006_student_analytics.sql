@@ -0,0 +1,5 @@
+-- One analytics row per (user, subject, topic); NULL subject/topic count as their own group
+CREATE UNIQUE INDEX IF NOT EXISTS idx_analytics_user_topic ON analytics(user_id, COALESCE(subject_id, 0), COALESCE(topic_id, 0));
+
+-- A student's attempts across tests, newest first (progress over time)
+CREATE INDEX IF NOT EXISTS idx_test_attempts_user_submitted ON test_attempts(user_id, submitted_at);
@@ -0,0 +1,8 @@
+-- Per-answer autosave: one row per question of an attempt, upserted as the student works
+
+ALTER TABLE attempt_answers ADD COLUMN flagged BOOLEAN DEFAULT FALSE;
+
+-- Client-side save counter; an upsert never replaces a newer revision
+ALTER TABLE attempt_answers ADD COLUMN revision INTEGER DEFAULT 0;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_attempt_answers_question ON attempt_answers(attempt_id, question_id);
@@ -0,0 +1,7 @@
+-- Canonical paper order: tests created before question_order was filled in
+-- keep their previous (question id) order
+
+UPDATE test_questions SET question_order = (
+    SELECT COUNT(*) FROM test_questions earlier
+    WHERE earlier.test_id = test_questions.test_id AND earlier.question_id < test_questions.question_id
+) WHERE question_order IS NULL;
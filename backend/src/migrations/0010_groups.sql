@@ -0,0 +1,31 @@
+-- Student groups, and one assignment per (test, student) so cohort assignment can skip existing ones
+
+CREATE TABLE IF NOT EXISTS student_groups (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(255) NOT NULL,
+    created_by INTEGER REFERENCES users(id) ON DELETE SET NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS group_members (
+    group_id INTEGER REFERENCES student_groups(id) ON DELETE CASCADE,
+    user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (group_id, user_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_group_members_user ON group_members(user_id);
+
+-- Earlier assign calls could insert the same student twice; keep the first assignment
+UPDATE test_attempts SET assignment_id = (
+    SELECT MIN(d.id) FROM test_assignments a
+    JOIN test_assignments d ON d.test_id = a.test_id AND d.user_id = a.user_id
+    WHERE a.id = test_attempts.assignment_id
+) WHERE assignment_id IS NOT NULL;
+
+DELETE FROM test_assignments WHERE id NOT IN (SELECT MIN(id) FROM test_assignments GROUP BY test_id, user_id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_test_assignments_unique ON test_assignments(test_id, user_id);
+
+-- Covered by the unique index
+DROP INDEX IF EXISTS idx_test_assignments_test;
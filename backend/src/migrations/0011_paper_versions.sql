@@ -0,0 +1,4 @@
+-- Bumped by every edit that changes a test's paper, so each worker process
+-- can tell its cached copy is stale
+
+ALTER TABLE tests ADD COLUMN paper_version INTEGER DEFAULT 0;
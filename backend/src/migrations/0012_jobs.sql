@@ -0,0 +1,23 @@
+-- Background jobs (bulk uploads, assignments, exports) run by the in-process worker pool
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id SERIAL PRIMARY KEY,
+    kind VARCHAR(50) NOT NULL,
+    status VARCHAR(20) CHECK (status IN ('queued', 'running', 'succeeded', 'failed', 'cancelled')) DEFAULT 'queued',
+    payload TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    progress_done INTEGER DEFAULT 0,
+    progress_total INTEGER,
+    attempts INTEGER DEFAULT 0,
+    max_attempts INTEGER DEFAULT 3,
+    cancel_requested INTEGER DEFAULT 0,
+    worker_pid INTEGER,
+    created_by INTEGER REFERENCES users(id) ON DELETE SET NULL,
+    created_at TIMESTAMP NOT NULL,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+
+-- Queue claim: WHERE status = 'queued' ORDER BY id
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id);
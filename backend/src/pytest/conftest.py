@@ -0,0 +1,67 @@
+import pytest
+from user_management import app, init_db, generate_jwt
+from db import close_pools
+import jobs
+
+# --- Shared fixtures ---
+# Every app.config change goes through monkeypatch, so no test leaks settings
+# into the next one. A module opts into a fresh migrated database per test
+# with its own autouse setup_db fixture that requests `database`.
+
+@pytest.fixture
+def app_config(monkeypatch):
+    """app.config for one test: TESTING on, a known SECRET_KEY and no job workers; further changes are undone afterwards too."""
+    monkeypatch.setitem(app.config, 'TESTING', True)
+    monkeypatch.setitem(app.config, 'SECRET_KEY', 'test_secret')
+    # Jobs are run explicitly with run_next_job() unless a test starts its own pool
+    monkeypatch.setitem(app.config, 'JOB_WORKERS', 0)
+    monkeypatch.setattr(jobs, '_pool', None)
+    return app.config
+
+@pytest.fixture
+def database(monkeypatch, tmp_path, app_config):
+    """Path of an empty, fully migrated SQLite database that the app uses for this test."""
+    path = str(tmp_path / 'test.db')
+    monkeypatch.setitem(app_config, 'DATABASE', path)
+    with app.app_context():
+        init_db()
+    yield path
+    close_pools()
+
+@pytest.fixture
+def client():
+    with app.test_client() as client:
+        yield client
+
+def make_headers(user_id, role):
+    with app.app_context():
+        token = generate_jwt({'id': user_id, 'role': role})
+    return {'Authorization': f'Bearer {token}'}
+
+@pytest.fixture
+def headers_for(app_config):
+    """headers_for(user_id, role='student') -> Authorization header for a token signed with the test secret."""
+    return lambda user_id, role='student': make_headers(user_id, role)
+
+@pytest.fixture
+def admin_headers(headers_for):
+    return headers_for(1, 'admin')
+
+@pytest.fixture
+def student(headers_for):
+    return headers_for(10)
+
+# Question bodies given to make_paper are laid over this one
+PAPER_QUESTION = {'subject_id': 1, 'topic_id': 1, 'question_type': 'mcq_single', 'content': 'Q', 'difficulty': 'easy',
+                  'explanation': '', 'options': [{'option_text': 'right', 'is_correct': True}, {'option_text': 'wrong'}]}
+
+@pytest.fixture
+def make_paper(client, admin_headers):
+    """make_paper(*questions, name='Paper') -> (test_id, created questions) for a test made of the given question bodies."""
+    def make(*questions, name='Paper'):
+        created = [client.post('/api/v1/questions', headers=admin_headers, json=dict(PAPER_QUESTION, **q)).get_json()
+                   for q in questions or [{}]]
+        test_id = client.post('/api/v1/tests', headers=admin_headers, json={
+            'name': name, 'duration_minutes': 30, 'question_ids': [q['id'] for q in created]}).get_json()['id']
+        return test_id, created
+    return make
@@ -0,0 +1,109 @@
+import asyncio
+from datetime import datetime
+import json
+import os
+import sys
+import pytest
+from user_management import app, get_db
+from passwords import hash_password
+import test_management
+from autosave import AutosaveBuffer
+from scoring import answer_keys
+import asgi
+from asgi import create_asgi_app
+from metrics import metrics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+from async_serving import asgi_request
+
+@pytest.fixture(autouse=True)
+def setup_db(monkeypatch, database):
+    monkeypatch.setitem(app.config, 'AUTOSAVE_FLUSH_INTERVAL', 0)
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_WORKERS', 0)
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000')
+    monkeypatch.setattr(test_management, 'autosave_buffer', AutosaveBuffer())
+    yield
+    answer_keys.invalidate()
+
+@pytest.fixture
+def asgi_app():
+    application = create_asgi_app(app)
+    yield application
+    application.close()
+
+def call(application, method, path, headers=None, body=None):
+    status, headers, content = asyncio.run(asgi_request(application, method, path, headers, body))
+    return status, headers, json.loads(content) if headers.get('content-type', '').startswith('application/json') else content
+
+@pytest.fixture
+def paper(make_paper):
+    test_id, [q] = make_paper(name='Async')
+    return test_id, q['id'], q['options'][0]['id']
+
+def test_test_taking_runs_on_async_routes(asgi_app, student, paper):
+    test_id, question_id, right = paper
+    assert call(asgi_app, 'POST', f'/api/v1/tests/{test_id}/start', {}, {})[0] == 401
+    status, _, started = call(asgi_app, 'POST', f'/api/v1/tests/{test_id}/start', student, {})
+    assert status == 201
+    status, _, saved = call(asgi_app, 'POST', f'/api/v1/tests/{test_id}/answer', student,
+                            {'question_id': question_id, 'selected_option_ids': [right], 'revision': 1})
+    assert status == 200 and saved['attempt_id'] == started['attempt_id']
+    assert call(asgi_app, 'POST', f'/api/v1/tests/{test_id}/answer', student, {'question_id': 'x'})[0] == 400
+    status, _, submitted = call(asgi_app, 'POST', f'/api/v1/tests/{test_id}/submit', student, {})
+    assert status == 200 and submitted['score'] == submitted['max_score'] == 1
+    assert call(asgi_app, 'POST', f'/api/v1/tests/{test_id}/start', student, {})[2] == {'message': 'Already attempted'}
+    # Counted under the Flask view's labels
+    assert 'endpoint="test_management.submit_test",method="POST",status="200"' in metrics.render()
+
+def test_login_waits_on_the_hasher_asynchronously(asgi_app):
+    with app.app_context():
+        db = get_db()
+        db.execute('INSERT INTO users (id, email, password_hash, name, role, is_email_verified, created_at, updated_at)'
+                   ' VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (5, 'student@example.com', hash_password('secret'), 'Student',
+                                                        'student', 1, datetime.utcnow(), datetime.utcnow()))
+        db.commit()
+    status, _, body = call(asgi_app, 'POST', '/auth/login', body={'email': 'student@example.com', 'password': 'secret'})
+    assert status == 200
+    status, _, profile = call(asgi_app, 'GET', '/users/profile', {'Authorization': f"Bearer {body['token']}"})
+    assert status == 200 and profile['email'] == 'student@example.com'
+    assert call(asgi_app, 'POST', '/auth/login', body={'email': 'student@example.com', 'password': 'wrong'})[0] == 401
+    assert call(asgi_app, 'POST', '/auth/login', body={})[0] == 400
+
+def test_other_routes_and_limits_go_through_the_wsgi_bridge(monkeypatch, student, admin_headers, paper):
+    test_id, _, _ = paper
+    monkeypatch.setitem(app.config, 'ASGI_ASYNC_ROUTES', False)
+    monkeypatch.setitem(app.config, 'ASGI_MAX_BODY', 64)
+    application = create_asgi_app(app)
+    try:
+        status, _, started = call(application, 'POST', f'/api/v1/tests/{test_id}/start', student, {})
+        assert status == 201 and started['test_id'] == test_id
+        status, _, tests = call(application, 'GET', '/api/v1/tests?limit=1', admin_headers)
+        assert status == 200 and [t['id'] for t in tests['items']] == [test_id]
+        assert call(application, 'POST', f'/api/v1/tests/{test_id}/answer', student, {'answer_text': 'x' * 100})[0] == 413
+    finally:
+        application.close()
+
+def test_client_leaving_mid_body_gets_no_handling(asgi_app, student, paper):
+    test_id, question_id, right = paper
+    body = json.dumps({'question_id': question_id, 'selected_option_ids': [right]}).encode()
+    messages = [{'type': 'http.request', 'body': body[:10], 'more_body': True}, {'type': 'http.disconnect'}]
+    async def receive():
+        return messages.pop(0)
+    sent = []
+    async def send(message):
+        sent.append(message)
+    scope = {'type': 'http', 'method': 'POST', 'path': f'/api/v1/tests/{test_id}/answer', 'query_string': b'',
+             'headers': [(b'authorization', student['Authorization'].encode())]}
+    asyncio.run(asgi_app(scope, receive, send))
+    assert sent == []
+    assert test_management.autosave_buffer.saves == 0
+
+def test_application_is_created_on_first_use(monkeypatch):
+    monkeypatch.setattr(asgi, '_application', None)
+    assert 'application' not in vars(asgi)
+    application = asgi.application
+    try:
+        assert isinstance(application, asgi.AsgiApp) and asgi.application is application
+    finally:
+        application.close()
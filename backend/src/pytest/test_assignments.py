@@ -0,0 +1,82 @@
+import pytest
+from user_management import app, get_db
+from assignments import group_membership
+import jobs
+
+@pytest.fixture(autouse=True)
+def setup_db(database):
+    add_users(range(2, 10))
+    yield
+    group_membership.invalidate()
+
+def add_users(user_ids, role='student'):
+    with app.app_context():
+        db = get_db()
+        db.executemany("INSERT INTO users (id, email, password_hash, role, is_email_verified, created_at, updated_at)"
+                       " VALUES (?, ?, '', ?, 1, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)",
+                       [(uid, f'user{uid}@example.com', role) for uid in user_ids])
+        db.commit()
+
+@pytest.fixture
+def test_id(client, admin_headers):
+    return client.post('/api/v1/tests', headers=admin_headers, json={'name': 'Cohort', 'duration_minutes': 30}).get_json()['id']
+
+def assignments():
+    with app.app_context():
+        return [tuple(r) for r in get_db().execute('SELECT user_id, id FROM test_assignments ORDER BY user_id')]
+
+def test_assign_users_and_groups_skips_existing(client, admin_headers, test_id):
+    group = client.post('/admin/groups', headers=admin_headers, json={'name': '10A', 'user_ids': [2, 3, 4]}).get_json()['id']
+    resp = client.post(f'/api/v1/tests/{test_id}/assign', headers=admin_headers, json={'user_ids': [1, 2], 'group_ids': [group]})
+    assert resp.status_code == 200
+    assert resp.get_json()['assigned_count'] == 4
+    # Repeating the assignment, or assigning the group again, adds no rows
+    resp = client.post(f'/api/v1/tests/{test_id}/assign', headers=admin_headers, json={'user_ids': [1, 5], 'group_ids': [group]})
+    assert (resp.get_json()['assigned_count'], resp.get_json()['already_assigned']) == (1, 4)
+    resp = client.post(f'/admin/groups/{group}/assign-test', headers=admin_headers, json={'test_id': test_id})
+    assert (resp.get_json()['assigned_count'], resp.get_json()['already_assigned']) == (0, 3)
+    rows = assignments()
+    assert [u for u, _ in rows] == [1, 2, 3, 4, 5]
+    assert all(i is not None for _, i in rows)
+    assert client.post(f'/api/v1/tests/{test_id}/assign', headers=admin_headers, json={'group_ids': [999]}).status_code == 404
+    assert client.post(f'/admin/groups/999/assign-test', headers=admin_headers, json={'test_id': test_id}).status_code == 404
+
+def test_membership_is_cached_until_members_change(client, admin_headers, test_id):
+    group = client.post('/admin/groups', headers=admin_headers, json={'name': '10B', 'user_ids': [7]}).get_json()['id']
+    client.post(f'/admin/groups/{group}/assign-test', headers=admin_headers, json={'test_id': test_id})
+    loads = group_membership.loads
+    client.post(f'/admin/groups/{group}/assign-test', headers=admin_headers, json={'test_id': test_id})
+    assert group_membership.loads == loads
+    resp = client.post(f'/admin/groups/{group}/members', headers=admin_headers, json={'user_ids': [8, 9]})
+    assert resp.get_json()['member_count'] == 3
+    client.delete(f'/admin/groups/{group}/members', headers=admin_headers, json={'user_ids': [7]})
+    resp = client.post(f'/admin/groups/{group}/assign-test', headers=admin_headers, json={'test_id': test_id})
+    assert resp.get_json()['assigned_count'] == 2
+    assert group_membership.loads == loads + 1
+    listed = client.get('/admin/groups', headers=admin_headers).get_json()['groups']
+    assert listed == [{'id': group, 'name': '10B', 'member_count': 2}]
+
+def test_groups_only_take_existing_students(client, admin_headers):
+    add_users([20], role='teacher')
+    resp = client.post('/admin/groups', headers=admin_headers, json={'name': '10C', 'user_ids': [2, 20, 404]})
+    assert resp.status_code == 400
+    assert resp.get_json()['user_ids'] == [20, 404]
+    assert client.get('/admin/groups', headers=admin_headers).get_json()['groups'] == []
+    group = client.post('/admin/groups', headers=admin_headers, json={'name': '10C', 'user_ids': [2]}).get_json()['id']
+    assert client.post(f'/admin/groups/{group}/members', headers=admin_headers, json={'user_ids': [3, 404]}).status_code == 400
+    # Removing ids that are not members is still allowed
+    resp = client.delete(f'/admin/groups/{group}/members', headers=admin_headers, json={'user_ids': [404]})
+    assert resp.status_code == 200 and resp.get_json()['member_count'] == 1
+
+def test_assign_job_can_be_retried(client, admin_headers, test_id):
+    resp = client.post(f'/api/v1/tests/{test_id}/assign?async=1', headers=admin_headers, json={'user_ids': list(range(1, 51))})
+    job_id = resp.get_json()['job_id']
+    with app.app_context():
+        jobs.run_next_job()
+    assert client.get(f'/api/v1/jobs/{job_id}', headers=admin_headers).get_json()['result']['assigned_count'] == 50
+    with app.app_context():
+        assert jobs.JOB_HANDLERS['assign_test'][1] > 1
+    client.post(f'/api/v1/jobs/{job_id}/retry', headers=admin_headers)
+    with app.app_context():
+        jobs.run_next_job()
+    assert len(assignments()) == 50
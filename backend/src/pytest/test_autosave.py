@@ -0,0 +1,115 @@
+import pytest
+from datetime import datetime
+from user_management import app, get_db
+import test_management
+import scoring
+from autosave import AutosaveBuffer
+from scoring import answer_keys
+
+@pytest.fixture(autouse=True)
+def setup_db(monkeypatch, database):
+    monkeypatch.setitem(app.config, 'AUTOSAVE_FLUSH_INTERVAL', 0)
+    monkeypatch.setattr(test_management, 'autosave_buffer', AutosaveBuffer())
+    yield
+    answer_keys.invalidate()
+
+@pytest.fixture
+def paper(make_paper):
+    test_id, questions = make_paper(*({'content': f'Q{i}'} for i in range(3)), name='Autosaved')
+    return test_id, [(q['id'], q['options'][0]['id'], q['options'][1]['id']) for q in questions]
+
+def save(client, headers, test_id, question_id, option_id, **extra):
+    return client.post(f'/api/v1/tests/{test_id}/answer', headers=headers,
+                       json=dict({'question_id': question_id, 'selected_option_ids': [option_id]}, **extra))
+
+def saved_rows(attempt_id):
+    with app.app_context():
+        rows = get_db().execute('SELECT question_id, selected_option_ids, revision FROM attempt_answers WHERE attempt_id = ? ORDER BY question_id',
+                                (attempt_id,)).fetchall()
+        return [tuple(r) for r in rows]
+
+def test_autosave_then_submit_grades_saved_answers(client, student, admin_headers, paper):
+    test_id, questions = paper
+    (q1, right1, wrong1), (q2, right2, _), _ = questions
+    started = client.post(f'/api/v1/tests/{test_id}/start', headers=student)
+    assert started.status_code == 201
+    attempt_id = started.get_json()['attempt_id']
+    assert client.post(f'/api/v1/tests/{test_id}/start', headers=student).get_json()['attempt_id'] == attempt_id
+    assert save(client, student, test_id, q1, wrong1, revision=1).status_code == 200
+    assert save(client, student, test_id, q1, right1, revision=2).status_code == 200
+    # A late retry of an older save is ignored; repeating a save changes nothing
+    assert save(client, student, test_id, q1, wrong1, revision=1).status_code == 200
+    assert save(client, student, test_id, q2, right2, flagged=True).status_code == 200
+    assert save(client, student, test_id, q2, right2, flagged=True).status_code == 200
+    assert saved_rows(attempt_id) == [(q1, f'[{right1}]', 2), (q2, f'[{right2}]', 0)]
+    resumed = client.get(f'/api/v1/tests/{test_id}/attempt', headers=student).get_json()
+    assert [a['flagged'] for a in resumed['answers']] == [False, True]
+    resp = client.post(f'/api/v1/tests/{test_id}/submit', headers=student)
+    assert resp.status_code == 200
+    assert (resp.get_json()['score'], resp.get_json()['max_score']) == (2, 3)
+    assert save(client, student, test_id, q1, wrong1, revision=3).status_code == 409
+    assert client.post(f'/api/v1/tests/{test_id}/submit', headers=student).status_code == 400
+    assert saved_rows(attempt_id)[0] == (q1, f'[{right1}]', 2)
+    stats = client.get(f'/api/v1/tests/{test_id}/analytics', headers=admin_headers).get_json()
+    assert stats['total_attempts'] == 1
+
+def test_racing_starts_share_one_attempt(monkeypatch, client, student, paper):
+    test_id, _ = paper
+    real = scoring.find_open_attempt
+    def racing(db, *args):
+        monkeypatch.setattr(scoring, 'find_open_attempt', real)
+        # Another request starts the attempt between this one's check and its insert
+        with app.app_context():
+            other = get_db()
+            other.execute('INSERT INTO test_attempts (id, test_id, user_id, started_at) VALUES (50, ?, 10, ?)', (test_id, datetime.utcnow()))
+            other.commit()
+        return None
+    monkeypatch.setattr(scoring, 'find_open_attempt', racing)
+    resp = client.post(f'/api/v1/tests/{test_id}/start', headers=student)
+    assert (resp.status_code, resp.get_json()['attempt_id']) == (200, 50)
+    with app.app_context():
+        assert get_db().execute('SELECT COUNT(*) FROM test_attempts').fetchone()[0] == 1
+
+def test_autosave_rejects_questions_and_options_outside_the_test(client, student, paper):
+    test_id, questions = paper
+    (q1, _, _), (_, right2, _), _ = questions
+    assert save(client, student, test_id, 999, right2).status_code == 400
+    assert save(client, student, test_id, q1, right2).status_code == 400
+    assert client.post(f'/api/v1/tests/{test_id}/answer', headers=student, json={'question_id': q1, 'revision': 'x'}).status_code == 400
+
+def test_rapid_saves_are_coalesced_into_one_batch(monkeypatch, client, student, paper):
+    monkeypatch.setitem(app.config, 'AUTOSAVE_FLUSH_INTERVAL', 60)
+    buffer = test_management.autosave_buffer
+    test_id, questions = paper
+    for revision in range(10):
+        for qid, right, wrong in questions:
+            resp = save(client, student, test_id, qid, right if revision % 2 else wrong, revision=revision)
+            # Accepted, not yet in the database
+            assert resp.status_code == 202
+    assert buffer.saves == 30
+    assert buffer.pending_count() == 3
+    attempt_id = client.post(f'/api/v1/tests/{test_id}/start', headers=student).get_json()['attempt_id']
+    assert saved_rows(attempt_id) == []
+    buffer.flush()
+    assert (buffer.writes, buffer.flushes) == (3, 1)
+    assert [r[2] for r in saved_rows(attempt_id)] == [9, 9, 9]
+
+def test_submit_writes_pending_saves_first(monkeypatch, client, student, paper):
+    monkeypatch.setitem(app.config, 'AUTOSAVE_FLUSH_INTERVAL', 60)
+    test_id, questions = paper
+    for qid, right, _ in questions:
+        save(client, student, test_id, qid, right)
+    resp = client.post(f'/api/v1/tests/{test_id}/submit', headers=student)
+    assert resp.get_json()['score'] == 3
+    assert test_management.autosave_buffer.pending_count() == 0
+
+def test_full_submit_merges_with_autosaved_answers(client, student, paper):
+    test_id, questions = paper
+    (q1, right1, _), (q2, _, wrong2), (q3, right3, _) = questions
+    save(client, student, test_id, q1, right1)
+    save(client, student, test_id, q2, wrong2)
+    resp = client.post(f'/api/v1/tests/{test_id}/attempt', headers=student,
+                       json={'answers': [{'question_id': q3, 'selected_option_ids': [right3]}]})
+    assert resp.status_code == 200
+    assert resp.get_json()['score'] == 2
+    assert client.post(f'/api/v1/tests/{test_id}/attempt', headers=student, json={'answers': []}).status_code == 400
@@ -0,0 +1,42 @@
+import os
+import sys
+import pytest
+from user_management import app, init_db
+from db import ConnectionPool, close_pools
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+import load_test
+from seed_data import seed
+
+@pytest.fixture
+def seeded(monkeypatch, tmp_path):
+    database = str(tmp_path / 'bench.db')
+    written = seed(database, users=120, questions=300, tests=4, attempts=200)
+    monkeypatch.setitem(app.config, 'DATABASE', database)
+    monkeypatch.setitem(app.config, 'SECRET_KEY', 'test_secret')
+    monkeypatch.setitem(app.config, 'JOB_WORKERS', 0)
+    # The counter patches the pool class; put it back afterwards
+    monkeypatch.setattr(ConnectionPool, 'acquire', ConnectionPool.acquire)
+    with app.app_context():
+        init_db()
+    yield written
+    close_pools()
+
+def test_seed_writes_consistent_volumes(seeded):
+    assert seeded['users'] == 120
+    assert seeded['test_attempts'] == 4 * 50
+    assert seeded['attempt_answers'] > seeded['test_attempts']
+
+def test_scenarios_run_without_errors(seeded):
+    counter = load_test.QueryCounter()
+    counter.install()
+    ctx = load_test.Context(10)
+    driver = load_test.ClientDriver()
+    for name in load_test.SCENARIOS:
+        result = load_test.run_scenario(name, ctx, driver, 2, counter)
+        assert result['errors'] == {}, name
+        assert result['requests'] and result['p50_ms'] <= result['p99_ms']
+        assert result['queries_per_request'] > 0
+    baseline = dict(result, p95_ms=result['p95_ms'] / 10, queries_per_request=result['queries_per_request'] / 2)
+    assert [r.split()[0] for r in load_test.regressions(result, baseline, 0.5)] == ['p95_ms', 'queries_per_request']
@@ -0,0 +1,55 @@
+import pytest
+import threading
+from db import ConnectionPool, PoolTimeout, get_db, close_pools
+
+@pytest.fixture
+def db_path(tmp_path):
+    yield str(tmp_path / 'pool.db')
+    close_pools()
+
+def test_connections_use_wal_and_tuned_pragmas(db_path):
+    pool = ConnectionPool(db_path, {'DB_CACHE_SIZE_KB': 4096, 'DB_BUSY_TIMEOUT_MS': 1234})
+    db = pool.acquire()
+    assert db.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert db.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+    assert db.execute('PRAGMA cache_size').fetchone()[0] == -4096
+    assert db.execute('PRAGMA busy_timeout').fetchone()[0] == 1234
+    pool.release(db)
+    pool.close()
+
+def test_pool_reuses_connections_and_rolls_back_on_release(db_path):
+    pool = ConnectionPool(db_path)
+    db = pool.acquire()
+    db.execute('CREATE TABLE t (x INTEGER)')
+    db.commit()
+    db.execute('INSERT INTO t VALUES (1)')
+    pool.release(db)
+    again = pool.acquire()
+    assert again is db
+    assert again.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+    pool.release(again)
+    stats = pool.stats()
+    assert stats['created'] == 1 and stats['acquired'] == 2 and stats['in_use'] == 0
+    pool.close()
+
+def test_pool_is_bounded_and_times_out(db_path):
+    pool = ConnectionPool(db_path, {'DB_POOL_SIZE': 2, 'DB_POOL_TIMEOUT': 0.05})
+    held = [pool.acquire(), pool.acquire()]
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    assert pool.stats()['timeouts'] == 1
+    # A waiter is handed the connection as soon as one is released
+    got = []
+    pool.timeout = 5
+    waiter = threading.Thread(target=lambda: got.append(pool.acquire()))
+    waiter.start()
+    pool.release(held.pop())
+    waiter.join()
+    assert got and pool.stats()['size'] == 2
+    pool.close()
+
+def test_pool_stats_endpoint(client, database, admin_headers):
+    resp = client.get('/admin/db/pool', headers=admin_headers)
+    assert resp.status_code == 200
+    stats = next(p for p in resp.get_json() if p['database'] == database)
+    assert stats['in_use'] == 0 and stats['created'] >= 1
@@ -0,0 +1,127 @@
+import pytest
+import io
+import json
+import os
+import time
+from user_management import app, get_db
+import jobs
+
+@pytest.fixture(autouse=True)
+def setup_db(monkeypatch, tmp_path, database):
+    monkeypatch.setitem(app.config, 'JOB_OUTPUT_DIR', str(tmp_path / 'jobs'))
+
+def run_jobs():
+    with app.app_context():
+        while jobs.run_next_job():
+            pass
+
+def upload(client, headers, rows):
+    text = 'question_type,content,options\n' + ''.join(f'mcq_single,Q{i},A;B\n' for i in range(rows))
+    return client.post('/api/v1/questions/bulk-upload?async=1', headers=headers,
+                       data={'file': (io.BytesIO(text.encode('utf-8')), 'questions.csv')},
+                       content_type='multipart/form-data')
+
+def test_async_bulk_upload_returns_job_and_completes(client, admin_headers):
+    resp = upload(client, admin_headers, 30)
+    assert resp.status_code == 202
+    job_id = resp.get_json()['job_id']
+    assert client.get(f'/api/v1/jobs/{job_id}', headers=admin_headers).get_json()['status'] == 'queued'
+    run_jobs()
+    job = client.get(f'/api/v1/jobs/{job_id}', headers=admin_headers).get_json()
+    assert job['status'] == 'succeeded'
+    assert job['result']['success_count'] == 30
+    assert job['progress']['done'] == 30
+    with app.app_context():
+        assert get_db().execute('SELECT COUNT(*) FROM questions').fetchone()[0] == 30
+
+def test_cancel_queued_job_and_retry(client, admin_headers):
+    job_id = upload(client, admin_headers, 5).get_json()['job_id']
+    resp = client.post(f'/api/v1/jobs/{job_id}/cancel', headers=admin_headers)
+    assert resp.get_json()['status'] == 'cancelled'
+    run_jobs()
+    assert client.post(f'/api/v1/jobs/{job_id}/cancel', headers=admin_headers).status_code == 409
+    assert client.post(f'/api/v1/jobs/{job_id}/retry', headers=admin_headers).status_code == 202
+    run_jobs()
+    job = client.get(f'/api/v1/jobs/{job_id}', headers=admin_headers).get_json()
+    assert job['status'] == 'succeeded'
+    assert job['result']['success_count'] == 5
+
+def test_failed_job_is_retried_up_to_max_attempts(monkeypatch, client, admin_headers):
+    calls = []
+    def flaky(db, job):
+        calls.append(job.id)
+        if len(calls) < 3:
+            raise RuntimeError('transient')
+        return {'ok': True}
+    monkeypatch.setitem(jobs.JOB_HANDLERS, 'flaky', (flaky, 3))
+    with app.test_request_context():
+        job_id = jobs.enqueue_job(get_db(), 'flaky', {}, 1)
+    run_jobs()
+    job = client.get(f'/api/v1/jobs/{job_id}', headers=admin_headers).get_json()
+    assert job['status'] == 'succeeded'
+    assert job['attempts'] == 3
+    assert len(calls) == 3
+
+def test_worker_pool_runs_jobs_in_background(client, admin_headers):
+    job_id = upload(client, admin_headers, 10).get_json()['job_id']
+    pool = jobs.WorkerPool(app, 2)
+    pool.start()
+    try:
+        pool.wake.set()
+        deadline = time.time() + 10
+        while time.time() < deadline:
+            status = client.get(f'/api/v1/jobs/{job_id}', headers=admin_headers).get_json()['status']
+            if status == 'succeeded':
+                break
+            time.sleep(0.05)
+    finally:
+        pool.stop()
+    assert status == 'succeeded'
+
+def test_interrupted_jobs_are_requeued_only_with_attempts_left(monkeypatch, client, admin_headers):
+    monkeypatch.setitem(jobs.JOB_HANDLERS, 'flaky', (lambda db, job: {'ok': True}, 3))
+    upload_id = upload(client, admin_headers, 5).get_json()['job_id']
+    with app.test_request_context():
+        db = get_db()
+        flaky_id = jobs.enqueue_job(db, 'flaky', {}, 1)
+        # Both were running in a worker that died
+        db.execute("UPDATE jobs SET status = 'running', attempts = 1, worker_pid = NULL")
+        db.commit()
+        jobs.requeue_interrupted_jobs()
+    status = lambda job_id: client.get(f'/api/v1/jobs/{job_id}', headers=admin_headers).get_json()
+    # A half-imported upload is not run again
+    assert status(upload_id)['status'] == 'failed' and status(upload_id)['error'].startswith('Interrupted')
+    assert status(flaky_id)['status'] == 'queued'
+
+def test_jobs_left_by_a_previous_process_run_without_a_new_enqueue(monkeypatch, client, admin_headers):
+    monkeypatch.setitem(jobs.JOB_HANDLERS, 'flaky', (lambda db, job: {'ok': True}, 3))
+    queued_id = upload(client, admin_headers, 5).get_json()['job_id']
+    with app.test_request_context():
+        db = get_db()
+        running_id = jobs.enqueue_job(db, 'flaky', {}, 1)
+        db.execute("UPDATE jobs SET status = 'running', attempts = 1, worker_pid = NULL WHERE id = ?", (running_id,))
+        db.commit()
+    # The process restarts: no pool, and nothing enqueues a job
+    monkeypatch.setattr(jobs, '_pool', None)
+    monkeypatch.setitem(app.config, 'JOB_WORKERS', 1)
+    status = lambda job_id: client.get(f'/api/v1/jobs/{job_id}', headers=admin_headers).get_json()['status']
+    try:
+        deadline = time.time() + 10
+        while time.time() < deadline and {status(queued_id), status(running_id)} != {'succeeded'}:
+            time.sleep(0.05)
+    finally:
+        jobs._pool.stop()
+    assert (status(queued_id), status(running_id)) == ('succeeded', 'succeeded')
+
+def test_failed_upload_removes_its_file(monkeypatch, client, admin_headers):
+    import question_bank
+    def broken(*args, **kwargs):
+        raise RuntimeError('bad file')
+    monkeypatch.setattr(question_bank, 'import_questions', broken)
+    job_id = upload(client, admin_headers, 5).get_json()['job_id']
+    with app.app_context():
+        path = json.loads(get_db().execute('SELECT payload FROM jobs WHERE id = ?', (job_id,)).fetchone()[0])['path']
+    assert os.path.exists(path)
+    run_jobs()
+    assert client.get(f'/api/v1/jobs/{job_id}', headers=admin_headers).get_json()['status'] == 'failed'
+    assert not os.path.exists(path)
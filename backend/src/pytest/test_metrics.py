@@ -0,0 +1,71 @@
+import logging
+import re
+import pytest
+from user_management import app
+from metrics import metrics, Histogram
+
+SAMPLE = re.compile(r'^[a-z_]+(\{([a-z_]+="[^"]*",?)*\})? [0-9.e+-]+$')
+
+pytestmark = pytest.mark.usefixtures('database')
+
+def sample(text, name, **labels):
+    """Value of the sample with exactly these labels, or None."""
+    wanted = ','.join(f'{k}="{v}"' for k, v in labels.items())
+    for line in text.splitlines():
+        if line.startswith(f'{name}{{{wanted}}} ') or (not labels and line.startswith(f'{name} ')):
+            return float(line.rsplit(' ', 1)[1])
+    return None
+
+def test_requests_and_statements_are_counted_per_route(client, admin_headers):
+    route = {'blueprint': 'test_management', 'endpoint': 'test_management.get_tests'}
+    before = client.get('/metrics', headers=admin_headers).get_data(as_text=True)
+    for _ in range(3):
+        assert client.get('/api/v1/tests', headers=admin_headers).status_code == 200
+    text = client.get('/metrics', headers=admin_headers).get_data(as_text=True)
+    assert all(SAMPLE.match(line) for line in text.splitlines() if not line.startswith('#'))
+    count = lambda t: sample(t, 'http_requests_total', **route, method='GET', status='200') or 0
+    assert count(text) - count(before) == 3
+    assert sample(text, 'http_request_duration_seconds_bucket', **route, method='GET', le='+Inf') >= 3
+    # One SELECT per listing, counted on the request's connection
+    queries = lambda t: (sample(t, 'db_queries_per_request_sum', **route) or 0, sample(t, 'db_queries_per_request_count', **route) or 0)
+    (sum_before, n_before), (sum_after, n_after) = queries(before), queries(text)
+    assert (sum_after - sum_before) / (n_after - n_before) == 1
+    assert sample(text, 'db_query_duration_seconds_count', operation='SELECT') > 0
+    assert sample(text, 'db_pool_in_use', database=app.config['DATABASE']) is not None
+
+def test_slow_queries_are_logged_with_plan(client, admin_headers, monkeypatch, caplog):
+    monkeypatch.setitem(app.config, 'SLOW_QUERY_SECONDS', 0)
+    with caplog.at_level(logging.WARNING, logger='begining.sql'):
+        client.get('/api/v1/tests/1', headers=admin_headers)
+    slow = [r.fields for r in caplog.records if r.name == 'begining.sql']
+    paper = next(f for f in slow if f['sql'].startswith('SELECT * FROM tests'))
+    assert paper['endpoint'] == 'test_management.get_test'
+    assert any('USING' in step for step in paper['plan'])
+
+def test_metrics_token_and_histogram_format(client, admin_headers, headers_for, monkeypatch):
+    # Without a token only admins may scrape
+    student = headers_for(2)
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers=student).status_code == 401
+    assert client.get('/metrics', headers=admin_headers).status_code == 200
+    monkeypatch.setitem(app.config, 'METRICS_TOKEN', 's3cret')
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer s3cret'}).status_code == 200
+    h = Histogram('demo_seconds', 'Demo.', ('route',), buckets=(0.1, 1))
+    for value in (0.05, 0.5, 5):
+        h.observe(('a"b',), value)
+    assert h.render()[2:] == ['demo_seconds_bucket{route="a\\"b",le="0.1"} 1', 'demo_seconds_bucket{route="a\\"b",le="1"} 2',
+                              'demo_seconds_bucket{route="a\\"b",le="+Inf"} 3', 'demo_seconds_sum{route="a\\"b"} 5.55',
+                              'demo_seconds_count{route="a\\"b"} 3']
+
+def test_metrics_can_be_disabled_after_import(client, admin_headers, monkeypatch):
+    monkeypatch.setitem(app.config, 'METRICS_ENABLED', False)
+    route = {'blueprint': 'test_management', 'endpoint': 'test_management.get_tests'}
+    count = lambda: sample(metrics.render(), 'http_requests_total', **route, method='GET', status='200') or 0
+    before = count()
+    assert client.get('/api/v1/tests', headers=admin_headers).status_code == 200
+    assert count() == before
+    assert client.get('/metrics', headers=admin_headers).status_code == 404
+    monkeypatch.setitem(app.config, 'METRICS_ENABLED', True)
+    assert client.get('/api/v1/tests', headers=admin_headers).status_code == 200
+    assert count() == before + 1
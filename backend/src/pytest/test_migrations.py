@@ -0,0 +1,75 @@
+import pytest
+from db import connect
+from migrate import migrate, discover, MigrationError, MIGRATIONS_DIR
+
+# The queries behind hot endpoints; each must be answered through an index.
+HOT_QUERIES = {
+    'question options (bulk)': ('SELECT id, question_id, option_text, is_correct FROM question_options WHERE question_id IN (?, ?, ?) ORDER BY question_id, id', (1, 2, 3)),
+    'question by id': ('SELECT * FROM questions WHERE id = ?', (1,)),
+    'question list page': ('SELECT * FROM questions WHERE 1=1 AND subject_id = ? AND topic_id = ? AND id > ? ORDER BY id LIMIT ?', (1, 1, 0, 100)),
+    'test paper': ('SELECT q.* FROM questions q JOIN test_questions tq ON q.id = tq.question_id WHERE tq.test_id = ? ORDER BY tq.question_order, q.id', (1,)),
+    'tests containing question': ('SELECT test_id FROM test_questions WHERE question_id = ?', (1,)),
+    'student test list': ('SELECT t.* FROM tests t JOIN test_assignments ta ON t.id = ta.test_id WHERE ta.user_id = ? AND t.id > ? ORDER BY t.id LIMIT ?', (1, 0, 100)),
+    'student attempt': ('SELECT * FROM test_attempts WHERE test_id = ? AND user_id = ?', (1, 1)),
+    'test results': ('SELECT * FROM test_attempts WHERE test_id = ?', (1,)),
+    'answer key options': ('SELECT o.id, o.question_id, o.option_text, o.is_correct FROM test_questions tq JOIN question_options o ON o.question_id = tq.question_id WHERE tq.test_id = ?', (1,)),
+    'rescore attempts': ('SELECT id FROM test_attempts WHERE test_id = ? AND id > ? ORDER BY id LIMIT ?', (1, 0, 500)),
+    'attempt answers': ('SELECT * FROM attempt_answers WHERE attempt_id = ?', (1,)),
+    'test analytics': ('SELECT s.question_id, s.answered, s.graded, s.correct, s.time_seconds_sum, q.topic_id FROM test_question_stats s LEFT JOIN questions q ON q.id = s.question_id WHERE s.test_id = ? ORDER BY s.question_id', (1,)),
+    'student analytics': ('SELECT subject_id, topic_id, total_attempts, avg_score FROM analytics WHERE user_id = ?', (1,)),
+    'student progress': ('SELECT submitted_at, score FROM test_attempts WHERE user_id = ? ORDER BY submitted_at DESC LIMIT ?', (1, 20)),
+    'open attempt': ('SELECT id, user_id, started_at FROM test_attempts WHERE test_id = ? AND user_id = ? AND submitted_at IS NULL', (1, 1)),
+    'existing assignments': ('SELECT user_id FROM test_assignments WHERE test_id = ?', (1,)),
+    'group members': ('SELECT g.id, m.user_id FROM student_groups g LEFT JOIN group_members m ON m.group_id = g.id WHERE g.id IN (?, ?)', (1, 2)),
+    'job claim': ("SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1", ()),
+}
+
+@pytest.fixture
+def db(tmp_path):
+    db = connect(str(tmp_path / 'migrations.db'))
+    yield db
+    db.close()
+
+def test_migrate_is_idempotent_and_recorded(db):
+    versions = [v for v, _, _ in discover()]
+    assert migrate(db) == versions
+    assert migrate(db) == []
+    recorded = [r[0] for r in db.execute('SELECT version FROM schema_migrations ORDER BY version')]
+    assert recorded == versions
+
+def test_migrate_upgrades_database_created_from_baseline(db):
+    migrate(db, target=1)
+    cols = {r['name'] for r in db.execute('PRAGMA table_info(test_attempts)')}
+    assert 'test_id' not in cols
+    db.execute("INSERT INTO questions (question_type, content) VALUES ('mcq_single', 'legacy')")
+    db.commit()
+    assert migrate(db) == [v for v, _, _ in discover() if v > 1]
+    cols = {r['name'] for r in db.execute('PRAGMA table_info(test_attempts)')}
+    assert {'test_id', 'user_id', 'answers'} <= cols
+    assert db.execute("SELECT id FROM questions WHERE content = 'legacy'").fetchone()['id'] == 1
+
+def test_duplicate_assignments_are_merged(db):
+    migrate(db, target=9)
+    db.executemany('INSERT INTO test_assignments (id, test_id, user_id) VALUES (?, ?, ?)', [(1, 1, 5), (2, 1, 5), (3, 1, 6)])
+    db.execute('INSERT INTO test_attempts (id, assignment_id, test_id, user_id) VALUES (1, 2, 1, 5)')
+    db.commit()
+    migrate(db)
+    assert [tuple(r) for r in db.execute('SELECT id, user_id FROM test_assignments ORDER BY id')] == [(1, 5), (3, 6)]
+    assert db.execute('SELECT assignment_id FROM test_attempts').fetchone()[0] == 1
+
+def test_failed_migration_is_rolled_back(db, tmp_path):
+    broken = tmp_path / 'migrations'
+    broken.mkdir()
+    (broken / '0002_broken.sql').write_text('CREATE TABLE half_done (x INTEGER);\nSELECT * FROM missing_table')
+    with pytest.raises(MigrationError):
+        migrate(db, migrations_dir=str(broken))
+    assert db.execute("SELECT name FROM sqlite_master WHERE name = 'half_done'").fetchone() is None
+    assert [r[0] for r in db.execute('SELECT version FROM schema_migrations')] == [1]
+
+@pytest.mark.parametrize('name', sorted(HOT_QUERIES))
+def test_hot_queries_use_indexes(db, name):
+    migrate(db)
+    sql, params = HOT_QUERIES[name]
+    plan = [r['detail'] for r in db.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+    full_scans = [step for step in plan if step.startswith('SCAN') and 'USING' not in step]
+    assert not full_scans, f'{name} regressed to a full scan: {plan}'
@@ -0,0 +1,103 @@
+import gzip
+import json
+import pytest
+from papers import test_papers
+from scoring import answer_keys
+
+@pytest.fixture(autouse=True)
+def setup_db(database):
+    yield
+    test_papers.invalidate()
+    answer_keys.invalidate()
+
+@pytest.fixture
+def paper(make_paper):
+    test_id, questions = make_paper(*({'content': f'Q{i} ' + 'x' * 400} for i in range(3)))
+    return test_id, [q['id'] for q in questions]
+
+def test_students_get_paper_without_answers(client, admin_headers, student, paper):
+    test_id, _ = paper
+    staff = client.get(f'/api/v1/tests/{test_id}/questions', headers=admin_headers).get_json()
+    assert [o['is_correct'] for o in staff[0]['options']] == [True, False]
+    taker = client.get(f'/api/v1/tests/{test_id}/questions', headers=student).get_json()
+    assert [o['option_text'] for o in taker[0]['options']] == ['right', 'wrong']
+    assert all('is_correct' not in o for q in taker for o in q['options'])
+    # Served from the cache the second time, byte for byte
+    hits = test_papers.hits
+    again = client.get(f'/api/v1/tests/{test_id}/questions', headers=student)
+    assert test_papers.hits == hits + 1
+    assert again.get_json() == taker
+    assert client.get('/api/v1/tests/999', headers=student).status_code == 404
+
+def test_etag_and_gzip(client, student, paper):
+    test_id, _ = paper
+    url = f'/api/v1/tests/{test_id}/questions'
+    first = client.get(url, headers=student)
+    assert first.status_code == 200 and first.headers['ETag']
+    assert client.get(url, headers=dict(student, **{'If-None-Match': first.headers['ETag']})).status_code == 304
+    zipped = client.get(url, headers=dict(student, **{'Accept-Encoding': 'gzip'}))
+    assert zipped.headers['Content-Encoding'] == 'gzip'
+    assert zipped.headers['ETag'] != first.headers['ETag']
+    assert json.loads(gzip.decompress(zipped.get_data())) == first.get_json()
+    not_modified = client.get(url, headers=dict(student, **{'Accept-Encoding': 'gzip', 'If-None-Match': zipped.headers['ETag']}))
+    assert not_modified.status_code == 304 and not not_modified.get_data()
+
+def test_edits_invalidate_the_paper(client, admin_headers, student, paper):
+    test_id, (q1, q2, q3) = paper
+    url = f'/api/v1/tests/{test_id}/questions'
+    etag = client.get(url, headers=student).headers['ETag']
+    client.put(f'/api/v1/questions/{q1}', headers=admin_headers, json={
+        'subject_id': 1, 'topic_id': 1, 'question_type': 'mcq_single', 'content': 'Reworded', 'difficulty': 'easy',
+        'options': [{'option_text': 'yes', 'is_correct': True}, {'option_text': 'no'}]})
+    changed = client.get(url, headers=dict(student, **{'If-None-Match': etag}))
+    assert changed.status_code == 200
+    assert changed.get_json()[0]['content'] == 'Reworded'
+    assert [o['option_text'] for o in changed.get_json()[0]['options']] == ['yes', 'no']
+    client.delete(f'/api/v1/questions/{q2}', headers=admin_headers)
+    assert [q['id'] for q in client.get(url, headers=student).get_json()] == [q1, q3]
+    client.put(f'/api/v1/tests/{test_id}', headers=admin_headers, json={'name': 'Renamed', 'question_ids': [q3]})
+    assert [q['id'] for q in client.get(url, headers=student).get_json()] == [q3]
+    assert client.get(f'/api/v1/tests/{test_id}', headers=student).get_json()['name'] == 'Renamed'
+
+def test_edit_in_another_process_is_seen(monkeypatch, client, admin_headers, student, paper):
+    test_id, (q1, _, q3) = paper
+    url = f'/api/v1/tests/{test_id}/questions'
+    assert len(client.get(url, headers=student).get_json()) == 3
+    # The edit is served by a worker whose cache is not this one
+    monkeypatch.setattr(test_papers, 'invalidate', lambda test_ids=None: None)
+    client.put(f'/api/v1/tests/{test_id}', headers=admin_headers, json={'question_ids': [q3, q1]})
+    assert [q['id'] for q in client.get(url, headers=student).get_json()] == [q3, q1]
+    hits = test_papers.hits
+    client.get(url, headers=student)
+    assert test_papers.hits == hits + 1
+
+def test_shuffled_paper_is_per_student_and_stable(client, admin_headers, headers_for, paper):
+    test_id, question_ids = paper
+    more = [client.post('/api/v1/questions', headers=admin_headers, json={
+        'subject_id': 1, 'topic_id': 1, 'question_type': 'mcq_multiple', 'content': f'M{i}', 'difficulty': 'easy',
+        'options': [{'option_text': str(n), 'is_correct': n < 2} for n in range(5)]}).get_json()['id'] for i in range(9)]
+    question_ids = question_ids + more
+    client.put(f'/api/v1/tests/{test_id}', headers=admin_headers, json={'pattern': 'MCQ, shuffle', 'question_ids': question_ids})
+    url = f'/api/v1/tests/{test_id}/questions'
+    staff = client.get(url, headers=admin_headers).get_json()
+    assert [q['id'] for q in staff] == question_ids
+    papers = {}
+    for user_id in range(10, 20):
+        taker = client.get(url, headers=headers_for(user_id, 'student')).get_json()
+        assert sorted(q['id'] for q in taker) == sorted(question_ids)
+        assert all(sorted(o['id'] for o in q['options']) == sorted(o['id'] for o in s['options'])
+                   for q in taker for s in staff if s['id'] == q['id'])
+        papers[user_id] = [(q['id'], [o['id'] for o in q['options']]) for q in taker]
+    assert len(set(map(str, papers.values()))) > 1
+    # Same student, same order, from the one cached canonical paper
+    misses = test_papers.misses
+    assert [(q['id'], [o['id'] for o in q['options']]) for q in client.get(url, headers=headers_for(10, 'student')).get_json()] == papers[10]
+    assert test_papers.misses == misses
+    order = [q['id'] for q in client.get(f'/api/v1/tests/{test_id}', headers=headers_for(10, 'student')).get_json()['questions']]
+    assert order == [qid for qid, _ in papers[10]]
+    # Answers are graded by id whatever the order, and read back in the student's order
+    student = headers_for(10, 'student')
+    picked = [{'question_id': qid, 'selected_option_ids': options[:1]} for qid, options in reversed(papers[10])]
+    assert client.post(f'/api/v1/tests/{test_id}/attempt', headers=student, json={'answers': picked}).status_code == 200
+    attempt = client.get(f'/api/v1/tests/{test_id}/attempt', headers=student).get_json()
+    assert [a['question_id'] for a in attempt['answers']] == order
@@ -0,0 +1,53 @@
+import time
+import pytest
+import test_management
+from profiling import profiler, collapse
+
+@pytest.fixture(autouse=True)
+def setup_db(database):
+    yield
+    profiler.stop()
+    profiler.clear()
+
+def test_profiler_is_admin_only_and_validates_rates(client, headers_for, admin_headers):
+    assert client.post('/admin/profiler/start', headers=headers_for(1, 'teacher'), json={'default_rate': 1}).status_code == 401
+    admin = admin_headers
+    assert client.post('/admin/profiler/start', headers=admin, json={'default_rate': 2}).status_code == 400
+    assert client.post('/admin/profiler/start', headers=admin, json={}).status_code == 400
+    assert client.get('/admin/profiler', headers=admin).get_json()['enabled'] is False
+
+def test_sampled_route_stacks_are_collapsed(client, monkeypatch, admin_headers):
+    admin = admin_headers
+    real_page = test_management.Page
+    def slow_page(*args):
+        time.sleep(0.05)
+        return real_page(*args)
+    monkeypatch.setattr(test_management, 'Page', slow_page)
+    resp = client.post('/admin/profiler/start', headers=admin,
+                       json={'rates': {'test_management.get_tests': 1.0}, 'interval_ms': 2, 'duration': 30})
+    assert resp.get_json()['enabled'] is True
+    for _ in range(3):
+        client.get('/api/v1/tests', headers=admin)
+    client.get('/users', headers=admin)
+    status = client.get('/admin/profiler', headers=admin).get_json()
+    assert status['requests'] == {'test_management.get_tests': 3}
+    assert status['samples'] > 0
+    text = client.get('/admin/profiler/stacks', headers=admin).get_data(as_text=True)
+    lines = text.splitlines()
+    assert lines and all(line.startswith('test_management.get_tests;') for line in lines)
+    assert any('get_tests (test_management.py' in line and 'slow_page' in line for line in lines)
+    assert all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+    client.post('/admin/profiler/stop', headers=admin)
+    samples = client.get('/admin/profiler', headers=admin).get_json()['samples']
+    client.get('/api/v1/tests', headers=admin)
+    assert client.get('/admin/profiler', headers=admin).get_json()['samples'] == samples
+    assert client.delete('/admin/profiler/stacks', headers=admin).status_code == 204
+    assert client.get('/admin/profiler/stacks', headers=admin).get_data() == b''
+
+def test_collapse_is_root_first():
+    def inner():
+        import sys
+        return collapse(sys._getframe())
+    stack = inner().split(';')
+    assert stack[-1].startswith('inner (test_profiling.py')
+    assert stack[-2].startswith('test_collapse_is_root_first')
@@ -0,0 +1,313 @@
+import pytest
+import random
+import sqlite3
+import json
+import csv
+import io
+from werkzeug.test import EnvironBuilder
+from user_management import app, get_db
+from question_bank import get_options_for_question, insert_options
+import question_import
+import question_pools
+import question_search
+from db import close_pools, insert, pool_stats
+
+pytestmark = pytest.mark.usefixtures('database')
+
+def seed_questions(count, options_per_question=3):
+    with app.app_context():
+        db = get_db()
+        for i in range(count):
+            qid = insert(db, 'questions', {'subject_id': 1, 'topic_id': 1, 'question_type': 'mcq_single',
+                                           'content': f'Question {i}', 'difficulty': 'easy', 'explanation': '', 'created_by': 1})
+            insert_options(db, qid, [{'option_text': f'Option {j}', 'is_correct': j == 0} for j in range(options_per_question)])
+        db.commit()
+
+def count_queries(monkeypatch, client, url, headers):
+    statements = []
+    connect = sqlite3.connect
+    def traced_connect(*args, **kwargs):
+        conn = connect(*args, **kwargs)
+        conn.set_trace_callback(statements.append)
+        return conn
+    with monkeypatch.context() as m:
+        m.setattr(sqlite3, 'connect', traced_connect)
+        # Drop pooled connections so the request opens a traced one
+        close_pools()
+        resp = client.get(url, headers=headers)
+    assert resp.status_code == 200
+    # Leave out auth's periodic reload of the revocation list and the job workers' startup check
+    return resp, [s for s in statements if s.lstrip().upper().startswith('SELECT')
+                  and 'revoked_tokens' not in s and 'FROM jobs' not in s]
+
+def test_get_questions_returns_options(client, admin_headers):
+    seed_questions(3)
+    resp = client.get('/api/v1/questions', headers=admin_headers)
+    assert resp.status_code == 200
+    questions = resp.get_json()
+    assert len(questions) == 3
+    for q in questions:
+        assert [o['option_text'] for o in q['options']] == ['Option 0', 'Option 1', 'Option 2']
+        assert [o['is_correct'] for o in q['options']] == [True, False, False]
+
+def test_get_questions_query_count_is_constant(monkeypatch, client, admin_headers):
+    seed_questions(5)
+    _, small = count_queries(monkeypatch, client, '/api/v1/questions', admin_headers)
+    seed_questions(495)
+    resp, large = count_queries(monkeypatch, client, '/api/v1/questions', admin_headers)
+    assert len(resp.get_json()) == 500
+    assert len(small) == len(large) == 2
+
+def test_get_test_questions_uses_bulk_options(monkeypatch, client, admin_headers):
+    seed_questions(50)
+    resp = client.post('/api/v1/tests', headers=admin_headers, json={
+        'name': 'Bulk', 'duration_minutes': 30, 'question_ids': list(range(1, 51))
+    })
+    test_id = resp.get_json()['id']
+    resp, selects = count_queries(monkeypatch, client, f'/api/v1/tests/{test_id}/questions', admin_headers)
+    questions = resp.get_json()
+    assert len(questions) == 50
+    assert all(len(q['options']) == 3 for q in questions)
+    # The paper's version, the test's pattern, its questions, and all options in one go
+    assert len(selects) == 4
+    # Later requests are served from the cached paper once its version is checked
+    resp, selects = count_queries(monkeypatch, client, f'/api/v1/tests/{test_id}/questions', admin_headers)
+    assert resp.get_json() == questions
+    assert len(selects) == 1 and 'paper_version' in selects[0]
+
+def test_get_questions_keyset_pagination(client, admin_headers):
+    seed_questions(25)
+    seen, cursor = [], None
+    while True:
+        params = {'limit': 10}
+        if cursor:
+            params['after_id'] = cursor
+        resp = client.get('/api/v1/questions', headers=admin_headers, query_string=params)
+        assert resp.status_code == 200
+        page = resp.get_json()
+        seen.extend(q['id'] for q in page['items'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert seen == list(range(1, 26))
+
+def test_get_questions_field_projection_skips_options(monkeypatch, client, admin_headers):
+    seed_questions(5)
+    resp, selects = count_queries(monkeypatch, client, '/api/v1/questions?fields=content', admin_headers)
+    items = resp.get_json()['items']
+    assert items[0] == {'id': 1, 'content': 'Question 0'}
+    assert len(selects) == 1
+
+def test_get_questions_rejects_bad_page_args(client, admin_headers):
+    assert client.get('/api/v1/questions?limit=abc', headers=admin_headers).status_code == 400
+    assert client.get('/api/v1/questions?limit=0', headers=admin_headers).status_code == 400
+    assert client.get('/api/v1/questions?fields=password', headers=admin_headers).status_code == 400
+
+def test_get_questions_ndjson_stream(client, admin_headers):
+    seed_questions(1200, options_per_question=2)
+    resp = client.get('/api/v1/questions?stream=1', headers=admin_headers)
+    assert resp.status_code == 200
+    assert resp.is_streamed
+    assert resp.mimetype == 'application/x-ndjson'
+    lines = resp.get_data(as_text=True).splitlines()
+    assert len(lines) == 1200
+    rows = [json.loads(line) for line in lines]
+    assert [r['id'] for r in rows] == list(range(1, 1201))
+    assert all(len(r['options']) == 2 for r in rows)
+
+def test_ndjson_stream_releases_its_connection(client, admin_headers):
+    seed_questions(3)
+    in_use = lambda: sum(p['in_use'] for p in pool_stats())
+    # The client goes away before the server has pulled the first chunk
+    environ = EnvironBuilder('/api/v1/questions?stream=1', headers=admin_headers).get_environ()
+    body = app(environ, lambda status, headers, exc_info=None: None)
+    assert in_use() == 1
+    body.close()
+    assert in_use() == 0
+    resp = client.get('/api/v1/questions?stream=1', headers=admin_headers)
+    assert len(resp.get_data(as_text=True).splitlines()) == 3
+    resp.close()
+    assert in_use() == 0
+
+def test_get_questions_ndjson_via_accept_header(client, admin_headers):
+    seed_questions(3)
+    headers = dict(admin_headers, Accept='application/x-ndjson')
+    resp = client.get('/api/v1/questions?fields=content', headers=headers)
+    assert resp.mimetype == 'application/x-ndjson'
+    assert [json.loads(line) for line in resp.get_data(as_text=True).splitlines()][0] == {'id': 1, 'content': 'Question 0'}
+
+def upload_csv(client, headers, text, encoding='utf-8', **params):
+    return client.post('/api/v1/questions/bulk-upload', headers=headers, query_string=params,
+                       data={'file': (io.BytesIO(text.encode(encoding)), 'questions.csv')},
+                       content_type='multipart/form-data')
+
+def test_bulk_upload_batches_and_reports_bad_rows(client, admin_headers):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['subject_id', 'topic_id', 'question_type', 'content', 'difficulty', 'explanation', 'options'])
+    for i in range(25):
+        qtype = 'essay' if i == 7 else 'mcq_single'
+        options = '[{"is_correct": true}]' if i == 12 else json.dumps([{'option_text': 'A', 'is_correct': True}, {'option_text': 'B'}])
+        writer.writerow([1, 1, qtype, f'Q{i}', 'easy', '', options])
+    writer.writerow([1, 1, 'true_false', 'Semicolons', 'easy', '', 'True; False'])
+    resp = upload_csv(client, admin_headers, out.getvalue(), batch_size=10)
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert data['success_count'] == 24
+    assert [e['row'] for e in data['errors']] == [9, 14]
+    assert data['stats']['rows_read'] == 26
+    assert data['stats']['batches'] == 3
+    with app.app_context():
+        db = get_db()
+        assert db.execute('SELECT COUNT(*) FROM questions WHERE id IS NULL').fetchone()[0] == 0
+        semi = db.execute("SELECT id FROM questions WHERE content = 'Semicolons'").fetchone()['id']
+        opts = get_options_for_question(db, semi)
+        assert [o['option_text'] for o in opts] == ['True', 'False']
+        assert db.execute('SELECT COUNT(*) FROM question_options').fetchone()[0] == 23 * 2 + 2
+
+def test_bulk_upload_rejects_non_utf8_before_inserting(client, admin_headers):
+    rows = ['question_type,content'] + [f'mcq_single,Q{i}' for i in range(30)] + ['mcq_single,Caf\u00e9']
+    resp = upload_csv(client, admin_headers, '\n'.join(rows), encoding='latin-1', batch_size=10)
+    assert resp.status_code == 400
+    assert resp.get_json() == {'message': 'File must be UTF-8 encoded'}
+    with app.app_context():
+        assert get_db().execute('SELECT COUNT(*) FROM questions').fetchone()[0] == 0
+
+def test_import_isolates_rows_rejected_by_database():
+    rows = [(2, (1, 1, 'mcq_single', 'ok', 'easy', '', 1), []),
+            (3, (1, 1, 'not_a_type', 'bad', 'easy', '', 1), []),
+            (4, (1, 1, 'mcq_single', 'ok too', 'easy', '', 1), [])]
+    errors = []
+    with app.app_context():
+        db = get_db()
+        assert question_import._flush(db, rows, errors) == 2
+        assert [e['row'] for e in errors] == [3]
+        assert db.execute('SELECT COUNT(*) FROM questions').fetchone()[0] == 2
+
+def add_question(client, headers, content, explanation='', **fields):
+    body = {'subject_id': 1, 'topic_id': 1, 'question_type': 'mcq_single', 'difficulty': 'easy',
+            'content': content, 'explanation': explanation, 'options': []}
+    body.update(fields)
+    return client.post('/api/v1/questions', headers=headers, json=body).get_json()['id']
+
+def search(client, headers, query_string):
+    resp = client.get(f'/api/v1/questions?{query_string}', headers=headers)
+    assert resp.status_code == 200
+    return resp.get_json()
+
+def test_search_ranks_prefix_matches_with_snippets(client, admin_headers):
+    weak = add_question(client, admin_headers, 'Solve for x', explanation='Uses algebraic rules')
+    strong = add_question(client, admin_headers, 'Algebra: factor the algebraic expression')
+    add_question(client, admin_headers, 'Name the capital of France')
+    results = search(client, admin_headers, 'search=algebr')
+    assert [q['id'] for q in results] == [strong, weak]
+    assert results[0]['relevance'] > results[1]['relevance']
+    assert '<mark>Algebra</mark>' in results[0]['snippets']['content']
+    assert '<mark>algebraic</mark>' in results[1]['snippets']['explanation']
+    # Query syntax in user input is treated as plain words
+    assert search(client, admin_headers, 'search=algebra%22%20OR%20NOT') == []
+
+def test_search_snippets_are_loaded_in_chunks(monkeypatch, client, admin_headers):
+    monkeypatch.setattr(question_search, 'SNIPPET_CHUNK_SIZE', 2)
+    for i in range(5):
+        add_question(client, admin_headers, f'Osmosis question {i}')
+    results = search(client, admin_headers, 'search=osmosis')
+    assert len(results) == 5
+    assert all(q['snippets']['content'].startswith('<mark>Osmosis</mark>') for q in results)
+
+def test_search_combines_with_filters_and_pages_by_rank(client, admin_headers):
+    for i in range(5):
+        add_question(client, admin_headers, f'Photosynthesis question {i}', difficulty='hard' if i % 2 else 'easy')
+    hard = search(client, admin_headers, 'search=photo&difficulty=hard')
+    assert len(hard) == 2
+    seen, cursor = [], None
+    while True:
+        qs = 'search=photo&limit=2&fields=content' + (f'&after_id={cursor}' if cursor else '')
+        page = search(client, admin_headers, qs)
+        seen += [q['id'] for q in page['items']]
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert sorted(seen) == [1, 2, 3, 4, 5] and len(set(seen)) == 5
+
+def test_search_index_follows_updates_deletes_and_bulk_upload(client, admin_headers):
+    qid = add_question(client, admin_headers, 'Mitochondria are the powerhouse')
+    client.put(f'/api/v1/questions/{qid}', headers=admin_headers, json={
+        'subject_id': 1, 'topic_id': 1, 'question_type': 'mcq_single', 'content': 'Ribosomes build proteins',
+        'difficulty': 'easy', 'explanation': '', 'options': []})
+    assert search(client, admin_headers, 'search=mitochondria') == []
+    assert [q['id'] for q in search(client, admin_headers, 'search=ribosome')] == [qid]
+    client.delete(f'/api/v1/questions/{qid}', headers=admin_headers)
+    assert search(client, admin_headers, 'search=ribosome') == []
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['subject_id', 'topic_id', 'question_type', 'content', 'difficulty', 'explanation', 'options'])
+    writer.writerow([1, 1, 'true_false', 'Enzymes speed up reactions', 'easy', 'Catalysts', 'True; False'])
+    assert upload_csv(client, admin_headers, out.getvalue()).status_code == 200
+    assert [q['content'] for q in search(client, admin_headers, 'search=catalyst')] == ['Enzymes speed up reactions']
+
+def seed_bank(client, admin_headers):
+    ids = {}
+    for topic, difficulty, count in ((1, 'easy', 30), (1, 'hard', 4), (2, 'hard', 12)):
+        ids[(topic, difficulty)] = [client.post('/api/v1/questions', headers=admin_headers, json={
+            'subject_id': 1, 'topic_id': topic, 'question_type': 'mcq_single', 'content': f'{difficulty} {topic} {i}',
+            'difficulty': difficulty, 'options': [{'option_text': 'a', 'is_correct': True}]}).get_json()['id']
+            for i in range(count)]
+    return ids
+
+def test_generate_test_from_blueprint(client, admin_headers):
+    ids = seed_bank(client, admin_headers)
+    blueprint = [{'topic_id': 1, 'difficulty': 'easy', 'count': 10}, {'subject_id': 1, 'difficulty': 'hard', 'count': 5}]
+    resp = client.post('/api/v1/tests/generate', headers=admin_headers,
+                       json={'name': 'Generated', 'duration_minutes': 30, 'blueprint': blueprint, 'seed': 7})
+    assert resp.status_code == 201
+    body = resp.get_json()
+    assert len(set(body['question_ids'])) == 15
+    assert set(body['question_ids'][:10]) <= set(ids[(1, 'easy')])
+    assert set(body['question_ids'][10:]) <= set(ids[(1, 'hard')] + ids[(2, 'hard')])
+    paper = client.get(f"/api/v1/tests/{body['id']}/questions", headers=admin_headers).get_json()
+    assert [q['id'] for q in paper] == body['question_ids']
+    # The same seed draws the same paper
+    again = client.post('/api/v1/tests/generate', headers=admin_headers,
+                        json={'blueprint': blueprint, 'seed': 7, 'preview': True}).get_json()
+    assert again['question_ids'] == body['question_ids']
+    short = client.post('/api/v1/tests/generate', headers=admin_headers, json={'blueprint': [{'topic_id': 1, 'difficulty': 'hard', 'count': 5}]})
+    assert short.status_code == 400
+    assert 'only 4' in short.get_json()['message']
+    assert client.post('/api/v1/tests/generate', headers=admin_headers, json={'blueprint': [{'count': 0}]}).status_code == 400
+
+def test_generate_per_student_papers_and_pool_refresh(client, admin_headers):
+    ids = seed_bank(client, admin_headers)
+    resp = client.post('/api/v1/tests/generate', headers=admin_headers, json={
+        'name': 'Personal', 'duration_minutes': 30, 'per_student': True, 'user_ids': [10, 11, 12],
+        'blueprint': [{'topic_id': 1, 'difficulty': 'easy', 'count': 10}]})
+    assert resp.status_code == 201
+    tests = resp.get_json()['tests']
+    assert [t['user_id'] for t in tests] == [10, 11, 12]
+    # 30 easy questions are enough for three disjoint papers
+    assert len({qid for t in tests for qid in t['question_ids']}) == 30
+    with app.app_context():
+        assigned = get_db().execute('SELECT test_id, user_id FROM test_assignments ORDER BY user_id').fetchall()
+    assert [tuple(r) for r in assigned] == [(t['id'], t['user_id']) for t in tests]
+    # Pools follow edits to the bank
+    for qid in ids[(1, 'hard')][:2]:
+        client.delete(f'/api/v1/questions/{qid}', headers=admin_headers)
+    preview = client.post('/api/v1/tests/generate', headers=admin_headers, json={
+        'preview': True, 'blueprint': [{'topic_id': 1, 'difficulty': 'hard', 'count': 2}]}).get_json()
+    assert sorted(preview['question_ids']) == ids[(1, 'hard')][2:]
+
+def test_paper_draw_keeps_running_free_lists():
+    rows = [{'id': i, 'subject_id': 1, 'topic_id': 1 + i % 2, 'difficulty': 'easy', 'question_type': 'mcq_single'}
+            for i in range(12)]
+    draw = question_pools.PoolIndex(rows).draw(random.Random(3))
+    rule = [({'subject_id': 1}, 4)]
+    papers = [draw.paper(rule) for _ in range(3)]
+    # Three papers use up the bank without sharing a question
+    assert sorted(qid for paper in papers for qid in paper) == list(range(12))
+    assert [free.count for free in draw.free.values()] == [0, 0]
+    # Later papers reuse questions, still without repeats inside a paper
+    assert len(set(draw.paper(rule))) == 4
+    topic = draw.paper([({'topic_id': 2}, 6)])
+    assert sorted(topic) == [1, 3, 5, 7, 9, 11]
+    with pytest.raises(question_pools.BlueprintError, match='only 6'):
+        draw.paper([({'topic_id': 2}, 7)])
@@ -0,0 +1,196 @@
+import pytest
+from datetime import datetime, timedelta
+from user_management import app, get_db
+from scoring import answer_keys, save_answers
+from db import insert
+import analytics
+
+@pytest.fixture(autouse=True)
+def setup_db(database):
+    yield
+    answer_keys.invalidate()
+
+def question(question_type, options):
+    return {'question_type': question_type, 'content': f'{question_type}?', 'options': options}
+
+@pytest.fixture
+def paper(make_paper):
+    test_id, questions = make_paper(
+        question('mcq_single', [{'option_text': '3'}, {'option_text': '4', 'is_correct': True}]),
+        question('mcq_multiple', [{'option_text': '2', 'is_correct': True}, {'option_text': '3', 'is_correct': True}, {'option_text': '4'}]),
+        question('true_false', [{'option_text': 'True', 'is_correct': True}, {'option_text': 'False'}]),
+        question('fill_blank', [{'option_text': 'Paris', 'is_correct': True}]),
+        question('short_answer', []), name='Scored')
+    opts = {q['question_type']: [o['id'] for o in q['options']] for q in questions}
+    return test_id, {q['question_type']: q['id'] for q in questions}, opts
+
+def submit(client, test_id, headers, answers):
+    return client.post(f'/api/v1/tests/{test_id}/attempt', headers=headers, json={'answers': answers})
+
+def test_attempt_is_scored_per_question_type(client, headers_for, paper):
+    test_id, qids, opts = paper
+    resp = submit(client, test_id, headers_for(10), [
+        {'question_id': qids['mcq_single'], 'selected_option_ids': [opts['mcq_single'][1]]},
+        {'question_id': qids['mcq_multiple'], 'selected_option_ids': [opts['mcq_multiple'][0]]},
+        # The frontend sends {question_id: "<id>", answer: <option id or text>}
+        {'question_id': str(qids['true_false']), 'answer': opts['true_false'][0]},
+        {'question_id': qids['fill_blank'], 'answer': '  paris '},
+        {'question_id': qids['short_answer'], 'answer_text': 'An essay'},
+    ])
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert (data['score'], data['max_score'], data['is_graded']) == (3, 4, False)
+    attempt = client.get(f'/api/v1/tests/{test_id}/attempt', headers=headers_for(10, 'student')).get_json()
+    graded = {a['question_id']: a['is_correct'] for a in attempt['answers']}
+    assert graded == {qids['mcq_single']: True, qids['mcq_multiple']: False, qids['true_false']: True,
+                      qids['fill_blank']: True, qids['short_answer']: None}
+    assert attempt['score'] == 3
+
+def test_answer_key_is_loaded_once_per_test(client, headers_for, paper):
+    test_id, qids, opts = paper
+    misses = answer_keys.misses
+    for user_id in range(20, 30):
+        assert submit(client, test_id, headers_for(user_id), [{'question_id': qids['mcq_single'], 'selected_option_ids': [opts['mcq_single'][1]]}]).status_code == 200
+    assert answer_keys.misses == misses + 1
+
+def test_malformed_answers_are_rejected(client, headers_for, paper):
+    test_id, _, _ = paper
+    assert submit(client, test_id, headers_for(10), [{'answer': 3}]).status_code == 400
+    assert submit(client, test_id, headers_for(10), {'not': 'a list'}).status_code == 400
+
+def test_rescore_after_answer_key_change(client, admin_headers, headers_for, paper):
+    test_id, qids, opts = paper
+    for user_id, pick in [(10, 0), (11, 1), (12, 0)]:
+        submit(client, test_id, headers_for(user_id), [{'question_id': qids['mcq_single'], 'selected_option_ids': [opts['mcq_single'][pick]]}])
+    # Flip the correct option; option ids change when options are rewritten
+    q = client.put(f"/api/v1/questions/{qids['mcq_single']}", headers=admin_headers, json={
+        'subject_id': 1, 'topic_id': 1, 'question_type': 'mcq_single', 'content': 'mcq_single?', 'difficulty': 'easy',
+        'explanation': '', 'options': [{'option_text': '3', 'is_correct': True}, {'option_text': '4'}]}).get_json()
+    with app.app_context():
+        db = get_db()
+        db.execute('UPDATE attempt_answers SET selected_option_ids = ? WHERE selected_option_ids = ?',
+                   (f"[{q['options'][0]['id']}]", f"[{opts['mcq_single'][0]}]"))
+        db.commit()
+    resp = client.post(f'/api/v1/tests/{test_id}/score', headers=admin_headers, json={})
+    assert resp.get_json()['rescored_count'] == 3
+    results = client.get(f'/api/v1/tests/{test_id}/results', headers=admin_headers).get_json()
+    assert {r['user_id']: r['score'] for r in results} == {10: 1, 11: 0, 12: 1}
+
+def get_analytics(client, headers, test_id):
+    resp = client.get(f'/api/v1/tests/{test_id}/analytics', headers=headers)
+    assert resp.status_code == 200
+    return resp.get_json()
+
+def test_analytics_are_maintained_as_attempts_are_scored(client, admin_headers, headers_for, paper):
+    test_id, qids, opts = paper
+    assert get_analytics(client, admin_headers, test_id)['total_attempts'] == 0
+    right, wrong = opts['mcq_single'][1], opts['mcq_single'][0]
+    for user_id, pick, blank in [(10, right, 'Paris'), (11, wrong, 'Paris'), (12, wrong, 'Lyon'), (13, right, 'paris')]:
+        submit(client, test_id, headers_for(user_id), [{'question_id': qids['mcq_single'], 'selected_option_ids': [pick]},
+                                          {'question_id': qids['fill_blank'], 'answer_text': blank}])
+    data = get_analytics(client, admin_headers, test_id)
+    assert data['total_attempts'] == 4
+    assert data['average_score'] == 1.25
+    assert (data['lowest_score'], data['highest_score']) == (0, 2)
+    assert data['score_histogram'] == [{'score': 0, 'attempts': 1}, {'score': 1, 'attempts': 1}, {'score': 2, 'attempts': 2}]
+    assert data['percentiles'] == {'p25': 0, 'p50': 1, 'p75': 2, 'p90': 2}
+    single = next(q for q in data['question_stats'] if q['question_id'] == qids['mcq_single'])
+    assert (single['answered'], single['correct'], single['correct_rate']) == (4, 2, 0.5)
+    assert single['option_picks'] == [{'option_id': wrong, 'picks': 2}, {'option_id': right, 'picks': 2}]
+    assert data['topic_stats'] == [{'topic_id': 1, 'graded_answers': 8, 'correct_rate': 0.625}]
+
+def staggered_attempt(test_id, user_id, answers):
+    """Open an attempt whose answers were saved the given seconds after it started; answers: [(question_id, option_id, seconds)]."""
+    started = datetime(2026, 1, 5, 9, 0)
+    with app.app_context():
+        db = get_db()
+        attempt_id = insert(db, 'test_attempts', {'test_id': test_id, 'user_id': user_id, 'started_at': started})
+        save_answers(db, [(attempt_id, qid, [option_id], None, False, 0, started + timedelta(seconds=seconds))
+                          for qid, option_id, seconds in answers])
+        db.commit()
+
+def test_question_time_runs_from_the_previous_answer(client, admin_headers, headers_for, paper):
+    test_id, qids, opts = paper
+    # 10s on the first question, then two answers saved together 30s later
+    staggered_attempt(test_id, 10, [(qids['mcq_single'], opts['mcq_single'][1], 10),
+                                    (qids['mcq_multiple'], opts['mcq_multiple'][0], 40),
+                                    (qids['true_false'], opts['true_false'][0], 40)])
+    assert client.post(f'/api/v1/tests/{test_id}/submit', headers=headers_for(10)).status_code == 200
+    times = {q['question_id']: q['avg_time_seconds'] for q in get_analytics(client, admin_headers, test_id)['question_stats']}
+    assert times == {qids['mcq_single']: 10, qids['mcq_multiple']: 15, qids['true_false']: 15}
+    student = client.get(f'/api/v1/tests/{test_id}/analytics/student', headers=headers_for(10)).get_json()
+    assert student['time_per_question'] == [{'question_id': qids['mcq_single'], 'time_spent_seconds': 10},
+                                            {'question_id': qids['mcq_multiple'], 'time_spent_seconds': 15},
+                                            {'question_id': qids['true_false'], 'time_spent_seconds': 15}]
+
+def test_analytics_rebuild_matches_incremental_totals(client, admin_headers, headers_for, paper):
+    test_id, qids, opts = paper
+    for user_id in range(10, 16):
+        submit(client, test_id, headers_for(user_id), [{'question_id': qids['mcq_multiple'], 'selected_option_ids': opts['mcq_multiple'][:2 if user_id % 2 else 1]},
+                                          {'question_id': qids['true_false'], 'selected_option_ids': [opts['true_false'][user_id % 2]]}])
+    incremental = get_analytics(client, admin_headers, test_id)
+    client.post(f'/api/v1/tests/{test_id}/score', headers=admin_headers, json={})
+    rebuilt = get_analytics(client, admin_headers, test_id)
+    assert rebuilt == incremental
+
+def student_rows(user_id):
+    with app.app_context():
+        rows = get_db().execute('SELECT subject_id, topic_id, total_attempts, avg_score FROM analytics WHERE user_id = ? ORDER BY topic_id',
+                                (user_id,)).fetchall()
+        return [tuple(r) for r in rows]
+
+def test_student_analytics_keep_running_means(monkeypatch, client, admin_headers, headers_for, paper):
+    test_id, qids, opts = paper
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO subjects (id, name) VALUES (1, 'Maths')")
+        db.execute("INSERT INTO topics (id, subject_id, name) VALUES (1, 1, 'Arithmetic')")
+        db.commit()
+    right = [{'question_id': qids['mcq_single'], 'selected_option_ids': [opts['mcq_single'][1]]},
+             {'question_id': qids['true_false'], 'selected_option_ids': [opts['true_false'][0]]}]
+    half = [right[0], {'question_id': qids['true_false'], 'selected_option_ids': [opts['true_false'][1]]}]
+    submit(client, test_id, headers_for(10), right)
+    submit(client, test_id, headers_for(11), half)
+    # A second test over the same topic folds into the same running mean
+    second = client.post('/api/v1/tests', headers=admin_headers, json={
+        'name': 'Retake', 'duration_minutes': 30, 'question_ids': [qids['true_false']]}).get_json()['id']
+    submit(client, second, headers_for(10), [half[1]])
+    assert student_rows(10) == [(1, 1, 2, 50.0)]
+    assert student_rows(11) == [(1, 1, 1, 50.0)]
+    resp = client.get(f'/api/v1/tests/{test_id}/analytics/student', headers=headers_for(10, 'student'))
+    assert resp.status_code == 200
+    data = resp.get_json()
+    assert (data['total_score'], data['percentage'], data['accuracy']) == (2, 50.0, 1.0)
+    assert data['breakdown'] == [{'subject_id': 1, 'topic_id': 1, 'subject': 'Maths', 'topic': 'Arithmetic', 'score': 2, 'total': 2}]
+    assert data['class_average'] == 1.5
+    assert data['weaknesses'] == [] and data['strengths'] == []
+    assert [p['score'] for p in data['progress_over_time']] == [2, 0]
+    # Teachers can read any student's analytics; students only their own
+    teacher = client.get(f'/api/v1/tests/{test_id}/analytics/student?user_id=11', headers=admin_headers).get_json()
+    assert teacher['user_id'] == 11
+    assert client.get(f'/api/v1/tests/{test_id}/analytics/student?user_id=11', headers=headers_for(10, 'student')).get_json()['user_id'] == 10
+    # Replaying every attempt in small batches gives the same rows
+    monkeypatch.setattr(analytics, 'REBUILD_BATCH_SIZE', 1)
+    with app.app_context():
+        db = get_db()
+        assert analytics.rebuild_student_analytics(db, lambda t: answer_keys.get(db, t)) == 3
+        db.commit()
+    assert student_rows(10) == [(1, 1, 2, 50.0)]
+    assert student_rows(11) == [(1, 1, 1, 50.0)]
+
+def test_student_running_mean_is_not_truncated(client, admin_headers, headers_for, paper):
+    test_id, qids, opts = paper
+    right = {'question_id': qids['true_false'], 'selected_option_ids': [opts['true_false'][0]]}
+    wrong = {'question_id': qids['true_false'], 'selected_option_ids': [opts['true_false'][1]]}
+    # Whole-number means (100, then 0) are stored as INTEGER; the merge must still divide exactly
+    for answer in (right, wrong, wrong):
+        retake = client.post('/api/v1/tests', headers=admin_headers, json={
+            'name': 'Retake', 'duration_minutes': 30, 'question_ids': [qids['true_false']]}).get_json()['id']
+        submit(client, retake, headers_for(12), [answer])
+    [(_, _, attempts, live)] = student_rows(12)
+    assert attempts == 3 and live == pytest.approx(100 / 3)
+    with app.app_context():
+        db = get_db()
+        analytics.rebuild_student_analytics(db, lambda t: answer_keys.get(db, t))
+        db.commit()
+    assert student_rows(12)[0][3] == pytest.approx(live)
@@ -0,0 +1,73 @@
+import os
+import threading
+import pytest
+from db import connect, insert, insert_many
+from storage import backend_for, backend_of, to_pyformat, SQLITE, POSTGRES
+
+POSTGRES_DSN = os.environ.get('TEST_POSTGRES_DSN')
+
+@pytest.fixture
+def sqlite_db(tmp_path):
+    db = connect(str(tmp_path / 'storage.db'))
+    db.executescript('''
+        CREATE TABLE serial_ids (id SERIAL PRIMARY KEY, name TEXT);
+        CREATE TABLE rowid_ids (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT);
+    ''')
+    yield db
+    db.close()
+
+def test_backend_is_chosen_from_database_setting():
+    assert backend_for('user_management.db') is SQLITE
+    assert backend_for('postgresql://u:p@localhost/exams') is POSTGRES
+
+def test_placeholders_are_rewritten_outside_literals():
+    assert to_pyformat("SELECT * FROM q WHERE a = ? AND b LIKE '%?%' AND c LIKE ?") == \
+        "SELECT * FROM q WHERE a = %s AND b LIKE '%?%' AND c LIKE %s"
+    assert to_pyformat("SELECT 100 % 7 WHERE x = ?") == "SELECT 100 %% 7 WHERE x = %s"
+
+@pytest.mark.parametrize('table', ['serial_ids', 'rowid_ids'])
+def test_sqlite_insert_fills_in_ids(sqlite_db, table):
+    first = insert(sqlite_db, table, {'name': 'a'})
+    ids = insert_many(sqlite_db, table, ('name',), [('b',), ('c',)])
+    assert [first] + ids == [1, 2, 3]
+    rows = sqlite_db.execute(f'SELECT id, name FROM {table} ORDER BY id').fetchall()
+    assert [(r['id'], r['name']) for r in rows] == [(1, 'a'), (2, 'b'), (3, 'c')]
+
+def test_sqlite_insert_many_holds_the_write_lock(sqlite_db, tmp_path):
+    # Another connection inserts just as the batch reads MAX(rowid); it must wait for the batch to commit
+    other = connect(str(tmp_path / 'storage.db'))
+    writer = threading.Thread(target=lambda: (other.execute("INSERT INTO serial_ids (name) VALUES ('other')"), other.commit()))
+    def interleave(sql):
+        if 'MAX(rowid)' in sql and not writer.is_alive():
+            writer.start()
+            writer.join(0.2)
+    sqlite_db.set_trace_callback(interleave)
+    ids = insert_many(sqlite_db, 'serial_ids', ('name',), [('b',), ('c',)])
+    sqlite_db.set_trace_callback(None)
+    sqlite_db.commit()
+    writer.join()
+    other.close()
+    rows = sqlite_db.execute('SELECT id, name FROM serial_ids ORDER BY rowid').fetchall()
+    assert ids == [1, 2]
+    assert [(r['id'], r['name']) for r in rows] == [(1, 'b'), (2, 'c'), (None, 'other')]
+
+def test_sqlite_arrays_round_trip_as_json():
+    assert SQLITE.decode_array(SQLITE.encode_array([3, 1])) == [3, 1]
+    assert SQLITE.encode_array(None) is None
+
+@pytest.mark.skipif(not POSTGRES_DSN, reason='set TEST_POSTGRES_DSN to run against PostgreSQL')
+def test_postgres_insert_returning_and_arrays():
+    pytest.importorskip('psycopg2')
+    db = connect(POSTGRES_DSN)
+    try:
+        assert backend_of(db) is POSTGRES
+        db.execute('CREATE TEMP TABLE storage_check (id SERIAL PRIMARY KEY, name TEXT, picks INTEGER[])')
+        first = insert(db, 'storage_check', {'name': 'a', 'picks': POSTGRES.encode_array([1, 2])})
+        ids = insert_many(db, 'storage_check', ('name', 'picks'), [('b', [3]), ('c', None)])
+        assert ids == [first + 1, first + 2]
+        row = db.execute('SELECT name, picks FROM storage_check WHERE id = ?', (first,)).fetchone()
+        assert row['name'] == 'a' and POSTGRES.decode_array(row['picks']) == [1, 2]
+        assert db.in_transaction
+    finally:
+        db.rollback()
+        db.close()
@@ -0,0 +1,160 @@
+import multiprocessing
+import os
+import sqlite3
+import pytest
+import threading
+import time
+from user_management import app, get_db
+import test_management
+import submissions
+from submissions import SubmissionBuffer, journal_path, journal_paths
+from scoring import answer_keys
+
+@pytest.fixture(autouse=True)
+def setup_db(monkeypatch, database):
+    monkeypatch.setitem(app.config, 'SUBMISSION_WRITE_BEHIND', True)
+    # The committer only runs when a test drains the buffer or a batch fills up
+    monkeypatch.setitem(app.config, 'SUBMISSION_COMMIT_INTERVAL', 60)
+    monkeypatch.setitem(app.config, 'SUBMISSION_BATCH_SIZE', 1000)
+    monkeypatch.setattr(test_management, 'submission_buffer', SubmissionBuffer())
+    yield
+    test_management.submission_buffer.stop()
+    answer_keys.invalidate()
+
+@pytest.fixture
+def paper(make_paper):
+    test_id, [q] = make_paper(name='Burst')
+    return test_id, q['id'], q['options'][0]['id']
+
+def submit(client, test_id, headers, question_id, option_id):
+    return client.post(f'/api/v1/tests/{test_id}/attempt', headers=headers,
+                       json={'answers': [{'question_id': question_id, 'selected_option_ids': [option_id]}]})
+
+def attempt_count():
+    with app.app_context():
+        return get_db().execute('SELECT COUNT(*) FROM test_attempts WHERE submitted_at IS NOT NULL').fetchone()[0]
+
+def test_submission_is_acknowledged_then_group_committed(client, headers_for, paper):
+    test_id, qid, right = paper
+    buffer = test_management.submission_buffer
+    assert submit(client, test_id, headers_for(10), qid, right).status_code == 202
+    assert submit(client, test_id, headers_for(10), qid, right).status_code == 400
+    assert submit(client, test_id, headers_for(11), qid, right).status_code == 202
+    assert client.get(f'/api/v1/tests/{test_id}/attempt', headers=headers_for(10)).status_code == 202
+    assert attempt_count() == 0
+    buffer.drain()
+    assert (buffer.committed, buffer.batches) == (2, 1)
+    attempt = client.get(f'/api/v1/tests/{test_id}/attempt', headers=headers_for(10)).get_json()
+    assert attempt['score'] == 1
+    assert submit(client, test_id, headers_for(10), qid, right).status_code == 400
+    with open(journal_path(app.config['DATABASE'], app.config)) as f:
+        assert f.read() == ''
+
+def crashed_writer(client, test_id, headers, qid, option_id):
+    """Submit from a child process that dies before committing; returns its pid."""
+    def run():
+        for h in headers:
+            submit(client, test_id, h, qid, option_id)
+        os._exit(0)
+    child = multiprocessing.get_context('fork').Process(target=run)
+    child.start()
+    child.join()
+    return child.pid
+
+def test_journal_is_replayed_after_a_crash(monkeypatch, client, headers_for, paper):
+    test_id, qid, right = paper
+    pid = crashed_writer(client, test_id, [headers_for(i) for i in (10, 11, 12)], qid, right)
+    # Student 10's submission reached the database before the crash; the rest did not
+    with app.app_context():
+        db = get_db()
+        db.execute('INSERT INTO test_attempts (id, test_id, user_id, submitted_at, score) VALUES (99, ?, 10, CURRENT_TIMESTAMP, 1)', (test_id,))
+        db.commit()
+    orphan = journal_path(app.config['DATABASE'], app.config, pid)
+    with open(orphan, 'a') as f:
+        f.write('{"db": "torn')
+    # A new process adopts the dead one's journal
+    restarted = SubmissionBuffer()
+    monkeypatch.setattr(test_management, 'submission_buffer', restarted)
+    restarted.start(app)
+    restarted.stop()
+    assert restarted.committed == 3
+    assert attempt_count() == 3
+    assert not os.path.exists(orphan)
+    assert client.get(f'/api/v1/tests/{test_id}/attempt', headers=headers_for(11)).get_json()['score'] == 1
+
+def in_child(run):
+    """Run in a forked process; returns its exit code."""
+    child = multiprocessing.get_context('fork').Process(target=lambda: os._exit(run()))
+    child.start()
+    child.join()
+    return child.exitcode
+
+def test_two_writer_processes_keep_their_own_journals(client, headers_for, paper):
+    test_id, qid, right = paper
+    database = app.config['DATABASE']
+    buffer = test_management.submission_buffer
+    # This process acknowledges two submissions; another one acknowledges three and dies
+    assert submit(client, test_id, headers_for(10), qid, right).status_code == 202
+    pid = crashed_writer(client, test_id, [headers_for(i) for i in (20, 21, 22)], qid, right)
+    assert submit(client, test_id, headers_for(11), qid, right).status_code == 202
+    # Committing ours empties our journal only
+    buffer.drain()
+    assert attempt_count() == 2
+    with open(journal_path(database, app.config)) as f:
+        assert f.read() == ''
+    with open(journal_path(database, app.config, pid)) as f:
+        assert len(f.readlines()) == 3
+    # A third process takes over the dead one's journal but not ours, which is still locked
+    def restart():
+        restarted = SubmissionBuffer()
+        restarted.start(app)
+        restarted.stop()
+        return restarted.committed
+    assert in_child(restart) == 3
+    assert attempt_count() == 2 + 3
+    assert not os.path.exists(journal_path(database, app.config, pid))
+    assert journal_path(database, app.config) in journal_paths(database, app.config)
+
+def test_transient_errors_are_retried_not_dropped(monkeypatch, client, headers_for, paper):
+    test_id, qid, right = paper
+    buffer = test_management.submission_buffer
+    assert submit(client, test_id, headers_for(10), qid, right).status_code == 202
+    real = submissions.record_attempt
+    calls = []
+    def busy_once(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            raise sqlite3.OperationalError('database is locked')
+        return real(*args, **kwargs)
+    monkeypatch.setattr(submissions, 'record_attempt', busy_once)
+    with pytest.raises(sqlite3.OperationalError):
+        buffer.drain()
+    assert attempt_count() == 0
+    buffer.drain()
+    assert attempt_count() == 1 and buffer.committed == 1
+
+def test_burst_of_submissions_is_batched(monkeypatch, headers_for, paper):
+    monkeypatch.setitem(app.config, 'SUBMISSION_COMMIT_INTERVAL', 0.01)
+    monkeypatch.setitem(app.config, 'SUBMISSION_BATCH_SIZE', 50)
+    test_id, qid, right = paper
+    students = 200
+    errors = []
+    def run(user_ids):
+        with app.test_client() as c:
+            for user_id in user_ids:
+                status = submit(c, test_id, headers_for(user_id), qid, right).status_code
+                if status != 202:
+                    errors.append(status)
+    started = time.perf_counter()
+    threads = [threading.Thread(target=run, args=(range(100 + i, 100 + students, 8),)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    buffer = test_management.submission_buffer
+    buffer.stop()
+    elapsed = time.perf_counter() - started
+    assert errors == []
+    assert attempt_count() == students
+    assert buffer.batches < students
+    print(f'{students / elapsed:.0f} submissions/s in {buffer.batches} batches')
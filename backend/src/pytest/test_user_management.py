@@ -6,7 +6,7 @@ from user_management import app, init_db, get_db
 import builtins
 import smtplib
 from unittest import mock
-from user_management import send_verification_email
+from user_management import send_verification_email, generate_jwt
 import base64, os
 import tempfile
 import sqlite3
@@ -19,9 +19,7 @@ def test_db_file():
     os.unlink(db_path)
 
 @pytest.fixture(autouse=True)
-def setup_and_teardown_db(monkeypatch, test_db_file):
-    app.config['TESTING'] = True
-    app.config['SECRET_KEY'] = 'test_secret'
+def setup_and_teardown_db(monkeypatch, test_db_file, app_config):
     monkeypatch.setattr('user_management.DATABASE', test_db_file)
     with app.app_context():
         init_db()
@@ -377,4 +375,198 @@ def test_unauthorized_access(client):
     user_token = resp.get_json()['token']
     headers = {'Authorization': f'Bearer {user_token}'}
     resp = client.get('/users', headers=headers)
-    assert resp.status_code == 401
\ No newline at end of file
+    assert resp.status_code == 401
+
+def test_list_users_keyset_pagination(client):
+    with app.app_context():
+        db = get_db()
+        now = datetime.datetime.utcnow()
+        for i in range(5):
+            db.execute(
+                'INSERT INTO users (email, password_hash, role, is_email_verified, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (f'page{i}@example.com', 'hashed', 'admin', True, now, now)
+            )
+        db.commit()
+        admin = db.execute('SELECT * FROM users WHERE email = ?', ('page0@example.com',)).fetchone()
+        headers = {'Authorization': f'Bearer {generate_jwt(admin)}'}
+    resp = client.get('/users?limit=2&fields=email', headers=headers)
+    assert resp.status_code == 200
+    page = resp.get_json()
+    assert [u['email'] for u in page['items']] == ['page0@example.com', 'page1@example.com']
+    assert set(page['items'][0]) == {'id', 'email'}
+    resp = client.get(f"/users?limit=2&after_id={page['next_cursor']}", headers=headers)
+    assert [u['email'] for u in resp.get_json()['items']] == ['page2@example.com', 'page3@example.com']
+
+def test_list_users_without_page_args_returns_every_user(client):
+    with app.app_context():
+        db = get_db()
+        now = datetime.datetime.utcnow()
+        db.executemany(
+            'INSERT INTO users (email, password_hash, role, is_email_verified, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+            [(f'bulk{i}@example.com', 'hashed', 'admin', True, now, now) for i in range(1001)]
+        )
+        db.commit()
+        admin = db.execute('SELECT * FROM users WHERE email = ?', ('bulk0@example.com',)).fetchone()
+        headers = {'Authorization': f'Bearer {generate_jwt(admin)}'}
+    resp = client.get('/users', headers=headers)
+    assert resp.status_code == 200
+    assert len(resp.get_json()) == 1001
+    assert 'X-Next-Cursor' not in resp.headers
+
+def test_logout_revokes_token_and_cache_respects_exp(client):
+    import time
+    import jwt
+    from auth import token_cache
+    with app.app_context():
+        token = generate_jwt({'id': 1, 'role': 'admin'})
+    headers = {'Authorization': f'Bearer {token}'}
+    hits = token_cache.hits
+    assert client.get('/admin/db/pool', headers=headers).status_code == 200
+    assert client.get('/admin/db/pool', headers=headers).status_code == 200
+    assert token_cache.hits == hits + 1
+    assert client.post('/auth/logout', headers=headers).status_code == 200
+    assert client.get('/admin/db/pool', headers=headers).status_code == 401
+    assert client.post('/auth/logout', headers=headers).status_code == 401
+    # A cached payload is not served past the token's exp
+    short = jwt.encode({'user_id': 2, 'role': 'admin', 'exp': int(time.time()) + 1}, 'test_secret', algorithm='HS256')
+    headers = {'Authorization': f'Bearer {short}'}
+    assert client.get('/admin/db/pool', headers=headers).status_code == 200
+    time.sleep(1.5)
+    assert client.get('/admin/db/pool', headers=headers).status_code == 401
+    # Nor for a token signed with another secret
+    forged = jwt.encode({'user_id': 1, 'role': 'admin'}, 'other_secret', algorithm='HS256')
+    assert client.get('/admin/db/pool', headers={'Authorization': f'Bearer {forged}'}).status_code == 401
+
+def test_stale_revocation_list_is_reloaded_by_one_thread(monkeypatch, test_db_file):
+    import threading
+    import time
+    import auth
+    monkeypatch.setitem(app.config, 'DATABASE', test_db_file)
+    revocations = auth.RevocationList()
+    with app.app_context():
+        assert not revocations.is_revoked(test_db_file, 'digest')
+    assert revocations.loads == 1
+    real_connect = auth.connect
+    def slow_connect(*args):
+        time.sleep(0.2)
+        return real_connect(*args)
+    monkeypatch.setattr(auth, 'connect', slow_connect)
+    monkeypatch.setitem(app.config, 'AUTH_REVOCATION_REFRESH', 0)
+    def check():
+        with app.app_context():
+            revocations.is_revoked(test_db_file, 'digest')
+    threads = [threading.Thread(target=check) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert revocations.loads == 2
+
+def register_verified(client, email, password):
+    client.post('/auth/register', json={'email': email, 'password': password, 'role': 'student'})
+    client.post('/auth/verify-email', json={'token': get_verification_token(email)})
+
+def test_login_rehashes_under_new_settings(client, monkeypatch):
+    register_verified(client, 'rehash@example.com', 'pass123')
+    assert find_user_by_email_db('rehash@example.com')['password_hash'].startswith('pbkdf2:sha256:')
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_METHOD', 'scrypt:16384')
+    assert client.post('/auth/login', json={'email': 'rehash@example.com', 'password': 'wrong'}).status_code == 401
+    assert find_user_by_email_db('rehash@example.com')['password_hash'].startswith('pbkdf2:sha256:')
+    assert client.post('/auth/login', json={'email': 'rehash@example.com', 'password': 'pass123'}).status_code == 200
+    rehashed = find_user_by_email_db('rehash@example.com')['password_hash']
+    assert rehashed.startswith('scrypt:16384:8:1$')
+    assert client.post('/auth/login', json={'email': 'rehash@example.com', 'password': 'pass123'}).status_code == 200
+    assert find_user_by_email_db('rehash@example.com')['password_hash'] == rehashed
+
+def test_login_storm_is_shed_with_429(client, monkeypatch):
+    import threading
+    import passwords
+    register_verified(client, 'storm@example.com', 'pass123')
+    hasher = passwords.PasswordHasher()
+    monkeypatch.setattr(passwords, 'password_hasher', hasher)
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_WORKERS', 0)
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_MAX_PENDING', 1)
+    busy, release = threading.Event(), threading.Event()
+    def hold():
+        with app.app_context():
+            hasher.run(lambda: (busy.set(), release.wait(5)))
+    holder = threading.Thread(target=hold)
+    holder.start()
+    busy.wait(5)
+    resp = client.post('/auth/login', json={'email': 'storm@example.com', 'password': 'pass123'})
+    assert resp.status_code == 429
+    assert resp.headers['Retry-After'] == '1'
+    release.set()
+    holder.join()
+    assert client.post('/auth/login', json={'email': 'storm@example.com', 'password': 'pass123'}).status_code == 200
+    assert hasher.rejected == 1
+
+def test_timed_out_hash_keeps_its_slot_until_it_finishes(monkeypatch):
+    import asyncio
+    import time
+    import passwords
+    hasher = passwords.PasswordHasher()
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_WORKERS', 1)
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_MAX_PENDING', 1)
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_TIMEOUT', 0.05)
+    try:
+        with app.app_context():
+            with pytest.raises(TimeoutError):
+                hasher.run(time.sleep, 0.5)
+            # The abandoned hash is still running in the pool
+            with pytest.raises(passwords.PasswordHashBusy):
+                hasher.run(abs, -1)
+            with pytest.raises(passwords.PasswordHashBusy):
+                asyncio.run(hasher.run_async(app.config, abs, -1))
+            time.sleep(0.6)
+            assert hasher.run(abs, -1) == 1
+            with pytest.raises(asyncio.TimeoutError):
+                asyncio.run(hasher.run_async(app.config, time.sleep, 0.5))
+            with pytest.raises(passwords.PasswordHashBusy):
+                hasher.run(abs, -1)
+            time.sleep(0.6)
+            assert asyncio.run(hasher.run_async(app.config, abs, -2)) == 2
+    finally:
+        hasher.shutdown()
+
+def test_request_log_is_sampled_redacted_and_skips_hot_routes(client, monkeypatch, caplog, test_db_file):
+    import logging
+    monkeypatch.setitem(app.config, 'DATABASE', test_db_file)
+    monkeypatch.setitem(app.config, 'LOG_SAMPLE_RATE', 0.0)
+    monkeypatch.setitem(app.config, 'LOG_ROUTE_SAMPLE_RATES', {'login': 1.0})
+    monkeypatch.setitem(app.config, 'LOG_BODIES', True)
+    with app.app_context():
+        token = generate_jwt({'id': 1, 'role': 'student'})
+    headers = {'Authorization': f'Bearer {token}'}
+    with caplog.at_level(logging.INFO, logger='begining.requests'):
+        client.post('/auth/login', json={'email': 'nobody@example.com', 'password': 'hunter2'})
+        client.post('/auth/register', json={'email': 'x@example.com'})
+        client.get('/api/v1/tests/1/questions', headers=headers)
+    records = [r for r in caplog.records if r.name == 'begining.requests']
+    assert len(records) == 1
+    fields = records[0].fields
+    assert (fields['endpoint'], fields['status']) == ('login', 401)
+    assert fields['request_body'] == {'email': 'nobody@example.com', 'password': '[REDACTED]'}
+    assert fields['response_body'] == {'message': 'Invalid credentials'}
+    assert 'hunter2' not in caplog.text
+    # Hot routes are left out even when sampled, unless LOG_HOT_ROUTES is set
+    monkeypatch.setitem(app.config, 'LOG_SAMPLE_RATE', 1.0)
+    caplog.clear()
+    with caplog.at_level(logging.INFO, logger='begining.requests'):
+        client.get('/api/v1/tests/1/questions', headers=headers)
+        monkeypatch.setitem(app.config, 'LOG_HOT_ROUTES', True)
+        client.get('/api/v1/tests/1/questions', headers=headers)
+    assert [r.fields['endpoint'] for r in caplog.records if r.name == 'begining.requests'] == ['test_management.get_test_questions']
+
+def test_logging_settings_apply_after_import(client, monkeypatch, caplog, test_db_file):
+    import logging
+    import request_logging
+    monkeypatch.setitem(app.config, 'DATABASE', test_db_file)
+    monkeypatch.setitem(app.config, 'LOG_SAMPLE_RATE', 1.0)
+    monkeypatch.setitem(app.config, 'LOG_REQUESTS', False)
+    with caplog.at_level(logging.INFO, logger='begining.requests'):
+        client.post('/auth/login', json={'email': 'nobody@example.com', 'password': 'x'})
+    assert [r for r in caplog.records if r.name == 'begining.requests'] == []
+    # The root logger already has pytest's handlers, so the first request left them in place
+    assert os.getpid() in request_logging._installed and request_logging._installed[os.getpid()] is None
+    assert not any(isinstance(h, logging.handlers.QueueHandler) for h in logging.getLogger().handlers)
@@ -0,0 +1,305 @@
+from collections import Counter, defaultdict
+from datetime import datetime
+from storage import backend_of
+from db import fill_ids
+
+# --- Materialized per-test analytics ---
+# Scoring feeds every attempt through a StatsDelta, which is added onto the
+# test_stats / test_score_histogram / test_question_stats / test_option_stats
+# rows with upserts. Reads never touch test_attempts.
+PERCENTILES = (25, 50, 75, 90)
+REBUILD_BATCH_SIZE = 500
+
+class StatsDelta:
+    """Counts to add onto one test's analytics rows."""
+
+    def __init__(self, test_id):
+        self.test_id = test_id
+        self.attempts = 0
+        self.score_sum = 0
+        self.histogram = Counter()
+        self.questions = defaultdict(lambda: [0, 0, 0, 0.0])  # answered, graded, correct, time_seconds_sum
+        self.options = Counter()  # (question_id, option_id) -> picks
+
+    def add_attempt(self, key, score, started_at, answers):
+        """answers: [(question_id, selected_option_ids, is_correct, answered_at)]"""
+        self.attempts += 1
+        self.score_sum += score or 0
+        self.histogram[int(round(score or 0))] += 1
+        times = question_times(started_at, [(question_id, answered_at) for question_id, _, _, answered_at in answers])
+        for question_id, selected, is_correct, answered_at in answers:
+            stats = self.questions[question_id]
+            stats[0] += 1
+            if is_correct is not None:
+                stats[1] += 1
+                stats[2] += int(bool(is_correct))
+            stats[3] += times.get(question_id, 0)
+            question = key.questions.get(question_id)
+            for option_id in selected or ():
+                if question and option_id in question.option_ids:
+                    self.options[(question_id, option_id)] += 1
+
+    def apply(self, db):
+        if not self.attempts:
+            return
+        t = self.test_id
+        db.execute('INSERT INTO test_stats (test_id, attempts, score_sum, updated_at) VALUES (?, ?, ?, ?)'
+                   ' ON CONFLICT (test_id) DO UPDATE SET attempts = test_stats.attempts + excluded.attempts,'
+                   ' score_sum = test_stats.score_sum + excluded.score_sum, updated_at = excluded.updated_at',
+                   (t, self.attempts, self.score_sum, datetime.utcnow()))
+        db.executemany('INSERT INTO test_score_histogram (test_id, score, attempts) VALUES (?, ?, ?)'
+                       ' ON CONFLICT (test_id, score) DO UPDATE SET attempts = test_score_histogram.attempts + excluded.attempts',
+                       [(t, score, n) for score, n in self.histogram.items()])
+        db.executemany('INSERT INTO test_question_stats (test_id, question_id, answered, graded, correct, time_seconds_sum) VALUES (?, ?, ?, ?, ?, ?)'
+                       ' ON CONFLICT (test_id, question_id) DO UPDATE SET answered = test_question_stats.answered + excluded.answered,'
+                       ' graded = test_question_stats.graded + excluded.graded, correct = test_question_stats.correct + excluded.correct,'
+                       ' time_seconds_sum = test_question_stats.time_seconds_sum + excluded.time_seconds_sum',
+                       [(t, qid, *stats) for qid, stats in self.questions.items()])
+        db.executemany('INSERT INTO test_option_stats (test_id, question_id, option_id, picks) VALUES (?, ?, ?, ?)'
+                       ' ON CONFLICT (test_id, option_id) DO UPDATE SET picks = test_option_stats.picks + excluded.picks',
+                       [(t, qid, oid, n) for (qid, oid), n in self.options.items()])
+
+def question_times(started_at, answers):
+    """{question_id: seconds spent} for [(question_id, answered_at)].
+
+    A question's time runs from the previous save (or the start) to its own;
+    answers saved together, as in an all-at-once submit, split that time evenly.
+    """
+    times = {}
+    if not started_at:
+        return times
+    saved_at = defaultdict(list)
+    for question_id, answered_at in answers:
+        if answered_at:
+            saved_at[answered_at].append(question_id)
+    previous = started_at
+    for answered_at in sorted(saved_at):
+        question_ids = saved_at[answered_at]
+        spent = max((answered_at - previous).total_seconds(), 0) / len(question_ids)
+        for question_id in question_ids:
+            times[question_id] = spent
+        previous = max(previous, answered_at)
+    return times
+
+STATS_TABLES = ('test_stats', 'test_score_histogram', 'test_question_stats', 'test_option_stats')
+
+def clear_test_stats(db, test_id):
+    for table in STATS_TABLES:
+        db.execute(f'DELETE FROM {table} WHERE test_id = ?', (test_id,))
+
+def rebuild_test_stats(db, key):
+    """Recompute a test's analytics from its stored attempts, REBUILD_BATCH_SIZE attempts at a time.
+
+    Only needed after re-scoring or for backfill; the caller commits.
+    """
+    decode = backend_of(db).decode_array
+    clear_test_stats(db, key.test_id)
+    last_id = 0
+    while True:
+        attempts = db.execute('SELECT id, score, started_at FROM test_attempts WHERE test_id = ? AND submitted_at IS NOT NULL AND id > ? ORDER BY id LIMIT ?',
+                              (key.test_id, last_id, REBUILD_BATCH_SIZE)).fetchall()
+        if not attempts:
+            break
+        answers = defaultdict(list)
+        ids = [a['id'] for a in attempts]
+        for r in db.execute(f"SELECT attempt_id, question_id, selected_option_ids, is_correct, answered_at FROM attempt_answers"
+                            f" WHERE attempt_id IN ({', '.join('?' * len(ids))})", ids):
+            answers[r['attempt_id']].append((r['question_id'], decode(r['selected_option_ids']),
+                                             None if r['is_correct'] is None else bool(r['is_correct']), r['answered_at']))
+        delta = StatsDelta(key.test_id)
+        for a in attempts:
+            delta.add_attempt(key, a['score'], a['started_at'], answers[a['id']])
+        delta.apply(db)
+        last_id = ids[-1]
+
+def percentile(histogram, total, p):
+    """Nearest-rank percentile of a [(score, count)] histogram sorted by score."""
+    rank = max(1, -(-p * total // 100))
+    seen = 0
+    for score, count in histogram:
+        seen += count
+        if seen >= rank:
+            return score
+    return None
+
+def read_test_stats(db, test_id):
+    """Analytics for a test from the precomputed rows only."""
+    stats = db.execute('SELECT attempts, score_sum FROM test_stats WHERE test_id = ?', (test_id,)).fetchone()
+    attempts = stats['attempts'] if stats else 0
+    histogram = [(r['score'], r['attempts']) for r in
+                 db.execute('SELECT score, attempts FROM test_score_histogram WHERE test_id = ? ORDER BY score', (test_id,))]
+    options = defaultdict(list)
+    for r in db.execute('SELECT question_id, option_id, picks FROM test_option_stats WHERE test_id = ? ORDER BY option_id', (test_id,)):
+        options[r['question_id']].append({'option_id': r['option_id'], 'picks': r['picks']})
+    question_stats = []
+    topics = defaultdict(lambda: [0, 0])
+    for r in db.execute('SELECT s.question_id, s.answered, s.graded, s.correct, s.time_seconds_sum, q.topic_id'
+                        ' FROM test_question_stats s LEFT JOIN questions q ON q.id = s.question_id'
+                        ' WHERE s.test_id = ? ORDER BY s.question_id', (test_id,)):
+        question_stats.append({
+            'question_id': r['question_id'],
+            'topic_id': r['topic_id'],
+            'answered': r['answered'],
+            'correct': r['correct'],
+            'correct_rate': round(r['correct'] / r['graded'], 4) if r['graded'] else None,
+            'avg_time_seconds': round(float(r['time_seconds_sum']) / r['answered'], 2) if r['answered'] else None,
+            'option_picks': options.get(r['question_id'], []),
+        })
+        topics[r['topic_id']][0] += r['graded']
+        topics[r['topic_id']][1] += r['correct']
+    return {
+        'test_id': test_id,
+        'average_score': round(float(stats['score_sum']) / attempts, 4) if attempts else None,
+        'highest_score': histogram[-1][0] if histogram else None,
+        'lowest_score': histogram[0][0] if histogram else None,
+        'total_attempts': attempts,
+        'score_histogram': [{'score': score, 'attempts': n} for score, n in histogram],
+        'percentiles': {f'p{p}': percentile(histogram, attempts, p) for p in PERCENTILES} if attempts else {},
+        'question_stats': question_stats,
+        'topic_stats': [{'topic_id': topic_id, 'graded_answers': graded,
+                         'correct_rate': round(correct / graded, 4) if graded else None}
+                        for topic_id, (graded, correct) in sorted(topics.items(), key=lambda t: (t[0] is None, t[0] or 0))],
+    }
+
+# --- Per-student running averages in the analytics table ---
+# Every scored attempt is an event; for each (subject, topic) it touches the
+# event's score is the percentage of its graded answers in that topic that
+# were correct. Rows keep a running mean, so events are folded in without
+# rereading history, and live scoring and backfill share the same code.
+STRENGTH_THRESHOLD = 75
+WEAKNESS_THRESHOLD = 50
+PROGRESS_POINTS = 20
+
+def topic_percentages(key, answers):
+    """{(subject_id, topic_id): percent correct} for [(question_id, is_correct)]."""
+    totals = defaultdict(lambda: [0, 0])
+    for question_id, is_correct in answers:
+        question = key.questions.get(question_id)
+        if question is None or is_correct is None:
+            continue
+        group = totals[(question.subject_id, question.topic_id)]
+        group[0] += 1
+        group[1] += int(bool(is_correct))
+    return {group: 100.0 * correct / graded for group, (graded, correct) in totals.items()}
+
+class StudentAggregator:
+    """Folds scored-attempt events into per-(user, subject, topic) running means."""
+
+    def __init__(self):
+        self.groups = {}  # (user_id, subject_id, topic_id) -> [count, mean, last_attempt_at]
+
+    def consume(self, key, user_id, submitted_at, answers):
+        for (subject_id, topic_id), percent in topic_percentages(key, answers).items():
+            group = self.groups.setdefault((user_id, subject_id, topic_id), [0, 0.0, None])
+            group[0] += 1
+            group[1] += (percent - group[1]) / group[0]
+            if submitted_at and (group[2] is None or submitted_at > group[2]):
+                group[2] = submitted_at
+
+    def apply(self, db):
+        # Merge each batch mean into the stored one: avg += (batch_avg - avg) * k / (n + k)
+        db.executemany(
+            'INSERT INTO analytics (user_id, subject_id, topic_id, total_attempts, avg_score, last_attempt_at) VALUES (?, ?, ?, ?, ?, ?)'
+            ' ON CONFLICT (user_id, COALESCE(subject_id, 0), COALESCE(topic_id, 0)) DO UPDATE SET'
+            # 1.0 keeps it real arithmetic: SQLite stores whole NUMERIC means as INTEGER
+            ' avg_score = analytics.avg_score + (excluded.avg_score - analytics.avg_score) * 1.0 * excluded.total_attempts'
+            ' / (analytics.total_attempts + excluded.total_attempts),'
+            ' total_attempts = analytics.total_attempts + excluded.total_attempts,'
+            ' last_attempt_at = CASE WHEN analytics.last_attempt_at IS NULL OR excluded.last_attempt_at > analytics.last_attempt_at'
+            ' THEN excluded.last_attempt_at ELSE analytics.last_attempt_at END',
+            [(user_id, subject_id, topic_id, count, mean, last)
+             for (user_id, subject_id, topic_id), (count, mean, last) in self.groups.items()])
+        fill_ids(db, 'analytics')
+        self.groups = {}
+
+def rebuild_student_analytics(db, keys, test_id=None, progress=None):
+    """Replay stored attempts into the analytics table in REBUILD_BATCH_SIZE chunks.
+
+    keys(test_id) returns the AnswerKey for a test. With test_id, only the
+    students who attempted that test are rebuilt (after a re-score). Each
+    chunk is committed when progress is given. Returns the attempts replayed.
+    """
+    user_scope = ' AND user_id IN (SELECT user_id FROM test_attempts WHERE test_id = ?)' if test_id is not None else ''
+    scope = (test_id,) if test_id is not None else ()
+    db.execute(f'DELETE FROM analytics WHERE 1=1{user_scope}', scope)
+    total = db.execute(f'SELECT COUNT(*) FROM test_attempts WHERE submitted_at IS NOT NULL{user_scope}', scope).fetchone()[0]
+    aggregator = StudentAggregator()
+    done = 0
+    last_id = 0
+    while True:
+        attempts = db.execute(f'SELECT id, test_id, user_id, submitted_at FROM test_attempts WHERE id > ? AND submitted_at IS NOT NULL{user_scope} ORDER BY id LIMIT ?',
+                              (last_id,) + scope + (REBUILD_BATCH_SIZE,)).fetchall()
+        if not attempts:
+            break
+        ids = [a['id'] for a in attempts]
+        answers = defaultdict(list)
+        for r in db.execute(f"SELECT attempt_id, question_id, is_correct FROM attempt_answers WHERE attempt_id IN ({', '.join('?' * len(ids))})", ids):
+            answers[r['attempt_id']].append((r['question_id'], None if r['is_correct'] is None else bool(r['is_correct'])))
+        for a in attempts:
+            aggregator.consume(keys(a['test_id']), a['user_id'], a['submitted_at'], answers[a['id']])
+        aggregator.apply(db)
+        done += len(ids)
+        last_id = ids[-1]
+        if progress:
+            progress(done, total)
+    return done
+
+def read_student_analytics(db, key, attempt, max_score):
+    """Analytics for one student's attempt: breakdown from its answers, trends from the analytics table."""
+    user_id = attempt['user_id']
+    answers = db.execute('SELECT question_id, is_correct, answered_at FROM attempt_answers WHERE attempt_id = ? ORDER BY id',
+                         (attempt['id'],)).fetchall()
+    times = question_times(attempt['started_at'], [(a['question_id'], a['answered_at']) for a in answers])
+    groups = defaultdict(lambda: [0, 0])
+    time_per_question = []
+    graded = correct = 0
+    for a in answers:
+        question = key.questions.get(a['question_id'])
+        if question is None:
+            continue
+        if a['is_correct'] is not None:
+            group = groups[(question.subject_id, question.topic_id)]
+            group[0] += int(bool(a['is_correct']))
+            group[1] += 1
+            graded += 1
+            correct += int(bool(a['is_correct']))
+        if a['question_id'] in times:
+            time_per_question.append({'question_id': a['question_id'], 'time_spent_seconds': int(times[a['question_id']])})
+    history = db.execute('SELECT subject_id, topic_id, total_attempts, avg_score FROM analytics WHERE user_id = ?', (user_id,)).fetchall()
+    names = topic_names(db, set(groups) | {(r['subject_id'], r['topic_id']) for r in history})
+    class_stats = db.execute('SELECT attempts, score_sum FROM test_stats WHERE test_id = ?', (attempt['test_id'],)).fetchone()
+    progress = db.execute('SELECT submitted_at, score FROM test_attempts WHERE user_id = ? AND submitted_at IS NOT NULL ORDER BY submitted_at DESC LIMIT ?',
+                          (user_id, PROGRESS_POINTS)).fetchall()
+    score = attempt['score'] or 0
+    return {
+        'test_id': attempt['test_id'],
+        'user_id': user_id,
+        'total_score': score,
+        'percentage': round(100.0 * float(score) / max_score, 2) if max_score else None,
+        'is_graded': bool(attempt['is_graded']),
+        'breakdown': [{'subject_id': s, 'topic_id': t, 'subject': names.get((s, t), (None, None))[0],
+                       'topic': names.get((s, t), (None, None))[1], 'score': c, 'total': n}
+                      for (s, t), (c, n) in groups.items()],
+        'time_per_question': time_per_question,
+        'accuracy': round(correct / graded, 4) if graded else None,
+        'strengths': [topic_label(names, r) for r in history if r['avg_score'] is not None and r['avg_score'] >= STRENGTH_THRESHOLD],
+        'weaknesses': [topic_label(names, r) for r in history if r['avg_score'] is not None and r['avg_score'] < WEAKNESS_THRESHOLD],
+        'class_average': round(float(class_stats['score_sum']) / class_stats['attempts'], 4) if class_stats and class_stats['attempts'] else None,
+        'progress_over_time': [{'attempt_date': p['submitted_at'], 'score': p['score']} for p in reversed(progress)],
+    }
+
+def topic_names(db, groups):
+    """{(subject_id, topic_id): (subject name, topic name)} for the given pairs."""
+    topic_ids = sorted({t for _, t in groups if t is not None})
+    subject_ids = sorted({s for s, _ in groups if s is not None})
+    topics = {}
+    subjects = {}
+    if topic_ids:
+        topics = {r['id']: r['name'] for r in db.execute(f"SELECT id, name FROM topics WHERE id IN ({', '.join('?' * len(topic_ids))})", topic_ids)}
+    if subject_ids:
+        subjects = {r['id']: r['name'] for r in db.execute(f"SELECT id, name FROM subjects WHERE id IN ({', '.join('?' * len(subject_ids))})", subject_ids)}
+    return {(s, t): (subjects.get(s), topics.get(t)) for s, t in groups}
+
+def topic_label(names, row):
+    subject, topic = names.get((row['subject_id'], row['topic_id']), (None, None))
+    return topic or subject or f"topic {row['topic_id']}"
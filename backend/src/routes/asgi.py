@@ -0,0 +1,336 @@
+from flask import g
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import io
+import json
+import logging
+import re
+import sys
+import threading
+import time
+from auth import verify_token, app_database
+from db import get_db, PoolTimeout, DEFAULT_POOL_SIZE
+from metrics import record_request
+from request_logging import install_log_handler
+from jobs import start_workers
+from passwords import check_password_async, PasswordHashBusy, DEFAULT_RETRY_AFTER
+import test_management
+
+# --- ASGI serving mode ---
+# Under WSGI every request holds a worker thread for its whole life, so at
+# exam start concurrency is capped by the thread count: a student waiting on
+# pbkdf2 or on SQLite's write lock blocks one thread, and the next student
+# queues behind it. Here the event loop holds the connections instead, and
+# threads are only borrowed for the work that needs them:
+#
+#   - start, autosave and submit (the test-taking path) and login run as
+#     coroutines. Their SQL runs on a small pool of dedicated I/O threads
+#     (ASGI_IO_THREADS, by default one per pooled connection), and login
+#     waits on the password process pool without a thread at all.
+#   - Every other route goes to the Flask app through a WSGI bridge running
+#     on ASGI_WSGI_THREADS threads; streamed responses stay streamed.
+#
+# Both kinds of thread take connections from the same pool (DB_POOL_SIZE),
+# so under mixed load an I/O thread can still wait for a connection (and
+# answer 503 after DB_POOL_TIMEOUT). Size DB_POOL_SIZE for both if the
+# test-taking routes must never wait behind bridged requests.
+#
+# The async routes share their logic with the Flask views (start_attempt,
+# autosave_answer, submit_attempt, complete_login), so the responses match.
+# They skip Flask's request hooks: they are counted in /metrics but are not
+# profiled or request-logged (the hot test-taking routes are not logged by
+# default anyway). There is no async SQLite driver here; one thread per
+# connection is what aiosqlite does as well.
+#
+#   uvicorn asgi:application --workers 4        (cd backend/src/routes)
+#   flask --app user_management serve-asgi --workers 4
+#
+# asgi.application is created on first access, so importing this module
+# starts no threads and settings made after import still apply.
+#
+# Settings (app.config, read when the ASGI app is created):
+#   ASGI_ASYNC_ROUTES   False sends every route through the WSGI bridge
+#   ASGI_IO_THREADS     threads running the async routes' SQL (default DB_POOL_SIZE)
+#   ASGI_WSGI_THREADS   threads running bridged Flask requests (default 16)
+#   ASGI_MAX_BODY       larger request bodies get 413 (default 1 MiB)
+DEFAULT_WSGI_THREADS = 16
+DEFAULT_MAX_BODY = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+class ClientDisconnected(Exception):
+    """The client went away before its request body was complete."""
+
+class AsgiRequest:
+    def __init__(self, scope, body):
+        self.scope = scope
+        self.method = scope['method']
+        self.body = body
+        self.headers = {k.decode('latin-1').lower(): v.decode('latin-1') for k, v in scope.get('headers', [])}
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+
+    def json(self):
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            return None
+
+    def token(self):
+        auth = self.headers.get('authorization', '')
+        return auth.split(' ')[1] if auth.startswith('Bearer ') else None
+
+def wsgi_environ(scope, body):
+    """PEP 3333 environ for an ASGI http scope and its buffered body."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope.get('http_version', '1.1'),
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        key = name.decode('latin-1').upper().replace('-', '_')
+        if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            key = 'HTTP_' + key
+        value = value.decode('latin-1')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+def find_user(email):
+    return get_db(app_database()).execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
+
+class AsgiApp:
+    """ASGI 3 application serving a Flask app; see the notes above."""
+
+    def __init__(self, app):
+        self.app = app
+        config = app.config
+        self.async_routes = config.get('ASGI_ASYNC_ROUTES', True)
+        self.max_body = config.get('ASGI_MAX_BODY', DEFAULT_MAX_BODY)
+        # The async routes skip the before_request hooks that would do these
+        install_log_handler(app)
+        start_workers(app)
+        self.io = ThreadPoolExecutor(config.get('ASGI_IO_THREADS', config.get('DB_POOL_SIZE', DEFAULT_POOL_SIZE)),
+                                     thread_name_prefix='asgi-io')
+        self.wsgi = ThreadPoolExecutor(config.get('ASGI_WSGI_THREADS', DEFAULT_WSGI_THREADS),
+                                       thread_name_prefix='asgi-wsgi')
+        # (method, path pattern, (blueprint, endpoint) as Flask names them, handler)
+        self.routes = [
+            ('POST', re.compile(r'/api/v1/tests/(\d+)/start'), ('test_management', 'test_management.start_test'),
+             self.start_test),
+            ('POST', re.compile(r'/api/v1/tests/(\d+)/answer'), ('test_management', 'test_management.save_answer'),
+             self.save_answer),
+            ('POST', re.compile(r'/api/v1/tests/(\d+)/submit'), ('test_management', 'test_management.submit_test'),
+             self.submit_test),
+            ('POST', re.compile(r'/auth/login'), ('app', 'login'), self.login),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        else:
+            await send({'type': 'websocket.close', 'code': 1000})
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def close(self):
+        self.io.shutdown(wait=True)
+        self.wsgi.shutdown(wait=True)
+
+    async def read_body(self, scope, receive):
+        """The request body, or None once it is larger than ASGI_MAX_BODY.
+
+        Raises ClientDisconnected if the client leaves before the body ends;
+        a truncated body must not be handled as if it were complete.
+        """
+        for name, value in scope.get('headers', []):
+            if name.lower() == b'content-length' and value.isdigit() and int(value) > self.max_body:
+                return None
+        chunks, size = [], 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                raise ClientDisconnected()
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > self.max_body:
+                return None
+            chunks.append(chunk)
+            if not message.get('more_body'):
+                break
+        return b''.join(chunks)
+
+    async def http(self, scope, receive, send):
+        try:
+            body = await self.read_body(scope, receive)
+        except ClientDisconnected:
+            # Nobody to answer, and nothing should be saved from half a request
+            return
+        if body is None:
+            await self.respond(send, 413, {'message': 'Request body too large'})
+            return
+        route = self.match(scope) if self.async_routes else None
+        if route is None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self.wsgi, self.call_wsgi, loop, scope, body, send)
+            return
+        labels, handler, args = route
+        request = AsgiRequest(scope, body)
+        started = time.perf_counter()
+        headers = []
+        try:
+            status, payload = await handler(request, *args)
+        except PoolTimeout:
+            status, payload = 503, {'message': 'Server busy, please retry'}
+        except PasswordHashBusy:
+            status, payload = 429, {'message': 'Too many sign-in requests, please retry'}
+            headers.append((b'retry-after', str(self.app.config.get('PASSWORD_HASH_RETRY_AFTER',
+                                                                     DEFAULT_RETRY_AFTER)).encode()))
+        except Exception:
+            logger.exception('Unhandled error in %s', labels[1])
+            status, payload = 500, {'message': 'Internal server error'}
+        size = await self.respond(send, status, payload, headers)
+        if self.app.config.get('METRICS_ENABLED', True):
+            record_request(labels, request.method, status, time.perf_counter() - started, size,
+                           request.sql_count, request.sql_seconds)
+
+    def match(self, scope):
+        for method, pattern, labels, handler in self.routes:
+            if scope['method'] == method:
+                m = pattern.fullmatch(scope['path'])
+                if m:
+                    return labels, handler, [int(arg) for arg in m.groups()]
+        return None
+
+    async def respond(self, send, status, payload, headers=()):
+        body = self.app.json.dumps(payload).encode('utf-8')
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json'),
+                                (b'content-length', str(len(body)).encode())] + list(headers)})
+        await send({'type': 'http.response.body', 'body': body})
+        return len(body)
+
+    # --- SQL on the I/O threads ---
+    def _in_app_context(self, fn, args):
+        with self.app.app_context():
+            g.sql_count, g.sql_seconds = 0, 0.0
+            result = fn(*args)
+            return result, g.sql_count, g.sql_seconds
+
+    async def run_io(self, request, fn, *args):
+        """fn(*args) on an I/O thread inside an app context; the connection is released on return."""
+        loop = asyncio.get_running_loop()
+        result, count, seconds = await loop.run_in_executor(self.io, self._in_app_context, fn, args)
+        request.sql_count += count
+        request.sql_seconds += seconds
+        return result
+
+    # --- Async routes ---
+    @staticmethod
+    def as_student(token, view, test_id, *args):
+        payload = verify_token(token) if token else None
+        if not payload:
+            return 401, {'message': 'Unauthorized'}
+        body, status = view(get_db(app_database()), test_id, payload['user_id'], *args)
+        return status, body
+
+    async def start_test(self, request, test_id):
+        return await self.run_io(request, self.as_student, request.token(), test_management.start_attempt, test_id)
+
+    async def save_answer(self, request, test_id):
+        return await self.run_io(request, self.as_student, request.token(), test_management.autosave_answer, test_id,
+                                 request.json())
+
+    async def submit_test(self, request, test_id):
+        return await self.run_io(request, self.as_student, request.token(), test_management.submit_attempt, test_id)
+
+    async def login(self, request):
+        from user_management import complete_login
+        data = request.json()
+        if not isinstance(data, dict) or not data.get('email') or not data.get('password'):
+            return 400, {'message': 'Missing required fields'}
+        user = await self.run_io(request, find_user, data['email'])
+        if not user:
+            return 401, {'message': 'Invalid credentials'}
+        # The hash runs in the password process pool; no thread waits for it
+        ok, rehashed = await check_password_async(self.app.config, user['password_hash'], data['password'])
+        body, status = await self.run_io(request, lambda: complete_login(get_db(app_database()), user, ok, rehashed))
+        return status, body
+
+    # --- Everything else: the Flask app over WSGI ---
+    def call_wsgi(self, loop, scope, body, send):
+        """Run the Flask app on a bridge thread, sending the response through the loop as it is produced."""
+        def emit(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+        response = []
+        def start_response(status, headers, exc_info=None):
+            response[:] = [int(status.split(' ', 1)[0]),
+                           [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers]]
+        result = self.app(wsgi_environ(scope, body), start_response)
+        try:
+            # Hold back one chunk so the last one goes out with more_body=False
+            pending = None
+            for chunk in result:
+                if not chunk:
+                    continue
+                if pending is None:
+                    emit({'type': 'http.response.start', 'status': response[0], 'headers': response[1]})
+                else:
+                    emit({'type': 'http.response.body', 'body': pending, 'more_body': True})
+                pending = chunk
+            if pending is None:
+                emit({'type': 'http.response.start', 'status': response[0], 'headers': response[1]})
+            emit({'type': 'http.response.body', 'body': pending or b''})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+def create_asgi_app(app=None):
+    """ASGI application for app (default: the user_management app)."""
+    if app is None:
+        from user_management import app
+    return AsgiApp(app)
+
+def serve(host='127.0.0.1', port=8000, workers=1):
+    try:
+        import uvicorn
+    except ImportError:
+        raise ImportError("uvicorn is required to serve the ASGI app. Install with 'pip install uvicorn'.")
+    uvicorn.run('asgi:application', host=host, port=port, workers=workers, lifespan='on')
+
+_application = None
+_application_lock = threading.Lock()
+
+def __getattr__(name):
+    # Module-level 'application' for ASGI servers, built on first access (in each worker)
+    global _application
+    if name != 'application':
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    with _application_lock:
+        if _application is None:
+            _application = create_asgi_app()
+        return _application
@@ -0,0 +1,124 @@
+from flask import current_app
+from collections import OrderedDict
+from datetime import datetime
+import threading
+import time
+from db import fill_ids
+
+# --- Set-based test assignment ---
+# Assigning a test to a cohort resolves explicit user ids and group members
+# into one set, drops students who already have the test, and inserts the rest
+# with a single executemany. The unique (test_id, user_id) index makes a repeat
+# or retried assignment a no-op instead of a duplicate row.
+#
+# Group membership is cached per (database, group) as a frozenset of user ids,
+# so assigning several tests to the same cohort reads group_members once.
+# Changes made through the groups API invalidate it; changes made by other
+# processes show up within GROUP_MEMBERSHIP_TTL seconds.
+DEFAULT_MEMBERSHIP_CACHE_SIZE = 1024
+DEFAULT_MEMBERSHIP_TTL = 60
+
+ASSIGNMENT_COLUMNS = ('test_id', 'user_id', 'assigned_at', 'start_time', 'end_time', 'attempt_limit')
+INSERT_ASSIGNMENTS = (f"INSERT INTO test_assignments ({', '.join(ASSIGNMENT_COLUMNS)})"
+                      f" VALUES ({', '.join('?' * len(ASSIGNMENT_COLUMNS))})"
+                      ' ON CONFLICT (test_id, user_id) DO NOTHING')
+
+class AssignmentError(ValueError):
+    pass
+
+class UnknownGroups(LookupError):
+    def __init__(self, group_ids):
+        super().__init__(f"Group not found: {', '.join(str(g) for g in sorted(group_ids))}")
+        self.group_ids = group_ids
+
+def parse_ids(values, name):
+    """A list of integer ids from a request field; raises AssignmentError otherwise."""
+    if values is None:
+        return []
+    if not isinstance(values, list):
+        raise AssignmentError(f'{name} must be a list of ids')
+    try:
+        return [int(v) for v in values]
+    except (TypeError, ValueError):
+        raise AssignmentError(f'{name} must be a list of ids')
+
+class GroupMembership:
+    """Member ids per group, in an LRU keyed by (database, group id)."""
+
+    def __init__(self):
+        self._members = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.loads = 0
+
+    def resolve(self, db, group_ids):
+        """{group_id: frozenset of user ids}; raises UnknownGroups for ids with no group."""
+        db_name = getattr(db, 'db_name', None) or current_app.config.get('DATABASE')
+        config = current_app.config
+        ttl = config.get('GROUP_MEMBERSHIP_TTL', DEFAULT_MEMBERSHIP_TTL)
+        resolved = {}
+        with self._lock:
+            now = time.monotonic()
+            for gid in set(group_ids):
+                entry = self._members.get((db_name, gid))
+                if entry and now - entry[0] < ttl:
+                    self._members.move_to_end((db_name, gid))
+                    resolved[gid] = entry[1]
+            self.hits += len(resolved)
+            generation = self._generation
+        missing = sorted(set(group_ids) - set(resolved))
+        if not missing:
+            return resolved
+        loaded = {}
+        marks = ', '.join('?' * len(missing))
+        for r in db.execute(f'SELECT g.id, m.user_id FROM student_groups g LEFT JOIN group_members m'
+                            f' ON m.group_id = g.id WHERE g.id IN ({marks})', missing):
+            members = loaded.setdefault(r[0], set())
+            if r[1] is not None:
+                members.add(r[1])
+        unknown = set(missing) - set(loaded)
+        if unknown:
+            raise UnknownGroups(unknown)
+        max_size = config.get('GROUP_MEMBERSHIP_CACHE_SIZE', DEFAULT_MEMBERSHIP_CACHE_SIZE)
+        with self._lock:
+            self.loads += len(loaded)
+            # Skip caching members read while a group was being changed
+            cache = generation == self._generation
+            for gid, members in loaded.items():
+                resolved[gid] = frozenset(members)
+                if cache:
+                    self._members[(db_name, gid)] = (time.monotonic(), resolved[gid])
+                    self._members.move_to_end((db_name, gid))
+            while len(self._members) > max_size:
+                self._members.popitem(last=False)
+        return resolved
+
+    def invalidate(self, group_ids=None):
+        with self._lock:
+            self._generation += 1
+            if group_ids is None:
+                self._members.clear()
+                return
+            for key in [k for k in self._members if k[1] in group_ids]:
+                del self._members[key]
+
+group_membership = GroupMembership()
+
+def assign_test_to(db, test_id, user_ids=(), group_ids=(), start_time=None, end_time=None, attempt_limit=None):
+    """Assign test_id to the users and group members not already assigned; returns (new, targeted) counts.
+
+    Raises UnknownGroups if a group does not exist. The caller commits.
+    """
+    targets = set(user_ids)
+    for members in group_membership.resolve(db, group_ids).values() if group_ids else ():
+        targets |= members
+    if not targets:
+        return 0, 0
+    existing = {r[0] for r in db.execute('SELECT user_id FROM test_assignments WHERE test_id = ?', (test_id,))}
+    new = sorted(targets - existing)
+    if new:
+        now = datetime.utcnow()
+        db.executemany(INSERT_ASSIGNMENTS, [(test_id, uid, now, start_time, end_time, attempt_limit) for uid in new])
+        fill_ids(db, 'test_assignments')
+    return len(new), len(targets)
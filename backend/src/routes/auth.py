@@ -0,0 +1,179 @@
+from flask import request, jsonify, g, current_app
+from collections import OrderedDict
+from datetime import datetime
+from functools import wraps
+import hashlib
+import threading
+import time
+import jwt
+from db import connect, DATABASE
+
+# --- Shared authentication for every blueprint ---
+# Verifying a JWT means an HMAC and a JSON parse per request. Verified
+# payloads are kept in a bounded LRU keyed by the token's hash (and the
+# secret that verified it) until the token's exp, so a student polling an
+# exam pays that once per token rather than per request. Revoked tokens are
+# held in a set refreshed from revoked_tokens, so the check is O(1) and only
+# touches the database every AUTH_REVOCATION_REFRESH seconds. One thread
+# reloads an expired set while the others keep checking against the old one.
+ALGORITHMS = ['HS256']
+
+DEFAULT_TOKEN_CACHE_SIZE = 10000
+DEFAULT_REVOCATION_REFRESH = 30
+
+def token_hash(token):
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+class TokenCache:
+    """Verified payloads by (token hash, secret); entries expire with the token."""
+
+    def __init__(self):
+        self._payloads = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._payloads.get(key)
+            if entry is not None:
+                if entry.get('exp') is None or time.time() < entry['exp']:
+                    self._payloads.move_to_end(key)
+                    self.hits += 1
+                    return entry
+                del self._payloads[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, payload, max_size):
+        with self._lock:
+            self._payloads[key] = payload
+            self._payloads.move_to_end(key)
+            while len(self._payloads) > max_size:
+                self._payloads.popitem(last=False)
+
+    def discard(self, digest):
+        with self._lock:
+            for key in [k for k in self._payloads if k[0] == digest]:
+                del self._payloads[key]
+
+    def clear(self):
+        with self._lock:
+            self._payloads.clear()
+
+class RevocationList:
+    """Hashes of revoked, not yet expired tokens per database."""
+
+    def __init__(self):
+        self._revoked = {}  # db_name -> (loaded_at, set of hashes)
+        self._refreshing = {}  # db_name -> lock held by the thread reloading it
+        self._lock = threading.Lock()
+        self.loads = 0
+
+    def is_revoked(self, db_name, digest):
+        refresh = current_app.config.get('AUTH_REVOCATION_REFRESH', DEFAULT_REVOCATION_REFRESH)
+        with self._lock:
+            entry = self._revoked.get(db_name)
+            if entry and time.monotonic() - entry[0] < refresh:
+                return digest in entry[1]
+            loading = self._refreshing.setdefault(db_name, threading.Lock())
+        # Only the first thread to find the set stale reloads it; the rest use
+        # the old set meanwhile, or wait for the reload if there is none yet
+        if not loading.acquire(blocking=entry is None):
+            return digest in entry[1]
+        try:
+            with self._lock:
+                entry = self._revoked.get(db_name)
+                if entry and time.monotonic() - entry[0] < refresh:
+                    return digest in entry[1]
+            # Pick up tokens revoked by other processes; a short-lived connection
+            # keeps this off the request's pooled one
+            db = connect(db_name, current_app.config)
+            try:
+                revoked = {r[0] for r in db.execute('SELECT token_hash FROM revoked_tokens WHERE expires_at > ?',
+                                                    (datetime.utcnow(),))}
+            finally:
+                db.close()
+            with self._lock:
+                self._revoked[db_name] = (time.monotonic(), revoked)
+                self.loads += 1
+            return digest in revoked
+        finally:
+            loading.release()
+
+    def revoke(self, db, digest, expires_at):
+        """Record a revoked token; rows are pruned once the token would have expired anyway. The caller commits."""
+        now = datetime.utcnow()
+        db.execute('DELETE FROM revoked_tokens WHERE expires_at <= ?', (now,))
+        db.execute('INSERT INTO revoked_tokens (token_hash, expires_at, revoked_at) VALUES (?, ?, ?)'
+                   ' ON CONFLICT (token_hash) DO NOTHING', (digest, expires_at, now))
+        with self._lock:
+            entry = self._revoked.get(db.db_name)
+            if entry:
+                entry[1].add(digest)
+
+    def clear(self):
+        with self._lock:
+            self._revoked.clear()
+
+token_cache = TokenCache()
+revocations = RevocationList()
+
+def app_database():
+    """The database requests use: the app's own resolver if it registered one, else DATABASE from its config."""
+    resolve = current_app.extensions.get('database')
+    return resolve() if resolve else current_app.config.get('DATABASE', DATABASE)
+
+def verify_token(token):
+    """The token's payload, or None if it is invalid, expired or revoked."""
+    digest = token_hash(token)
+    if revocations.is_revoked(app_database(), digest):
+        return None
+    secret = current_app.config['SECRET_KEY']
+    max_size = current_app.config.get('AUTH_TOKEN_CACHE_SIZE', DEFAULT_TOKEN_CACHE_SIZE)
+    if max_size:
+        payload = token_cache.get((digest, secret))
+        if payload is not None:
+            return dict(payload)
+    try:
+        payload = jwt.decode(token, secret, algorithms=ALGORITHMS)
+    except Exception:
+        return None
+    if max_size:
+        token_cache.put((digest, secret), payload, max_size)
+    return dict(payload)
+
+def revoke_token(db, token, payload):
+    digest = token_hash(token)
+    exp = payload.get('exp')
+    expires_at = datetime.utcfromtimestamp(exp) if exp else datetime.max
+    revocations.revoke(db, digest, expires_at)
+    token_cache.discard(digest)
+
+def bearer_token():
+    auth = request.headers.get('Authorization', None)
+    if not auth or not auth.startswith('Bearer '):
+        return None
+    return auth.split(' ')[1]
+
+def login_required(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        token = bearer_token()
+        payload = verify_token(token) if token else None
+        if not payload:
+            return jsonify({'message': 'Unauthorized'}), 401
+        g.user = payload
+        return f(*args, **kwargs)
+    return decorated
+
+def role_required(*roles):
+    """Decorator (under login_required) letting only the given roles through."""
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            if not hasattr(g, 'user') or g.user.get('role') not in roles:
+                return jsonify({'message': 'Unauthorized'}), 401
+            return f(*args, **kwargs)
+        return decorated
+    return decorator
@@ -0,0 +1,138 @@
+from flask import current_app
+import atexit
+import threading
+import logging
+from db import connect, DATABASE
+from scoring import save_answers
+
+# --- Coalesced answer autosave ---
+# Students save an answer every time they change it. Saves are held in
+# memory as the latest row per (attempt, question) and written in batches,
+# so a burst of edits to one question costs one upsert, and many students'
+# saves share one executemany and one commit.
+#
+# The buffer lives in process memory. A submit flushes the attempt's waiting
+# saves only if they are in the same process, so with several worker
+# processes a save buffered in one is lost to a submit served by another.
+# Buffering is therefore off by default (every save is written through and
+# answered 200); set AUTOSAVE_FLUSH_INTERVAL only on a single-process
+# server, where buffered saves are answered 202 because they are not yet in
+# the database.
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLUSH_INTERVAL = 0
+DEFAULT_MAX_PENDING = 5000
+
+class AutosaveBuffer:
+    """Pending autosaves per database, flushed by a background thread.
+
+    AUTOSAVE_FLUSH_INTERVAL is the longest a save waits (and so the most a
+    crash can lose); 0 writes every save through on the request's connection.
+    A flush also starts early once AUTOSAVE_MAX_PENDING rows are waiting.
+    """
+
+    def __init__(self):
+        self._pending = {}  # db_name -> {(attempt_id, question_id): row}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._app = None
+        self.saves = 0
+        self.writes = 0
+        self.flushes = 0
+
+    def save(self, db, row):
+        """Write or queue one save; True once it is committed, False if it is only queued.
+
+        row: (attempt_id, question_id, selected_option_ids, answer_text, flagged, revision, answered_at)
+        """
+        interval = current_app.config.get('AUTOSAVE_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL)
+        if not interval:
+            save_answers(db, [row])
+            db.commit()
+            with self._lock:
+                self.saves += 1
+                self.writes += 1
+            return True
+        db_name = current_app.config.get('DATABASE', DATABASE)
+        with self._lock:
+            pending = self._pending.setdefault(db_name, {})
+            current = pending.get(row[:2])
+            # A retried older save must not replace a newer one still waiting
+            if current is None or row[5] >= current[5]:
+                pending[row[:2]] = row
+            self.saves += 1
+            full = len(pending) >= current_app.config.get('AUTOSAVE_MAX_PENDING', DEFAULT_MAX_PENDING)
+            if self._thread is None:
+                self._start(current_app._get_current_object(), interval)
+        if full:
+            self._wake.set()
+        return False
+
+    def take(self, db_name, attempt_id=None):
+        with self._lock:
+            pending = self._pending.get(db_name, {})
+            if attempt_id is None:
+                self._pending[db_name] = {}
+                return list(pending.values())
+            keys = [k for k in pending if k[0] == attempt_id]
+            return [pending.pop(k) for k in keys]
+
+    def restore(self, db_name, rows):
+        """Put rows back after a failed write, unless a newer save arrived meanwhile."""
+        with self._lock:
+            pending = self._pending.setdefault(db_name, {})
+            for row in rows:
+                current = pending.get(row[:2])
+                if current is None or row[5] > current[5]:
+                    pending[row[:2]] = row
+
+    def flush_attempt(self, db, attempt_id):
+        """Write the attempt's waiting saves on db (before it is submitted); the caller commits."""
+        rows = self.take(current_app.config.get('DATABASE', DATABASE), attempt_id)
+        save_answers(db, rows)
+        with self._lock:
+            self.writes += len(rows)
+
+    def pending_count(self):
+        with self._lock:
+            return sum(len(p) for p in self._pending.values())
+
+    def flush(self):
+        """Write everything waiting, one batch and commit per database."""
+        with self._lock:
+            db_names = [name for name, pending in self._pending.items() if pending]
+        for db_name in db_names:
+            rows = self.take(db_name)
+            if not rows:
+                continue
+            db = connect(db_name, self._app.config if self._app else None)
+            try:
+                save_answers(db, rows)
+                db.commit()
+            except Exception:
+                db.rollback()
+                self.restore(db_name, rows)
+                raise
+            finally:
+                db.close()
+            with self._lock:
+                self.writes += len(rows)
+                self.flushes += 1
+
+    def _start(self, app, interval):
+        self._app = app
+        self._thread = threading.Thread(target=self._run, args=(interval,), name='autosave-flusher', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self, interval):
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Autosave flush failed; will retry')
+
+autosave_buffer = AutosaveBuffer()
@@ -0,0 +1,170 @@
+from flask import g, current_app
+import os
+import re
+import threading
+import time
+from storage import backend_for, backend_of
+
+# --- Shared database access: tuned connections handed out from a bounded pool ---
+DATABASE = 'user_management.db'
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_POOL_TIMEOUT = 5.0
+
+class PoolTimeout(Exception):
+    """No connection became free within DB_POOL_TIMEOUT seconds."""
+
+def connect(db_name, config=None):
+    """Open a tuned connection for db_name (SQLite path or postgres:// URL).
+
+    config is a mapping like app.config; see storage.py for the DB_* keys.
+    """
+    db = backend_for(db_name).connect(db_name, config or {})
+    db.db_name = db_name
+    return db
+
+class ConnectionPool:
+    """Bounded LIFO pool of connections to one database."""
+
+    def __init__(self, db_name, config=None):
+        config = config or {}
+        self.db_name = db_name
+        self.config = dict(config)
+        self.max_size = config.get('DB_POOL_SIZE', DEFAULT_POOL_SIZE)
+        self.timeout = config.get('DB_POOL_TIMEOUT', DEFAULT_POOL_TIMEOUT)
+        self._idle = []
+        self._lock = threading.Condition()
+        self._closed = False
+        self.size = 0
+        self.in_use = 0
+        self.created = 0
+        self.acquired = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.timeouts = 0
+
+    def acquire(self):
+        with self._lock:
+            self.acquired += 1
+            if not self._idle and self.size >= self.max_size:
+                self.waits += 1
+                started = time.perf_counter()
+                ready = self._lock.wait_for(lambda: self._idle or self.size < self.max_size, self.timeout)
+                self.wait_seconds += time.perf_counter() - started
+                if not ready:
+                    self.timeouts += 1
+                    raise PoolTimeout(f'No database connection available after {self.timeout}s')
+            if self._idle:
+                db = self._idle.pop()
+                self.in_use += 1
+                return db
+            self.size += 1
+            self.in_use += 1
+        try:
+            db = connect(self.db_name, self.config)
+        except Exception:
+            with self._lock:
+                self.size -= 1
+                self.in_use -= 1
+                self._lock.notify()
+            raise
+        db.pool = self
+        with self._lock:
+            self.created += 1
+        return db
+
+    def release(self, db):
+        if db.in_transaction:
+            db.rollback()
+        db.set_trace_callback(None)
+        db.observer = None
+        with self._lock:
+            self.in_use -= 1
+            if self._closed:
+                self.size -= 1
+                db.close()
+            else:
+                self._idle.append(db)
+            self._lock.notify()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            for db in self._idle:
+                db.close()
+            self.size -= len(self._idle)
+            self._idle = []
+
+    def stats(self):
+        with self._lock:
+            return {
+                'database': re.sub(r'//[^/@]*@', '//***@', self.db_name),
+                'max_size': self.max_size,
+                'size': self.size,
+                'in_use': self.in_use,
+                'idle': len(self._idle),
+                'created': self.created,
+                'acquired': self.acquired,
+                'waits': self.waits,
+                'wait_seconds': round(self.wait_seconds, 6),
+                'timeouts': self.timeouts,
+            }
+
+_pools = {}
+_pools_lock = threading.Lock()
+_pools_pid = os.getpid()
+
+def get_pool(db_name=None):
+    """Return the pool for db_name (default: the app's DATABASE setting)."""
+    global _pools, _pools_pid
+    db_name = db_name or current_app.config.get('DATABASE', DATABASE)
+    with _pools_lock:
+        # SQLite connections must not cross a fork; start over in the child
+        if _pools_pid != os.getpid():
+            _pools, _pools_pid = {}, os.getpid()
+        pool = _pools.get(db_name)
+        if pool is None:
+            pool = _pools[db_name] = ConnectionPool(db_name, current_app.config)
+        return pool
+
+def pool_stats():
+    with _pools_lock:
+        return [pool.stats() for pool in _pools.values()]
+
+def close_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
+
+def get_db(db_name=None):
+    db = getattr(g, '_database', None)
+    if db is None:
+        db = g._database = get_pool(db_name).acquire()
+        # Per-statement timing when metrics are configured (see metrics.py)
+        db.observer = current_app.extensions.get('sql_observer')
+    return db
+
+def release_connection(db):
+    if getattr(db, 'pool', None) is not None:
+        db.pool.release(db)
+    else:
+        db.close()
+
+def release_db(exception=None):
+    db = g.pop('_database', None)
+    if db is not None:
+        release_connection(db)
+
+# --- Dialect-neutral helpers for route code ---
+def insert(db, table, values):
+    """INSERT a row given as {column: value} and return its new id."""
+    return backend_of(db).insert(db, table, values)
+
+def insert_many(db, table, columns, rows):
+    """executemany INSERT of row tuples; returns the new ids in order."""
+    return backend_of(db).insert_many(db, table, columns, rows)
+
+def fill_ids(db, table):
+    """Give rows written by an upsert (INSERT ... ON CONFLICT) their id."""
+    backend_of(db).fill_ids(db, table)
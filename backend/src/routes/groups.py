@@ -0,0 +1,118 @@
+from flask import Blueprint, request, jsonify, g
+from db import get_db, insert
+from auth import login_required, role_required
+from assignments import (group_membership, assign_test_to, parse_ids, AssignmentError, UnknownGroups)
+
+# --- Blueprint ---
+groups = Blueprint('groups', __name__)
+
+# --- Auth Decorators ---
+admin_required = role_required('admin', 'teacher')
+
+def group_exists(db, group_id):
+    return db.execute('SELECT 1 FROM student_groups WHERE id = ?', (group_id,)).fetchone() is not None
+
+def unknown_students(db, user_ids):
+    """The ids in user_ids that are not student accounts, sorted."""
+    ids = sorted(set(user_ids))
+    if not ids:
+        return []
+    found = {r[0] for r in db.execute(f"SELECT id FROM users WHERE role = 'student' AND id IN ({', '.join('?' * len(ids))})", ids)}
+    return [uid for uid in ids if uid not in found]
+
+def unknown_students_response(unknown):
+    return jsonify({'message': f"Unknown student ids: {', '.join(str(uid) for uid in unknown)}", 'user_ids': unknown}), 400
+
+# --- API Endpoints ---
+# 1. List Groups
+@groups.route('/admin/groups', methods=['GET'])
+@login_required
+@admin_required
+def list_groups():
+    db = get_db()
+    rows = db.execute('SELECT g.id, g.name, COUNT(m.user_id) AS member_count FROM student_groups g'
+                      ' LEFT JOIN group_members m ON m.group_id = g.id GROUP BY g.id, g.name ORDER BY g.id').fetchall()
+    return jsonify({'groups': [dict(r) for r in rows]}), 200
+
+# 2. Create Group
+@groups.route('/admin/groups', methods=['POST'])
+@login_required
+@admin_required
+def create_group():
+    data = request.get_json() or {}
+    if not data.get('name'):
+        return jsonify({'message': 'name is required'}), 400
+    try:
+        user_ids = parse_ids(data.get('user_ids'), 'user_ids')
+    except AssignmentError as e:
+        return jsonify({'message': str(e)}), 400
+    db = get_db()
+    unknown = unknown_students(db, user_ids)
+    if unknown:
+        return unknown_students_response(unknown)
+    group_id = insert(db, 'student_groups', {'name': data['name'], 'created_by': g.user['user_id']})
+    add_members(db, group_id, user_ids)
+    db.commit()
+    return jsonify({'id': group_id, 'message': 'Group created successfully'}), 201
+
+def add_members(db, group_id, user_ids):
+    if user_ids:
+        db.executemany('INSERT INTO group_members (group_id, user_id) VALUES (?, ?) ON CONFLICT (group_id, user_id) DO NOTHING',
+                       [(group_id, uid) for uid in set(user_ids)])
+
+# 3. Add / Remove Members
+@groups.route('/admin/groups/<int:group_id>/members', methods=['POST', 'DELETE'])
+@login_required
+@admin_required
+def change_members(group_id):
+    data = request.get_json() or {}
+    try:
+        user_ids = parse_ids(data.get('user_ids'), 'user_ids')
+    except AssignmentError as e:
+        return jsonify({'message': str(e)}), 400
+    db = get_db()
+    if not group_exists(db, group_id):
+        return jsonify({'message': 'Group not found'}), 404
+    if request.method == 'POST':
+        unknown = unknown_students(db, user_ids)
+        if unknown:
+            return unknown_students_response(unknown)
+        add_members(db, group_id, user_ids)
+    elif user_ids:
+        db.executemany('DELETE FROM group_members WHERE group_id = ? AND user_id = ?', [(group_id, uid) for uid in user_ids])
+    db.commit()
+    group_membership.invalidate([group_id])
+    count = db.execute('SELECT COUNT(*) FROM group_members WHERE group_id = ?', (group_id,)).fetchone()[0]
+    return jsonify({'id': group_id, 'member_count': count, 'message': 'Group members updated'}), 200
+
+# 4. Delete Group
+@groups.route('/admin/groups/<int:group_id>', methods=['DELETE'])
+@login_required
+@admin_required
+def delete_group(group_id):
+    db = get_db()
+    if not group_exists(db, group_id):
+        return jsonify({'message': 'Group not found'}), 404
+    db.execute('DELETE FROM group_members WHERE group_id = ?', (group_id,))
+    db.execute('DELETE FROM student_groups WHERE id = ?', (group_id,))
+    db.commit()
+    group_membership.invalidate([group_id])
+    return '', 204
+
+# 5. Assign Test to Group
+@groups.route('/admin/groups/<int:group_id>/assign-test', methods=['POST'])
+@login_required
+@admin_required
+def assign_test_to_group(group_id):
+    data = request.get_json() or {}
+    db = get_db()
+    if not db.execute('SELECT 1 FROM tests WHERE id = ?', (data.get('test_id'),)).fetchone():
+        return jsonify({'message': 'Group or test not found'}), 404
+    try:
+        assigned, targeted = assign_test_to(db, data['test_id'], group_ids=[group_id], start_time=data.get('start_time'),
+                                            end_time=data.get('end_time'), attempt_limit=data.get('attempt_limit'))
+    except UnknownGroups:
+        return jsonify({'message': 'Group or test not found'}), 404
+    db.commit()
+    return jsonify({'message': 'Test assigned to group successfully', 'assigned_count': assigned,
+                    'already_assigned': targeted - assigned}), 200
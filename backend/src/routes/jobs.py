@@ -0,0 +1,292 @@
+from flask import Blueprint, request, jsonify, g, current_app, send_file
+import json
+import os
+import tempfile
+import threading
+import logging
+from datetime import datetime
+from db import get_db, connect, insert
+from auth import login_required, role_required, app_database
+from storage import backend_of
+
+# --- Background jobs persisted in SQLite, run by an in-process worker pool ---
+jobs = Blueprint('jobs', __name__)
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_ATTEMPTS = 3
+POLL_INTERVAL = 1.0
+
+JOB_HANDLERS = {}
+_pool = None
+_pool_lock = threading.Lock()
+
+class JobCancelled(Exception):
+    pass
+
+def job_handler(kind, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """Register f(db, job) as the runner for jobs of this kind.
+
+    Handlers that are not safe to re-run after a partial write should
+    pass max_attempts=1; they can still be retried by hand.
+    """
+    def register(f):
+        JOB_HANDLERS[kind] = (f, max_attempts)
+        return f
+    return register
+
+# --- DB Helper ---
+def connect_worker_db():
+    # Workers hold a connection for a whole job, so they stay out of the request pool
+    return connect(app_database(), current_app.config)
+
+def job_output_dir():
+    path = current_app.config.get('JOB_OUTPUT_DIR', os.path.join(tempfile.gettempdir(), 'begining_jobs'))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+# --- Auth Decorators ---
+admin_required = role_required('admin', 'teacher')
+
+# --- Job API used by other blueprints ---
+class Job:
+    """The running job as seen by a handler."""
+
+    def __init__(self, db, row):
+        self.db = db
+        self.id = row['id']
+        self.kind = row['kind']
+        self.payload = json.loads(row['payload'])
+
+    def progress(self, done, total=None):
+        """Record progress and stop the job if a cancel was requested.
+
+        This commits the handler's pending writes, so call it where they
+        are consistent.
+        """
+        self.db.execute('UPDATE jobs SET progress_done = ?, progress_total = ? WHERE id = ?', (done, total, self.id))
+        self.db.commit()
+        if self.db.execute('SELECT cancel_requested FROM jobs WHERE id = ?', (self.id,)).fetchone()[0]:
+            raise JobCancelled()
+
+    def output_path(self, suffix):
+        return os.path.join(job_output_dir(), f'job_{self.id}{suffix}')
+
+def wants_async():
+    return request.args.get('async', '').lower() in ('1', 'true', 'yes')
+
+def enqueue_job(db, kind, payload, created_by):
+    """Persist a job and wake the workers; returns the new job id."""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f'Unknown job kind: {kind}')
+    job_id = insert(db, 'jobs', {'kind': kind, 'status': 'queued', 'payload': json.dumps(payload),
+                                 'max_attempts': JOB_HANDLERS[kind][1], 'created_by': created_by, 'created_at': datetime.utcnow()})
+    db.commit()
+    start_workers(current_app._get_current_object()).wake.set()
+    return job_id
+
+def job_accepted(job_id):
+    return jsonify({'job_id': job_id, 'status': 'queued', 'status_url': f'/api/v1/jobs/{job_id}'}), 202
+
+def job_row_to_dict(row):
+    result = json.loads(row['result']) if row['result'] else None
+    job = {
+        'id': row['id'],
+        'kind': row['kind'],
+        'status': row['status'],
+        'progress': {'done': row['progress_done'], 'total': row['progress_total']},
+        'attempts': row['attempts'],
+        'max_attempts': row['max_attempts'],
+        'result': result,
+        'error': row['error'],
+        'created_at': row['created_at'],
+        'started_at': row['started_at'],
+        'finished_at': row['finished_at'],
+    }
+    if result and result.get('file'):
+        job['download_url'] = f"/api/v1/jobs/{row['id']}/download"
+    return job
+
+# --- Worker pool ---
+def claim_next_job(db):
+    backend = backend_of(db)
+    backend.begin_write(db)
+    row = db.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1" + backend.skip_locked).fetchone()
+    if row is None:
+        db.commit()
+        return None
+    db.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, started_at = ?, error = NULL, worker_pid = ? WHERE id = ?",
+               (datetime.utcnow(), os.getpid(), row['id']))
+    db.commit()
+    return row
+
+def finish_job(db, job_id, status, result=None, error=None):
+    db.execute('UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?',
+               (status, json.dumps(result) if result is not None else None, error, datetime.utcnow(), job_id))
+    db.commit()
+
+def run_next_job():
+    """Claim and run one queued job in the current app context.
+
+    Returns False when the queue is empty.
+    """
+    db = connect_worker_db()
+    try:
+        row = claim_next_job(db)
+        if row is None:
+            return False
+        job = Job(db, row)
+        handler, _ = JOB_HANDLERS[job.kind]
+        try:
+            if row['cancel_requested']:
+                raise JobCancelled()
+            result = handler(db, job)
+        except JobCancelled:
+            db.rollback()
+            finish_job(db, job.id, 'cancelled')
+        except Exception as e:
+            db.rollback()
+            logger.exception('Job %s (%s) failed', job.id, job.kind)
+            if row['attempts'] + 1 < row['max_attempts']:
+                db.execute("UPDATE jobs SET status = 'queued', error = ? WHERE id = ?", (str(e), job.id))
+                db.commit()
+            else:
+                finish_job(db, job.id, 'failed', error=str(e))
+        else:
+            finish_job(db, job.id, 'succeeded', result=result)
+        return True
+    finally:
+        db.close()
+
+class WorkerPool:
+    def __init__(self, app, size):
+        self.app = app
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.threads = [threading.Thread(target=self.run, name=f'job-worker-{i}', daemon=True) for i in range(size)]
+
+    def start(self):
+        with self.app.app_context():
+            requeue_interrupted_jobs()
+        for t in self.threads:
+            t.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.wake.set()
+        for t in self.threads:
+            t.join()
+
+    def run(self):
+        while not self.stopping.is_set():
+            self.wake.clear()
+            try:
+                with self.app.app_context():
+                    ran = run_next_job()
+            except Exception:
+                logger.exception('Job worker error')
+                ran = False
+            if not ran:
+                self.wake.wait(POLL_INTERVAL)
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def requeue_interrupted_jobs():
+    """Jobs left 'running' by a process that has since died go back in the queue.
+
+    A job that has used up its attempts fails instead: re-running it could
+    repeat a partial write (see job_handler).
+    """
+    db = connect_worker_db()
+    try:
+        rows = db.execute("SELECT id, worker_pid, attempts, max_attempts FROM jobs WHERE status = 'running'").fetchall()
+        stale = [r for r in rows if r['worker_pid'] == os.getpid() or not r['worker_pid'] or not pid_alive(r['worker_pid'])]
+        db.executemany("UPDATE jobs SET status = 'queued' WHERE id = ? AND status = 'running'",
+                       [(r['id'],) for r in stale if r['attempts'] < r['max_attempts']])
+        db.executemany("UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ? AND status = 'running'",
+                       [('Interrupted: the worker exited before the job finished', datetime.utcnow(), r['id'])
+                        for r in stale if r['attempts'] >= r['max_attempts']])
+        db.commit()
+    finally:
+        db.close()
+
+def start_workers(app):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = WorkerPool(app, app.config.get('JOB_WORKERS', DEFAULT_WORKERS))
+            _pool.start()
+    return _pool
+
+@jobs.before_app_request
+def ensure_workers():
+    # Jobs still queued, or interrupted, when the last process exited run without waiting for a new enqueue
+    if _pool is None:
+        start_workers(current_app._get_current_object())
+
+# --- ENDPOINTS ---
+@jobs.route('/api/v1/jobs/<int:job_id>', methods=['GET'])
+@login_required
+@admin_required
+def get_job(job_id):
+    db = get_db()
+    row = db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    if not row:
+        return jsonify({'message': 'Job not found'}), 404
+    return jsonify(job_row_to_dict(row)), 200
+
+@jobs.route('/api/v1/jobs/<int:job_id>/cancel', methods=['POST'])
+@login_required
+@admin_required
+def cancel_job(job_id):
+    db = get_db()
+    row = db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    if not row:
+        return jsonify({'message': 'Job not found'}), 404
+    if row['status'] == 'queued':
+        db.execute("UPDATE jobs SET status = 'cancelled', cancel_requested = 1, finished_at = ? WHERE id = ? AND status = 'queued'",
+                   (datetime.utcnow(), job_id))
+    elif row['status'] == 'running':
+        # The handler stops at its next progress report
+        db.execute('UPDATE jobs SET cancel_requested = 1 WHERE id = ?', (job_id,))
+    else:
+        return jsonify({'message': f"Job already {row['status']}"}), 409
+    db.commit()
+    row = db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    return jsonify(job_row_to_dict(row)), 200
+
+@jobs.route('/api/v1/jobs/<int:job_id>/retry', methods=['POST'])
+@login_required
+@admin_required
+def retry_job(job_id):
+    db = get_db()
+    row = db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    if not row:
+        return jsonify({'message': 'Job not found'}), 404
+    if row['status'] not in ('failed', 'cancelled'):
+        return jsonify({'message': 'Only failed or cancelled jobs can be retried'}), 409
+    db.execute("UPDATE jobs SET status = 'queued', cancel_requested = 0, attempts = 0, progress_done = 0, progress_total = NULL, finished_at = NULL WHERE id = ?",
+               (job_id,))
+    db.commit()
+    start_workers(current_app._get_current_object()).wake.set()
+    return job_accepted(job_id)
+
+@jobs.route('/api/v1/jobs/<int:job_id>/download', methods=['GET'])
+@login_required
+@admin_required
+def download_job_output(job_id):
+    db = get_db()
+    row = db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    if not row:
+        return jsonify({'message': 'Job not found'}), 404
+    result = json.loads(row['result']) if row['result'] else {}
+    if row['status'] != 'succeeded' or not result.get('file') or not os.path.exists(result['file']):
+        return jsonify({'message': 'No output available'}), 404
+    return send_file(result['file'], mimetype=result.get('mimetype', 'application/octet-stream'), as_attachment=True)
@@ -0,0 +1,254 @@
+from flask import request, g, current_app, jsonify, Response, has_request_context
+from bisect import bisect_left
+from collections import OrderedDict
+import hmac
+import logging
+import threading
+import time
+from db import pool_stats
+from auth import bearer_token, verify_token
+from storage import backend_of
+
+# --- Request and SQL metrics in Prometheus text format ---
+# Every request records its latency, response size and SQL statement count
+# per (blueprint, endpoint); every statement on the request's pooled
+# connection is timed through the connection's observer hook. Counters live
+# in process memory behind one lock per metric, and GET /metrics renders them
+# for a Prometheus scrape. With several worker processes each reports its own.
+#
+# Statements slower than SLOW_QUERY_SECONDS are logged to 'begining.sql'
+# with the query plan attached; plans are cached per statement text, so a
+# burst of slow statements is explained once.
+#
+# Settings (app.config):
+#   METRICS_ENABLED       False records nothing and /metrics answers 404 (read per request)
+#   METRICS_TOKEN         bearer token for the scraper; without it only admins may read /metrics
+#   SLOW_QUERY_SECONDS    slow-query threshold, default 0.1; None disables
+#   SLOW_QUERY_PLAN       attach EXPLAIN output to slow-query logs (default True)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SQL_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+DEFAULT_SLOW_QUERY_SECONDS = 0.1
+
+sql_logger = logging.getLogger('begining.sql')
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def label_text(names, values, extra=''):
+    pairs = [f'{n}="{escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        lines += [f'{self.name}{label_text(self.labels, k)} {number(v)}' for k, v in values]
+        return lines
+
+class Histogram:
+    """Cumulative-bucket histogram; observe() is one bisect and three adds under a lock."""
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, tuple(buckets)
+        self._series = {}  # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    def render(self):
+        with self._lock:
+            series = sorted((k, list(v)) for k, v in self._series.items())
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for labels, counts in series:
+            running = 0
+            for bound, n in zip(self.buckets + ('+Inf',), counts[:-1]):
+                running += n
+                le = 'le="%s"' % (bound if bound == '+Inf' else number(bound))
+                lines.append(f'{self.name}_bucket{label_text(self.labels, labels, le)} {running}')
+            lines.append(f'{self.name}_sum{label_text(self.labels, labels)} {number(counts[-1])}')
+            lines.append(f'{self.name}_count{label_text(self.labels, labels)} {running}')
+        return lines
+
+class Metrics:
+    """The app's metric families; collectors add gauges read at scrape time."""
+
+    def __init__(self):
+        route = ('blueprint', 'endpoint')
+        self.requests = Counter('http_requests_total', 'Requests handled.', route + ('method', 'status'))
+        self.latency = Histogram('http_request_duration_seconds', 'Time from routing to response, in seconds.',
+                                 route + ('method',))
+        self.response_size = Histogram('http_response_size_bytes', 'Response body size, in bytes.', route,
+                                       SIZE_BUCKETS)
+        self.queries = Histogram('db_queries_per_request', 'SQL statements run per request.', route, COUNT_BUCKETS)
+        self.query_seconds = Counter('db_query_seconds_total', 'Time spent executing SQL, in seconds.', route)
+        self.query_latency = Histogram('db_query_duration_seconds', 'Time to execute one SQL statement, in seconds.',
+                                       ('operation',), SQL_BUCKETS)
+        self.slow_queries = Counter('db_slow_queries_total', 'Statements slower than SLOW_QUERY_SECONDS.', route)
+        self.families = [self.requests, self.latency, self.response_size, self.queries, self.query_seconds,
+                         self.query_latency, self.slow_queries]
+        self.collectors = []
+
+    def render(self):
+        lines = []
+        for family in self.families:
+            lines += family.render()
+        for collect in self.collectors:
+            lines += collect()
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+def gauge(name, help, samples):
+    """Lines for a gauge family from [(labels dict, value)]."""
+    lines = [f'# HELP {name} {help}', f'# TYPE {name} gauge']
+    for labels, value in samples:
+        lines.append(f'{name}{label_text(labels.keys(), labels.values())} {number(value)}')
+    return lines
+
+def collect_pools():
+    stats = pool_stats()
+    lines = []
+    for field, help in (('size', 'Open connections.'), ('in_use', 'Connections checked out.'),
+                        ('waits', 'Acquires that had to wait.'), ('timeouts', 'Acquires that timed out.')):
+        lines += gauge(f'db_pool_{field}', help, [({'database': s['database']}, s[field]) for s in stats])
+    return lines
+
+def collect_caches():
+    from auth import token_cache
+    from papers import test_papers
+    lines = gauge('cache_hits', 'Hits of in-process caches.',
+                  [({'cache': 'auth_tokens'}, token_cache.hits), ({'cache': 'test_papers'}, test_papers.hits)])
+    lines += gauge('cache_misses', 'Misses of in-process caches.',
+                   [({'cache': 'auth_tokens'}, token_cache.misses), ({'cache': 'test_papers'}, test_papers.misses)])
+    return lines
+
+metrics.collectors += [collect_pools, collect_caches]
+
+def route_labels():
+    endpoint = request.endpoint or 'unmatched'
+    return request.blueprint or 'app', endpoint
+
+def operation(sql):
+    word = sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+    return word if word in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'BEGIN', 'COMMIT', 'PRAGMA') else 'OTHER'
+
+def metrics_enabled():
+    return current_app.config.get('METRICS_ENABLED', True)
+
+def observe_sql(db, sql, params, seconds):
+    """Connection observer: per-request totals, the statement histogram and slow-query logging."""
+    if not metrics_enabled():
+        return
+    g.sql_count = g.get('sql_count', 0) + 1
+    g.sql_seconds = g.get('sql_seconds', 0.0) + seconds
+    metrics.query_latency.observe((operation(sql),), seconds)
+    threshold = current_app.config.get('SLOW_QUERY_SECONDS', DEFAULT_SLOW_QUERY_SECONDS)
+    if threshold is not None and seconds >= threshold:
+        log_slow_query(db, sql, params, seconds)
+
+class PlanCache:
+    """Recent query plans by (database, SQL), so a burst of slow statements is explained once."""
+
+    def __init__(self, max_size=256):
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_size = max_size
+
+    def get(self, db, sql, params):
+        key = (db.db_name, sql)
+        with self._lock:
+            if key in self._plans:
+                self._plans.move_to_end(key)
+                return self._plans[key]
+        # executemany passes a list of rows; plan the first
+        if isinstance(params, list) and params and isinstance(params[0], (list, tuple)):
+            params = params[0]
+        plan = backend_of(db).explain(db, sql, params)
+        with self._lock:
+            self._plans[key] = plan
+            while len(self._plans) > self.max_size:
+                self._plans.popitem(last=False)
+        return plan
+
+query_plans = PlanCache()
+
+def log_slow_query(db, sql, params, seconds):
+    labels = route_labels() if has_request_context() else ('app', 'none')
+    metrics.slow_queries.inc(labels)
+    if not sql_logger.isEnabledFor(logging.WARNING):
+        return
+    fields = {'sql': sql, 'duration_ms': round(seconds * 1000, 3), 'endpoint': labels[1]}
+    if current_app.config.get('SLOW_QUERY_PLAN', True) and operation(sql) in ('SELECT', 'WITH', 'UPDATE', 'DELETE', 'INSERT'):
+        try:
+            fields['plan'] = query_plans.get(db, sql, params)
+        except Exception as e:
+            fields['plan_error'] = str(e)
+    sql_logger.warning('slow query (%.1f ms) in %s', seconds * 1000, labels[1], extra={'fields': fields})
+
+def start_request_metrics():
+    if not metrics_enabled():
+        return
+    g.metrics_started = time.perf_counter()
+    g.sql_count = 0
+    g.sql_seconds = 0.0
+
+def finish_request_metrics(response):
+    started = g.get('metrics_started')
+    if started is None:
+        return response
+    record_request(route_labels(), request.method, response.status_code, time.perf_counter() - started,
+                   response.content_length, g.get('sql_count', 0), g.get('sql_seconds'))
+    return response
+
+def record_request(labels, method, status, seconds, size, sql_count, sql_seconds):
+    """Count one finished request; also used by the ASGI routes, which have no Flask request."""
+    metrics.requests.inc(labels + (method, str(status)))
+    metrics.latency.observe(labels + (method,), seconds)
+    if size is not None:
+        metrics.response_size.observe(labels, size)
+    metrics.queries.observe(labels, sql_count)
+    if sql_seconds:
+        metrics.query_seconds.inc(labels, sql_seconds)
+
+def metrics_endpoint():
+    if not metrics_enabled():
+        return jsonify({'message': 'Not found'}), 404
+    token = current_app.config.get('METRICS_TOKEN')
+    supplied = request.headers.get('Authorization', '')
+    if not (token and hmac.compare_digest(supplied, f'Bearer {token}')):
+        # Route names, error rates and pool sizes are not for anonymous callers
+        payload = verify_token(bearer_token()) if bearer_token() else None
+        if not payload or payload.get('role') != 'admin':
+            return jsonify({'message': 'Unauthorized'}), 401
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def configure_metrics(app):
+    """Install the request hooks, the SQL observer and GET /metrics; METRICS_ENABLED is checked as they run."""
+    app.before_request(start_request_metrics)
+    app.after_request(finish_request_metrics)
+    app.extensions['sql_observer'] = observe_sql
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint, methods=['GET'])
@@ -0,0 +1,77 @@
+import importlib.util
+import os
+import re
+from datetime import datetime
+from storage import backend_of
+
+# --- Versioned schema migrations ---
+# Version 1 is the baseline dbSchema.sql at the repo root; later versions are
+# NNNN_name.sql or NNNN_name.py files in backend/src/migrations. A .py
+# migration defines upgrade(db, backend) for changes plain SQL cannot make
+# portably (conditional ALTERs, SQLite-only backfills).
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCHEMA_FILE = os.path.normpath(os.path.join(HERE, '..', '..', '..', 'dbSchema.sql'))
+MIGRATIONS_DIR = os.path.normpath(os.path.join(HERE, '..', 'migrations'))
+MIGRATION_FILE = re.compile(r'^(\d{4})_(\w+)\.(sql|py)$')
+
+class MigrationError(Exception):
+    pass
+
+def discover(schema_file=SCHEMA_FILE, migrations_dir=MIGRATIONS_DIR):
+    """Return [(version, name, path)] sorted by version."""
+    found = [(1, 'baseline', schema_file)]
+    for filename in sorted(os.listdir(migrations_dir)):
+        m = MIGRATION_FILE.match(filename)
+        if not m:
+            continue
+        version = int(m.group(1))
+        if version <= 1 or any(v == version for v, _, _ in found):
+            raise MigrationError(f'Duplicate or reserved migration version in {filename}')
+        found.append((version, m.group(2), os.path.join(migrations_dir, filename)))
+    return sorted(found)
+
+def applied_versions(db):
+    db.execute('CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY, name TEXT NOT NULL, applied_at TIMESTAMP NOT NULL)')
+    db.commit()
+    return {r[0] for r in db.execute('SELECT version FROM schema_migrations')}
+
+def to_dialect(sql, backend):
+    if backend.name == 'postgres':
+        sql = re.sub(r'INTEGER PRIMARY KEY AUTOINCREMENT', 'SERIAL PRIMARY KEY', sql, flags=re.IGNORECASE)
+    return sql
+
+def apply_migration(db, version, name, path):
+    backend = backend_of(db)
+    try:
+        if path.endswith('.py'):
+            spec = importlib.util.spec_from_file_location(f'migration_{version:04d}', path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            if backend.name == 'sqlite':
+                db.execute('BEGIN')
+            module.upgrade(db, backend)
+        else:
+            with open(path) as f:
+                sql = to_dialect(f.read(), backend)
+            if backend.name == 'sqlite':
+                # executescript commits first, so wrap the script to keep it atomic
+                db.executescript(f'BEGIN;\n{sql};\n')
+            else:
+                db.execute(sql)
+        db.execute('INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)',
+                   (version, name, datetime.utcnow()))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise MigrationError(f'Migration {version:04d}_{name} failed: {e}') from e
+
+def migrate(db, target=None, schema_file=SCHEMA_FILE, migrations_dir=MIGRATIONS_DIR):
+    """Apply every pending migration up to target; returns the versions applied."""
+    done = applied_versions(db)
+    applied = []
+    for version, name, path in discover(schema_file, migrations_dir):
+        if version in done or (target is not None and version > target):
+            continue
+        apply_migration(db, version, name, path)
+        applied.append(version)
+    return applied
@@ -0,0 +1,89 @@
+from flask import jsonify
+
+# --- Keyset pagination shared by the list endpoints ---
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+class PaginationError(ValueError):
+    pass
+
+def parse_ranked_cursor(cursor):
+    if cursor is None:
+        return None
+    score, _, after_id = cursor.rpartition(':')
+    return float(score), int(after_id)
+
+class Page:
+    """Keyset page parsed from ?after_id=&limit=&fields= query arguments.
+
+    Requests that pass none of these keep the legacy bare-list response
+    with every matching row; only paginated requests are limited, to at
+    most MAX_PAGE_SIZE rows per page.
+
+    A ranked page orders by (score, id) instead of id alone, for results
+    sorted by relevance; its cursor is the opaque string "score:id".
+    """
+
+    def __init__(self, args, allowed_fields, ranked=False):
+        self.paginated = any(k in args for k in ('after_id', 'limit', 'fields'))
+        self.ranked = ranked
+        try:
+            if ranked:
+                self.after_id = parse_ranked_cursor(args.get('after_id'))
+            else:
+                self.after_id = int(args.get('after_id', 0))
+            self.limit = int(args.get('limit', DEFAULT_PAGE_SIZE)) if self.paginated else None
+        except ValueError:
+            raise PaginationError('after_id and limit must be integers')
+        if self.limit is not None:
+            if self.limit < 1:
+                raise PaginationError('limit must be a positive integer')
+            self.limit = min(self.limit, MAX_PAGE_SIZE)
+        self.fields = None
+        if args.get('fields'):
+            fields = [f.strip() for f in args['fields'].split(',') if f.strip()]
+            unknown = [f for f in fields if f not in allowed_fields]
+            if unknown:
+                raise PaginationError(f"Unknown fields: {', '.join(unknown)}")
+            # id is always returned since it doubles as the cursor
+            self.fields = ['id'] + [f for f in fields if f != 'id']
+
+    def wants(self, field):
+        return self.fields is None or field in self.fields
+
+    def sql(self, id_column='id'):
+        """Return the keyset clause and its params, to be appended after WHERE."""
+        if self.limit is None:
+            return f' AND {id_column} > ? ORDER BY {id_column}', [self.after_id]
+        return f' AND {id_column} > ? ORDER BY {id_column} LIMIT ?', [self.after_id, self.limit + 1]
+
+    def ranked_sql(self, score_column='score', id_column='id'):
+        """Keyset clause for a ranked page: lowest score first, ties broken by id."""
+        order = f' ORDER BY {score_column}, {id_column}'
+        limit = []
+        if self.limit is not None:
+            order += ' LIMIT ?'
+            limit = [self.limit + 1]
+        if self.after_id is None:
+            return order, limit
+        score, after_id = self.after_id
+        return (f' AND ({score_column} > ? OR ({score_column} = ? AND {id_column} > ?))' + order,
+                [score, score, after_id] + limit)
+
+    def response(self, rows, to_dict):
+        """Serialize rows fetched with sql() and build the page response.
+
+        to_dict may be called on the page rows only; it receives the list
+        and must return the list of dicts in the same order.
+        """
+        if not self.paginated:
+            return jsonify(to_dict(rows)), 200
+        has_more = len(rows) > self.limit
+        rows = rows[:self.limit]
+        items = to_dict(rows)
+        if self.fields is not None:
+            items = [{f: item[f] for f in self.fields} for item in items]
+        next_cursor = None
+        if has_more and items:
+            next_cursor = f"{rows[-1]['score']!r}:{rows[-1]['id']}" if self.ranked else items[-1]['id']
+        return jsonify({'items': items, 'next_cursor': next_cursor}), 200
@@ -0,0 +1,150 @@
+from flask import current_app, request, Response
+from collections import OrderedDict
+import gzip
+import hashlib
+import threading
+import time
+from shuffle import ShuffleMode, shuffle_questions
+
+# --- Pre-serialized test papers ---
+# Every student opening a test gets the same questions and options, so the
+# JSON is built once per test and kept as bytes (plus a gzipped copy made on
+# first use). Papers for students are built without is_correct. Edits to a
+# test or its questions bump tests.paper_version in the same transaction
+# (mark_changed), and every read checks the cached copy against that row, so
+# no worker process serves a paper older than the last committed edit. A
+# test's created_at is part of the version too, so a new test that reuses a
+# deleted one's id does not match its leftovers. Tests with a shuffle pattern
+# are reordered per student from the cached canonical paper (see shuffle.py).
+DEFAULT_PAPER_CACHE_SIZE = 128
+DEFAULT_PAPER_TTL = 300
+DEFAULT_GZIP_MIN_SIZE = 1024
+
+STAFF_ROLES = ('admin', 'teacher')
+
+class Paper:
+    __slots__ = ('body', 'etag', 'payload', 'shuffle', '_gzipped')
+
+    def __init__(self, body, payload=None, shuffle=None):
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.payload = payload
+        self.shuffle = shuffle or ShuffleMode()
+        self._gzipped = None
+
+    def shuffled(self, seed):
+        """The paper body in one student's order."""
+        if isinstance(self.payload, dict):
+            payload = dict(self.payload, questions=shuffle_questions(self.payload['questions'], seed, self.shuffle))
+        else:
+            payload = shuffle_questions(self.payload, seed, self.shuffle)
+        return current_app.json.dumps(payload).encode('utf-8')
+
+    @property
+    def gzipped(self):
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body, compresslevel=6)
+        return self._gzipped
+
+def paper_variant(role):
+    return 'full' if role in STAFF_ROLES else 'student'
+
+def strip_answers(questions):
+    """Copy of question dicts whose options carry no is_correct."""
+    return [dict(q, options=[{k: v for k, v in o.items() if k != 'is_correct'} for o in q['options']])
+            if 'options' in q else q for q in questions]
+
+def mark_changed(db, test_ids):
+    """Bump the paper version of test_ids in the caller's transaction; the caller commits."""
+    test_ids = sorted(set(test_ids))
+    if test_ids:
+        db.execute(f"UPDATE tests SET paper_version = COALESCE(paper_version, 0) + 1 WHERE id IN ({', '.join('?' * len(test_ids))})",
+                   test_ids)
+
+def paper_version(db, test_id):
+    """The test's current version, or None if there is no such test."""
+    row = db.execute('SELECT created_at, paper_version FROM tests WHERE id = ?', (test_id,)).fetchone()
+    return (str(row[0]), row[1] or 0) if row else None
+
+class PaperCache:
+    """LRU of serialized papers keyed by (database, test, kind, variant), valid for one test version."""
+
+    def __init__(self):
+        self._papers = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, db, test_id, kind, variant, build):
+        """Return the cached Paper, or serialize build() and cache it.
+
+        build() returns (payload, ShuffleMode), or None for a missing test (not cached).
+        """
+        db_name = getattr(db, 'db_name', None) or current_app.config.get('DATABASE')
+        cache_key = (db_name, test_id, kind, variant)
+        ttl = current_app.config.get('PAPER_CACHE_TTL', DEFAULT_PAPER_TTL)
+        version = paper_version(db, test_id)
+        with self._lock:
+            entry = self._papers.get(cache_key)
+            if entry and version is not None and entry[1] == version and time.monotonic() - entry[0] < ttl:
+                self._papers.move_to_end(cache_key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+        built = build()
+        if built is None:
+            return None
+        payload, shuffle = built
+        # Only shuffled papers need the payload kept around
+        paper = Paper(current_app.json.dumps(payload).encode('utf-8'), payload if shuffle else None, shuffle)
+        if version is None:
+            return paper
+        with self._lock:
+            # Stored under the version read before building, so a paper built
+            # while an edit landed is simply stale on its next read
+            self._papers[cache_key] = (time.monotonic(), version, paper)
+            self._papers.move_to_end(cache_key)
+            while len(self._papers) > current_app.config.get('PAPER_CACHE_SIZE', DEFAULT_PAPER_CACHE_SIZE):
+                self._papers.popitem(last=False)
+        return paper
+
+    def invalidate(self, test_ids=None):
+        """Drop this process's copies now; other processes notice the bumped version on their next read."""
+        with self._lock:
+            if test_ids is None:
+                self._papers.clear()
+                return
+            test_ids = set(test_ids)
+            for cache_key in [k for k in self._papers if k[1] in test_ids]:
+                del self._papers[cache_key]
+
+test_papers = PaperCache()
+
+def paper_response(paper, seed=None):
+    """200 with the paper (gzipped when the client accepts it), or 304 if the client's copy is current.
+
+    With a seed, a shuffled paper is sent in that student's order.
+    """
+    personal = seed is not None and bool(paper.shuffle)
+    compress = (current_app.config.get('PAPER_GZIP', True) and request.accept_encodings['gzip'] > 0
+                and len(paper.body) >= current_app.config.get('PAPER_GZIP_MIN_SIZE', DEFAULT_GZIP_MIN_SIZE))
+    # Each encoding and each student's order is a separate representation with its own strong ETag
+    etag = f'{paper.etag}-{seed}' if personal else paper.etag
+    if compress:
+        etag += '-gz'
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        if personal:
+            body = paper.shuffled(seed)
+            body = gzip.compress(body, compresslevel=6) if compress else body
+        else:
+            body = paper.gzipped if compress else paper.body
+        response = Response(body, mimetype='application/json')
+        if compress:
+            response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Accept-Encoding')
+    response.vary.add('Authorization')
+    return response
@@ -0,0 +1,172 @@
+from flask import current_app
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+import atexit
+import os
+import threading
+
+# --- Password hashing off the request threads ---
+# Hashing is deliberately slow, so a login storm at exam start would keep
+# every request thread busy in pbkdf2. Hashes are computed in a bounded
+# process pool instead; once PASSWORD_HASH_MAX_PENDING hashes are queued or
+# running, further logins are refused (429) rather than queued behind them.
+# PASSWORD_HASH_METHOD picks the algorithm and cost:
+#   pbkdf2:sha256[:iterations]   (the default, as stored so far)
+#   scrypt[:n[:r[:p]]]
+#   argon2[:time_cost[:memory_kib[:parallelism]]]   (needs argon2-cffi)
+# A successful login with a hash made under other settings re-hashes the
+# password under the current ones.
+DEFAULT_METHOD = 'pbkdf2:sha256'
+DEFAULT_TIMEOUT = 30
+DEFAULT_RETRY_AFTER = 1
+SCRYPT_DEFAULTS = (2 ** 15, 8, 1)
+ARGON2_DEFAULTS = (3, 65536, 4)
+
+class PasswordHashBusy(Exception):
+    """Too many hashes in flight; the request should be retried later."""
+
+def normalize_method(method):
+    """Spell out the defaults so the method can be compared with a stored hash's prefix."""
+    parts = (method or DEFAULT_METHOD).split(':')
+    if parts[0] == 'pbkdf2':
+        if len(parts) == 1:
+            parts.append('sha256')
+        if len(parts) == 2:
+            parts.append(str(DEFAULT_PBKDF2_ITERATIONS))
+        if len(parts) != 3:
+            raise ValueError(f'Invalid password hash method: {method}')
+    elif parts[0] in ('scrypt', 'argon2'):
+        defaults = SCRYPT_DEFAULTS if parts[0] == 'scrypt' else ARGON2_DEFAULTS
+        if len(parts) > 4:
+            raise ValueError(f'Invalid password hash method: {method}')
+        parts += [str(d) for d in defaults[len(parts) - 1:]]
+    else:
+        raise ValueError(f'Unsupported password hash method: {method}')
+    if not all(p.isdigit() for p in parts[2 if parts[0] == 'pbkdf2' else 1:]):
+        raise ValueError(f'Invalid password hash method: {method}')
+    return ':'.join(parts)
+
+def _argon2(method):
+    try:
+        from argon2 import PasswordHasher
+    except ImportError:
+        raise ImportError("argon2-cffi is required for argon2 password hashing. Install with 'pip install argon2-cffi'.")
+    _, time_cost, memory_cost, parallelism = method.split(':')
+    return PasswordHasher(time_cost=int(time_cost), memory_cost=int(memory_cost), parallelism=int(parallelism))
+
+def _hash(password, method):
+    if method.startswith('argon2'):
+        return _argon2(method).hash(password)
+    return generate_password_hash(password, method=method)
+
+def _check(stored, password, method):
+    """(matches, new hash if the password matched under outdated settings)."""
+    if stored.startswith('$argon2'):
+        hasher = _argon2(method if method.startswith('argon2') else normalize_method('argon2'))
+        try:
+            ok = hasher.verify(stored, password)
+        except Exception:
+            ok = False
+        stale = not method.startswith('argon2') or hasher.check_needs_rehash(stored)
+    else:
+        ok = check_password_hash(stored, password)
+        stale = stored.split('$', 1)[0] != method
+    return ok, (_hash(password, method) if ok and stale else None)
+
+class PasswordHasher:
+    """Runs hashes in a process pool with bounded admission.
+
+    PASSWORD_HASH_WORKERS=0 hashes on the calling thread (still admission
+    controlled), which tests and single-process tools use.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = None
+        self._max_pending = None
+        self.hashed = 0
+        self.rejected = 0
+
+    def _start(self, config):
+        workers = config.get('PASSWORD_HASH_WORKERS', min(4, os.cpu_count() or 1))
+        self._max_pending = config.get('PASSWORD_HASH_MAX_PENDING', max(1, workers) * 4)
+        self._slots = threading.BoundedSemaphore(self._max_pending)
+        if workers:
+            self._executor = ProcessPoolExecutor(max_workers=workers)
+            atexit.register(self.shutdown)
+
+    def _admit(self, config):
+        with self._lock:
+            if self._slots is None:
+                self._start(config)
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordHashBusy()
+
+    def _submit(self, fn, args):
+        """Start an admitted hash in the pool.
+
+        Its slot is freed when the hash finishes, not when the caller stops
+        waiting, so hashes abandoned on timeout still count against the limit.
+        """
+        slots = self._slots
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        return future
+
+    def _run_inline(self, fn, args):
+        slots = self._slots
+        try:
+            return fn(*args)
+        finally:
+            slots.release()
+
+    def run(self, fn, *args):
+        config = current_app.config
+        self._admit(config)
+        if self._executor is None:
+            result = self._run_inline(fn, args)
+        else:
+            result = self._submit(fn, args).result(config.get('PASSWORD_HASH_TIMEOUT', DEFAULT_TIMEOUT))
+        with self._lock:
+            self.hashed += 1
+        return result
+
+    async def run_async(self, config, fn, *args):
+        """run() for the ASGI mode: the coroutine waits on the pool instead of a thread."""
+        self._admit(config)
+        if self._executor is None:
+            result = self._run_inline(fn, args)
+        else:
+            # A timeout cancels the hash if it has not started; a running one keeps its slot until it ends
+            result = await asyncio.wait_for(asyncio.wrap_future(self._submit(fn, args)),
+                                            config.get('PASSWORD_HASH_TIMEOUT', DEFAULT_TIMEOUT))
+        with self._lock:
+            self.hashed += 1
+        return result
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor, self._slots = self._executor, None, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+password_hasher = PasswordHasher()
+
+def hash_password(password):
+    return password_hasher.run(_hash, password, normalize_method(current_app.config.get('PASSWORD_HASH_METHOD')))
+
+def check_password(stored, password):
+    """(matches, replacement hash or None); store the replacement to finish a rehash-on-login."""
+    return password_hasher.run(_check, stored, password, normalize_method(current_app.config.get('PASSWORD_HASH_METHOD')))
+
+async def check_password_async(config, stored, password):
+    return await password_hasher.run_async(config, _check, stored, password,
+                                           normalize_method(config.get('PASSWORD_HASH_METHOD')))
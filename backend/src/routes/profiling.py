@@ -0,0 +1,241 @@
+from flask import Blueprint, request, jsonify, Response
+from collections import Counter
+import os
+import random
+import sys
+import threading
+import time
+from auth import login_required, role_required
+
+# --- On-demand sampling profiler ---
+# An admin switches profiling on at runtime with per-route sample rates. A
+# sampled request registers its thread; one background thread then reads
+# the stacks of registered threads every PROFILER_INTERVAL_MS from
+# sys._current_frames() and counts them per route. The route is not
+# instrumented, so wall time spent waiting on SQLite or the password pool
+# shows up as well.
+#
+# While off, the only cost is one attribute check per request. While on, the
+# sampler times itself and doubles its interval whenever sampling takes more
+# than PROFILER_MAX_OVERHEAD of wall time. It stops by itself once the
+# requested duration runs out. Stacks are kept per process, so with several
+# workers each one has to be read.
+#
+# GET /admin/profiler/stacks returns collapsed stacks ("frame;frame;frame
+# count" per line), which flamegraph.pl or speedscope render directly.
+DEFAULT_INTERVAL_MS = 5
+MAX_INTERVAL_MS = 1000
+DEFAULT_DURATION = 60
+MAX_DURATION = 3600
+DEFAULT_MAX_STACKS = 20000
+DEFAULT_MAX_OVERHEAD = 0.02
+DEFAULT_MAX_DEPTH = 128
+TRUNCATED = '[truncated]'
+
+class ProfilerError(ValueError):
+    pass
+
+def frame_label(code, cache={}):
+    label = cache.get(code)
+    if label is None:
+        label = cache[code] = f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+    return label
+
+def collapse(frame, max_depth=DEFAULT_MAX_DEPTH):
+    """Root-first 'a;b;c' labels of frame's stack."""
+    labels = []
+    while frame is not None and len(labels) < max_depth:
+        labels.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return ';'.join(labels)
+
+class SamplingProfiler:
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._active = {}  # thread ident -> endpoint
+        self.stacks = Counter()  # (endpoint, collapsed stack) -> samples
+        self.requests = Counter()  # endpoint -> profiled requests
+        self.reset_settings()
+
+    def reset_settings(self):
+        self.rates = {}
+        self.default_rate = 0.0
+        self.interval = DEFAULT_INTERVAL_MS / 1000
+        self.max_overhead = DEFAULT_MAX_OVERHEAD
+        self.max_stacks = DEFAULT_MAX_STACKS
+        self.started_at = None
+        self.expires_at = None
+        self.samples = 0
+        self.sampling_seconds = 0.0
+
+    def start(self, rates=None, default_rate=0.0, duration=DEFAULT_DURATION, interval_ms=DEFAULT_INTERVAL_MS,
+              max_overhead=DEFAULT_MAX_OVERHEAD, max_stacks=DEFAULT_MAX_STACKS):
+        rates = dict(rates or {})
+        for endpoint, rate in list(rates.items()) + [(None, default_rate)]:
+            if not isinstance(rate, (int, float)) or not 0 <= rate <= 1:
+                raise ProfilerError(f'Sample rate for {endpoint or "other routes"} must be between 0 and 1')
+        if not rates and not default_rate:
+            raise ProfilerError('Give rates per endpoint or a default_rate above 0')
+        if not isinstance(duration, (int, float)) or not 0 < duration <= MAX_DURATION:
+            raise ProfilerError(f'duration must be between 0 and {MAX_DURATION} seconds')
+        if not isinstance(interval_ms, (int, float)) or not 1 <= interval_ms <= MAX_INTERVAL_MS:
+            raise ProfilerError(f'interval_ms must be between 1 and {MAX_INTERVAL_MS}')
+        with self._lock:
+            self.rates = rates
+            self.default_rate = float(default_rate)
+            self.interval = interval_ms / 1000
+            self.max_overhead = max_overhead
+            self.max_stacks = max_stacks
+            self.started_at = time.time()
+            self.expires_at = self.started_at + duration
+            self.samples = 0
+            self.sampling_seconds = 0.0
+            self.enabled = True
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            self.enabled = False
+            self._active.clear()
+        self._wake.set()
+
+    def clear(self):
+        with self._lock:
+            self.stacks.clear()
+            self.requests.clear()
+
+    # Request hooks; keep the disabled path to the attribute check
+    def enter(self, endpoint):
+        if not self.enabled:
+            return
+        if random.random() < self.rates.get(endpoint, self.default_rate):
+            self._active[threading.get_ident()] = endpoint
+            with self._lock:
+                self.requests[endpoint] += 1
+            self._wake.set()
+
+    def leave(self):
+        if self._active:
+            self._active.pop(threading.get_ident(), None)
+
+    def _run(self):
+        me = threading.get_ident()
+        while True:
+            if not self.enabled:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            if time.time() >= self.expires_at:
+                self.stop()
+                continue
+            if not self._active:
+                # Nothing sampled right now; wait for a sampled request
+                self._wake.wait(0.5)
+                self._wake.clear()
+                continue
+            started = time.perf_counter()
+            frames = sys._current_frames()
+            taken = [(endpoint, collapse(frames[ident])) for ident, endpoint in list(self._active.items())
+                     if ident != me and ident in frames]
+            del frames
+            with self._lock:
+                for endpoint, stack in taken:
+                    key = (endpoint, stack)
+                    if key not in self.stacks and len(self.stacks) >= self.max_stacks:
+                        key = (endpoint, TRUNCATED)
+                    self.stacks[key] += 1
+                self.samples += len(taken)
+                spent = time.perf_counter() - started
+                self.sampling_seconds += spent
+                # Back off rather than exceed the overhead budget
+                if spent > self.interval * self.max_overhead and self.interval < MAX_INTERVAL_MS / 1000:
+                    self.interval = min(self.interval * 2, MAX_INTERVAL_MS / 1000)
+                interval = self.interval
+            time.sleep(interval)
+
+    def status(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'rates': self.rates,
+                'default_rate': self.default_rate,
+                'interval_ms': round(self.interval * 1000, 3),
+                'started_at': self.started_at,
+                'expires_at': self.expires_at,
+                'samples': self.samples,
+                'sampling_seconds': round(self.sampling_seconds, 6),
+                'distinct_stacks': len(self.stacks),
+                'requests': dict(self.requests),
+            }
+
+    def collapsed(self, endpoint=None):
+        """Collapsed-stack lines, the route as the root frame, most sampled first."""
+        with self._lock:
+            items = [(k, n) for k, n in self.stacks.items() if endpoint is None or k[0] == endpoint]
+        items.sort(key=lambda item: -item[1])
+        return ''.join(f'{route};{stack} {n}\n' for (route, stack), n in items)
+
+profiler = SamplingProfiler()
+
+# --- Blueprint ---
+profiling = Blueprint('profiling', __name__)
+
+# --- Auth Decorators ---
+admin_required = role_required('admin')
+
+@profiling.before_app_request
+def profile_request():
+    profiler.enter(request.endpoint)
+
+@profiling.teardown_app_request
+def end_profiled_request(exception=None):
+    profiler.leave()
+
+# --- API Endpoints ---
+@profiling.route('/admin/profiler', methods=['GET'])
+@login_required
+@admin_required
+def profiler_status():
+    return jsonify(profiler.status()), 200
+
+@profiling.route('/admin/profiler/start', methods=['POST'])
+@login_required
+@admin_required
+def start_profiler():
+    data = request.get_json() or {}
+    try:
+        profiler.start(rates=data.get('rates'), default_rate=data.get('default_rate', 0.0),
+                       duration=data.get('duration', DEFAULT_DURATION), interval_ms=data.get('interval_ms', DEFAULT_INTERVAL_MS))
+    except ProfilerError as e:
+        return jsonify({'message': str(e)}), 400
+    if data.get('clear'):
+        profiler.clear()
+    return jsonify(profiler.status()), 200
+
+@profiling.route('/admin/profiler/stop', methods=['POST'])
+@login_required
+@admin_required
+def stop_profiler():
+    profiler.stop()
+    return jsonify(profiler.status()), 200
+
+@profiling.route('/admin/profiler/stacks', methods=['GET'])
+@login_required
+@admin_required
+def get_profile_stacks():
+    text = profiler.collapsed(request.args.get('endpoint'))
+    return Response(text, mimetype='text/plain',
+                    headers={'Content-Disposition': 'attachment; filename=profile.collapsed'})
+
+@profiling.route('/admin/profiler/stacks', methods=['DELETE'])
+@login_required
+@admin_required
+def clear_profile_stacks():
+    profiler.clear()
+    return '', 204
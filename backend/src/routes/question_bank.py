@@ -1,53 +1,29 @@
-from flask import Blueprint, app, request, jsonify, g
+from flask import Blueprint, app, request, jsonify, g, current_app
 from werkzeug.utils import secure_filename
-import sqlite3
 import os
-import csv
 import io
-from functools import wraps
+import logging
 from datetime import datetime
-
-DATABASE = 'user_management.db'
+from db import get_db, insert, insert_many
+from auth import login_required, role_required
+from pagination import Page, PaginationError
+from streaming import wants_ndjson, ndjson_response
+from question_search import SEARCH_FIELDS, search_terms, match_expression, search_query, attach_search_results
+from scoring import invalidate_question
+from papers import test_papers, mark_changed
+from question_pools import question_pools
+from question_import import import_questions, is_utf8, DEFAULT_BATCH_SIZE, MAX_BATCH_SIZE
+from jobs import job_handler, enqueue_job, job_accepted, wants_async, job_output_dir
 
 question_bank = Blueprint('question_bank', __name__)
+logger = logging.getLogger(__name__)
 
-# --- AUTH DECORATORS (reuse from user_management) ---
-def get_db():
-    from flask import current_app, g
-    db = getattr(g, '_database', None)
-    if db is None:
-        db_name = current_app.config.get('DATABASE', DATABASE)
-        db = g._database = sqlite3.connect(db_name, detect_types=sqlite3.PARSE_DECLTYPES)
-        db.row_factory = sqlite3.Row
-    return db
-
-def login_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        from flask import request, jsonify, g, current_app
-        import jwt
-        auth = request.headers.get('Authorization', None)
-        if not auth or not auth.startswith('Bearer '):
-            return jsonify({'message': 'Unauthorized'}), 401
-        token = auth.split(' ')[1]
-        try:
-            payload = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
-        except Exception:
-            return jsonify({'message': 'Unauthorized'}), 401
-        g.user = payload
-        return f(*args, **kwargs)
-    return decorated
-
-def admin_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        from flask import g, jsonify
-        if not hasattr(g, 'user') or g.user.get('role') not in ['admin', 'teacher']:
-            return jsonify({'message': 'Unauthorized'}), 401
-        return f(*args, **kwargs)
-    return decorated
+# --- AUTH DECORATORS ---
+admin_required = role_required('admin', 'teacher')
 
 # --- HELPERS ---
+QUESTION_FIELDS = ['id', 'subject_id', 'topic_id', 'question_type', 'content', 'difficulty', 'explanation', 'options']
+
 def question_row_to_dict(row):
     return {
         'id': row['id'],
@@ -60,9 +36,45 @@ def question_row_to_dict(row):
         'options': [],  # To be filled below
     }
 
+OPTION_COLUMNS = ('question_id', 'option_text', 'is_correct')
+
+# SQLite builds before 3.32 cap host parameters at 999 per statement
+OPTIONS_CHUNK_SIZE = 900
+
+def option_row_to_dict(row):
+    return {'id': row['id'], 'option_text': row['option_text'], 'is_correct': bool(row['is_correct'])}
+
 def get_options_for_question(db, question_id):
-    options = db.execute('SELECT id, option_text, is_correct FROM question_options WHERE question_id = ?', (question_id,)).fetchall()
-    return [{'id': o['id'], 'option_text': o['option_text'], 'is_correct': bool(o['is_correct'])} for o in options]
+    return get_options_for_questions(db, [question_id]).get(question_id, [])
+
+def get_options_for_questions(db, question_ids):
+    """Load options for many questions at once, grouped by question_id.
+
+    Issues one query per OPTIONS_CHUNK_SIZE ids instead of one per question.
+    """
+    question_ids = list(dict.fromkeys(question_ids))
+    grouped = {qid: [] for qid in question_ids}
+    for start in range(0, len(question_ids), OPTIONS_CHUNK_SIZE):
+        chunk = question_ids[start:start + OPTIONS_CHUNK_SIZE]
+        placeholders = ', '.join('?' * len(chunk))
+        rows = db.execute(
+            f'SELECT id, question_id, option_text, is_correct FROM question_options WHERE question_id IN ({placeholders}) ORDER BY question_id, id',
+            chunk
+        ).fetchall()
+        for o in rows:
+            grouped.setdefault(o['question_id'], []).append(option_row_to_dict(o))
+    return grouped
+
+def insert_options(db, question_id, options):
+    insert_many(db, 'question_options', OPTION_COLUMNS,
+                [(question_id, opt.get('option_text'), opt.get('is_correct', False)) for opt in options])
+
+def attach_options(db, question_dicts):
+    """Fill the 'options' key of each question dict using a single bulk load."""
+    options = get_options_for_questions(db, [qd['id'] for qd in question_dicts])
+    for qd in question_dicts:
+        qd['options'] = options.get(qd['id'], [])
+    return question_dicts
 
 # --- ENDPOINTS ---
 @question_bank.route('/api/v1/questions', methods=['POST'])
@@ -72,26 +84,16 @@ def add_question():
     data = request.get_json()
     db = get_db()
     q = data
-    cur = db.execute(
-        'INSERT INTO questions (subject_id, topic_id, question_type, content, difficulty, explanation, created_by) VALUES (?, ?, ?, ?, ?, ?, ?)',
-        (q.get('subject_id'), q.get('topic_id'), q.get('question_type'), q.get('content'), q.get('difficulty'), q.get('explanation'), g.user['user_id'])
-    )
-    question_id = cur.lastrowid
-    print(f"Inserted question_id: {question_id}")
-    # Update id column to match rowid if needed
-    db.execute('UPDATE questions SET id = ? WHERE rowid = ?', (question_id, question_id))
+    question_id = insert(db, 'questions', {
+        'subject_id': q.get('subject_id'), 'topic_id': q.get('topic_id'), 'question_type': q.get('question_type'),
+        'content': q.get('content'), 'difficulty': q.get('difficulty'), 'explanation': q.get('explanation'),
+        'created_by': g.user['user_id'],
+    })
     # Insert options if present
-    options = q.get('options', [])
-    for opt in options:
-        db.execute('INSERT INTO question_options (question_id, option_text, is_correct) VALUES (?, ?, ?)',
-                   (question_id, opt.get('option_text'), opt.get('is_correct', False)))
+    insert_options(db, question_id, q.get('options', []))
     db.commit()
-    # Check if question is in DB
-    question_check = db.execute('SELECT * FROM questions WHERE id = ?', (question_id,)).fetchone()
-    print(f"Question row: {dict(question_check) if question_check else None}")
-    # Check if options are in DB
-    options_check = db.execute('SELECT * FROM question_options WHERE question_id = ?', (question_id,)).fetchall()
-    print(f"Options rows: {[dict(row) for row in options_check]}")
+    question_pools.invalidate()
+    logger.debug('Inserted question %s with %d options', question_id, len(q.get('options', [])))
     question = db.execute('SELECT * FROM questions WHERE id = ?', (question_id,)).fetchone()
     if not question:
         return jsonify({'message': 'Question not found after insert'}), 500
@@ -103,24 +105,40 @@ def add_question():
 @login_required
 @admin_required
 def get_questions():
+    terms = search_terms(request.args.get('search'))
+    try:
+        page = Page(request.args, QUESTION_FIELDS + SEARCH_FIELDS if terms else QUESTION_FIELDS, ranked=bool(terms))
+    except PaginationError as e:
+        return jsonify({'message': str(e)}), 400
     db = get_db()
-    query = 'SELECT * FROM questions WHERE 1=1'
+    filters = ''
     params = []
     for key in ['subject_id', 'topic_id', 'difficulty', 'question_type']:
         val = request.args.get(key)
         if val:
-            query += f' AND {key} = ?'
+            filters += f' AND q.{key} = ?'
             params.append(val)
-    if request.args.get('search'):
-        query += ' AND content LIKE ?'
-        params.append(f"%{request.args['search']}%")
-    questions = db.execute(query, params).fetchall()
-    result = []
-    for q in questions:
-        qd = question_row_to_dict(q)
-        qd['options'] = get_options_for_question(db, q['id'])
-        result.append(qd)
-    return jsonify(result), 200
+    if terms:
+        # Ranked full-text search; filters apply inside the match
+        match = match_expression(db, terms)
+        query = search_query(db, filters)
+        params = [match] + params
+        order, keyset = ' ORDER BY score, id', page.ranked_sql
+    else:
+        query = 'SELECT * FROM questions q WHERE 1=1' + filters
+        order, keyset = ' ORDER BY id', page.sql
+    def to_dicts(rows):
+        result = [question_row_to_dict(q) for q in rows]
+        if terms:
+            attach_search_results(db, match, result, rows)
+        return attach_options(db, result) if page.wants('options') else result
+    if wants_ndjson():
+        # Full export: filters and fields apply, page limits do not
+        cursor = db.execute(query + order, params)
+        return ndjson_response(cursor, to_dicts, page.fields)
+    keyset_sql, keyset_params = keyset()
+    questions = db.execute(query + keyset_sql, params + keyset_params).fetchall()
+    return page.response(questions, to_dicts)
 
 @question_bank.route('/api/v1/questions/<int:question_id>', methods=['GET'])
 @login_required
@@ -146,10 +164,12 @@ def update_question(question_id):
     db.execute('UPDATE questions SET subject_id=?, topic_id=?, question_type=?, content=?, difficulty=?, explanation=? WHERE id=?',
                (data.get('subject_id'), data.get('topic_id'), data.get('question_type'), data.get('content'), data.get('difficulty'), data.get('explanation'), question_id))
     db.execute('DELETE FROM question_options WHERE question_id = ?', (question_id,))
-    for opt in data.get('options', []):
-        db.execute('INSERT INTO question_options (question_id, option_text, is_correct) VALUES (?, ?, ?)',
-                   (question_id, opt.get('option_text'), opt.get('is_correct', False)))
+    insert_options(db, question_id, data.get('options', []))
+    test_ids = invalidate_question(db, question_id)
+    mark_changed(db, test_ids)
     db.commit()
+    test_papers.invalidate(test_ids)
+    question_pools.invalidate()
     q = db.execute('SELECT * FROM questions WHERE id = ?', (question_id,)).fetchone()
     qd = question_row_to_dict(q)
     qd['options'] = get_options_for_question(db, question_id)
@@ -163,8 +183,12 @@ def delete_question(question_id):
     q = db.execute('SELECT * FROM questions WHERE id = ?', (question_id,)).fetchone()
     if not q:
         return jsonify({'message': 'Question not found'}), 404
+    test_ids = invalidate_question(db, question_id)
+    mark_changed(db, test_ids)
     db.execute('DELETE FROM questions WHERE id = ?', (question_id,))
     db.commit()
+    test_papers.invalidate(test_ids)
+    question_pools.invalidate()
     return '', 204
 
 @question_bank.route('/api/v1/questions/bulk-upload', methods=['POST'])
@@ -176,33 +200,41 @@ def bulk_upload():
     file = request.files['file']
     if not file.filename.endswith('.csv'):
         return jsonify({'message': 'Only CSV files supported'}), 400
+    try:
+        batch_size = int(request.args.get('batch_size', current_app.config.get('BULK_UPLOAD_BATCH_SIZE', DEFAULT_BATCH_SIZE)))
+    except ValueError:
+        return jsonify({'message': 'batch_size must be an integer'}), 400
+    batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+    # Batches are committed as they go, so a bad byte must be found before the first one
+    if not is_utf8(file.stream):
+        return jsonify({'message': 'File must be UTF-8 encoded'}), 400
     db = get_db()
-    stream = io.StringIO(file.stream.read().decode('utf-8'))
-    reader = csv.DictReader(stream)
-    success, errors = 0, []
-    for i, row in enumerate(reader, 2):
-        try:
-            cur = db.execute(
-                'INSERT INTO questions (subject_id, topic_id, question_type, content, difficulty, explanation, created_by) VALUES (?, ?, ?, ?, ?, ?, ?)',
-                (row['subject_id'], row['topic_id'], row['question_type'], row['content'], row['difficulty'], row['explanation'], g.user['user_id'])
-            )
-            question_id = cur.lastrowid
-            # Update id column to match rowid if needed
-            db.execute('UPDATE questions SET id = ? WHERE rowid = ?', (question_id, question_id))
-            # Parse options (assume JSON string or semicolon-separated)
-            options = row.get('options', '')
-            if options:
-                import json
-                try:
-                    opts = json.loads(options)
-                except Exception:
-                    opts = [o.strip() for o in options.split(';') if o.strip()]
-                    opts = [{'option_text': o, 'is_correct': False} for o in opts]
-                for opt in opts:
-                    db.execute('INSERT INTO question_options (question_id, option_text, is_correct) VALUES (?, ?, ?)',
-                               (question_id, opt.get('option_text'), opt.get('is_correct', False)))
-            success += 1
-        except Exception as e:
-            errors.append({'row': i, 'message': str(e)})
-    db.commit()
-    return jsonify({'success_count': success, 'error_count': len(errors), 'errors': errors, 'summary': f"{success} questions added, {len(errors)} errors found."}), 200
+    if wants_async():
+        job_id = enqueue_upload_job(db, file, batch_size)
+        return job_accepted(job_id)
+    stream = io.TextIOWrapper(file.stream, encoding='utf-8-sig', newline='')
+    try:
+        result = import_questions(db, stream, g.user['user_id'], batch_size)
+    finally:
+        # Batches are committed as they go, so even a failed upload may have added questions
+        question_pools.invalidate()
+    return jsonify(result), 200
+
+def enqueue_upload_job(db, file, batch_size):
+    path = os.path.join(job_output_dir(), f"upload_{os.urandom(8).hex()}_{secure_filename(file.filename)}")
+    file.save(path)
+    return enqueue_job(db, 'bulk_upload', {'path': path, 'batch_size': batch_size, 'created_by': g.user['user_id']}, g.user['user_id'])
+
+# Re-running a half-imported file would duplicate questions, so no automatic retries
+@job_handler('bulk_upload', max_attempts=1)
+def run_bulk_upload_job(db, job):
+    p = job.payload
+    if not os.path.exists(p['path']):
+        raise RuntimeError('The uploaded file is no longer available; upload it again')
+    try:
+        with open(p['path'], encoding='utf-8-sig', newline='') as f:
+            return import_questions(db, f, p['created_by'], p['batch_size'], progress=lambda read, ok: job.progress(read))
+    finally:
+        question_pools.invalidate()
+        # Succeeded, failed or cancelled, this upload is not run again from this file
+        os.remove(p['path'])
@@ -0,0 +1,144 @@
+import codecs
+import csv
+import json
+import time
+from db import insert_many, backend_of
+
+# --- Batched CSV question importer used by bulk upload ---
+DEFAULT_BATCH_SIZE = 1000
+MAX_BATCH_SIZE = 10000
+QUESTION_TYPES = ('mcq_single', 'mcq_multiple', 'true_false', 'short_answer', 'fill_blank')
+REQUIRED_COLUMNS = ('question_type', 'content')
+
+QUESTION_COLUMNS = ('subject_id', 'topic_id', 'question_type', 'content', 'difficulty', 'explanation', 'created_by')
+OPTION_COLUMNS = ('question_id', 'option_text', 'is_correct')
+
+def is_utf8(stream, chunk_size=64 * 1024):
+    """Whether a seekable binary stream decodes as UTF-8; the stream is rewound either way."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        while True:
+            chunk = stream.read(chunk_size)
+            decoder.decode(chunk, final=not chunk)
+            if not chunk:
+                return True
+    except UnicodeDecodeError:
+        return False
+    finally:
+        stream.seek(0)
+
+def parse_options(raw):
+    """Options are either a JSON list of {option_text, is_correct} or 'a; b; c'."""
+    if not raw:
+        return []
+    try:
+        opts = json.loads(raw)
+    except ValueError:
+        opts = None
+    if not isinstance(opts, list):
+        return [{'option_text': o.strip(), 'is_correct': False} for o in raw.split(';') if o.strip()]
+    opts = [{'option_text': o, 'is_correct': False} if isinstance(o, str) else o for o in opts]
+    for o in opts:
+        if not isinstance(o, dict) or not o.get('option_text'):
+            raise ValueError('every option needs option_text')
+    return opts
+
+def validate_row(row, created_by):
+    """Turn a CSV row into (question params, options) or raise ValueError."""
+    missing = [c for c in REQUIRED_COLUMNS if not (row.get(c) or '').strip()]
+    if missing:
+        raise ValueError(f"Missing required fields: {', '.join(missing)}")
+    if row['question_type'] not in QUESTION_TYPES:
+        raise ValueError(f"Invalid question_type: {row['question_type']}")
+    params = (row.get('subject_id') or None, row.get('topic_id') or None, row['question_type'],
+              row['content'], row.get('difficulty') or None, row.get('explanation') or None, created_by)
+    return params, parse_options(row.get('options'))
+
+def _insert_rows(db, rows):
+    """Insert validated (line, params, options) rows; DB errors propagate to the caller."""
+    new_ids = insert_many(db, 'questions', QUESTION_COLUMNS, [params for _, params, _ in rows])
+    insert_many(db, 'question_options', OPTION_COLUMNS, [
+        (qid, opt.get('option_text'), opt.get('is_correct', False))
+        for qid, (_, _, opts) in zip(new_ids, rows) for opt in opts
+    ])
+
+def _flush(db, batch, errors):
+    """Write one batch inside a savepoint, isolating bad rows if the batch fails.
+
+    The write lock is held from the start: a savepoint opened on its own is a
+    deferred transaction, and under WAL its first write fails with
+    SQLITE_BUSY_SNAPSHOT if another writer committed after it first read.
+    A transient error is raised rather than retried row by row, where every
+    row would fail the same way.
+    """
+    backend = backend_of(db)
+    if not db.in_transaction:
+        backend.begin_write(db)
+    db.execute('SAVEPOINT import_batch')
+    try:
+        _insert_rows(db, batch)
+        inserted = len(batch)
+    except Exception as e:
+        db.execute('ROLLBACK TO import_batch')
+        if backend.is_transient(e):
+            db.rollback()
+            raise
+        inserted = 0
+        for item in batch:
+            db.execute('SAVEPOINT import_row')
+            try:
+                _insert_rows(db, [item])
+                inserted += 1
+            except Exception as e:
+                db.execute('ROLLBACK TO import_row')
+                errors.append({'row': item[0], 'message': str(e)})
+            db.execute('RELEASE import_row')
+    db.execute('RELEASE import_batch')
+    db.commit()
+    return inserted
+
+def import_questions(db, text_stream, created_by, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """Import questions from a CSV text stream without loading it into memory.
+
+    Rows are validated as they are read; valid rows are written with
+    executemany in batches of batch_size, each committed separately.
+    progress, if given, is called with the running (rows_read, success_count).
+    Returns the bulk upload response payload including throughput stats.
+    """
+    started = time.perf_counter()
+    reader = csv.DictReader(text_stream)
+    success, errors, batch, batches, total = 0, [], [], 0, 0
+    for line, row in enumerate(reader, 2):
+        total += 1
+        try:
+            params, options = validate_row(row, created_by)
+        except ValueError as e:
+            errors.append({'row': line, 'message': str(e)})
+            continue
+        batch.append((line, params, options))
+        if len(batch) >= batch_size:
+            success += _flush(db, batch, errors)
+            batches += 1
+            batch = []
+            if progress:
+                progress(total, success)
+    if batch:
+        success += _flush(db, batch, errors)
+        batches += 1
+    if progress:
+        progress(total, success)
+    elapsed = time.perf_counter() - started
+    errors.sort(key=lambda e: e['row'])
+    return {
+        'success_count': success,
+        'error_count': len(errors),
+        'errors': errors,
+        'summary': f"{success} questions added, {len(errors)} errors found.",
+        'stats': {
+            'rows_read': total,
+            'batch_size': batch_size,
+            'batches': batches,
+            'elapsed_seconds': round(elapsed, 4),
+            'rows_per_second': round(total / elapsed, 1) if elapsed else None,
+        },
+    }
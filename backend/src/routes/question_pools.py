@@ -0,0 +1,184 @@
+from flask import current_app
+import threading
+import time
+
+# --- Blueprint-based question sampling ---
+# The bank is indexed in memory as lists of question ids per
+# (subject_id, topic_id, difficulty, question_type), loaded with one query and
+# reloaded after the bank changes. A blueprint rule such as "10 easy
+# questions of topic 3" is drawn from the pools it matches in O(count),
+# without ORDER BY RANDOM() scans of the questions table. Per-student papers
+# share one PaperDraw, which keeps the ids no paper has used yet per pool, so
+# each paper costs O(questions drawn) however many papers came before it.
+DEFAULT_POOLS_TTL = 300
+MAX_GENERATED_QUESTIONS = 1000
+
+RULE_FIELDS = ('subject_id', 'topic_id', 'difficulty', 'question_type')
+
+class BlueprintError(ValueError):
+    pass
+
+def parse_blueprint(blueprint):
+    """Validate [{subject_id?, topic_id?, difficulty?, question_type?, count}] into (filters, count) rules."""
+    if not isinstance(blueprint, list) or not blueprint:
+        raise BlueprintError('blueprint must be a non-empty list of rules')
+    rules = []
+    for n, rule in enumerate(blueprint, 1):
+        if not isinstance(rule, dict):
+            raise BlueprintError(f'Blueprint rule {n} must be an object')
+        try:
+            count = int(rule.get('count'))
+            filters = {f: rule[f] for f in RULE_FIELDS if rule.get(f) is not None}
+            for f in ('subject_id', 'topic_id'):
+                if f in filters:
+                    filters[f] = int(filters[f])
+        except (TypeError, ValueError):
+            raise BlueprintError(f'Blueprint rule {n} needs an integer count and integer subject/topic ids')
+        if count < 1:
+            raise BlueprintError(f'Blueprint rule {n} needs a positive count')
+        rules.append((filters, count))
+    if sum(count for _, count in rules) > MAX_GENERATED_QUESTIONS:
+        raise BlueprintError(f'A blueprint can ask for at most {MAX_GENERATED_QUESTIONS} questions')
+    return rules
+
+class PoolIndex:
+    """Question ids of one database grouped by (subject_id, topic_id, difficulty, question_type)."""
+
+    def __init__(self, rows):
+        self.pools = {}
+        self.key_of = {}
+        self.position = {}
+        for r in rows:
+            key = (r['subject_id'], r['topic_id'], r['difficulty'], r['question_type'])
+            ids = self.pools.setdefault(key, [])
+            self.key_of[r['id']] = key
+            self.position[r['id']] = len(ids)
+            ids.append(r['id'])
+
+    @classmethod
+    def load(cls, db):
+        return cls(db.execute('SELECT id, subject_id, topic_id, difficulty, question_type FROM questions'))
+
+    @staticmethod
+    def matches(key, filters):
+        return all(key[i] == filters[f] for i, f in enumerate(RULE_FIELDS) if f in filters)
+
+    def draw(self, rng):
+        return PaperDraw(self, rng)
+
+class FreeIds:
+    """The ids of one pool no paper has drawn yet.
+
+    A Fisher-Yates shuffle run lazily: the first `count` slots hold the free
+    ids, and only the slots changed so far are stored, so taking an id costs
+    O(1) whatever the size of the pool.
+    """
+
+    def __init__(self, index, key):
+        self.index = index
+        self.ids = index.pools[key]
+        self.count = len(self.ids)
+        self.moved = {}  # slot -> id, where it differs from self.ids
+        self.slot = {}  # id -> slot, for ids that were moved
+
+    def take(self, i):
+        """Take the id in free slot i, moving the last free id into its place."""
+        last = self.count - 1
+        qid = self.moved.get(i, self.ids[i])
+        filler = self.moved.get(last, self.ids[last])
+        self.moved[i], self.slot[filler] = filler, i
+        self.moved[last], self.slot[qid] = qid, last
+        self.count = last
+        return qid
+
+    def discard(self, qid):
+        i = self.slot.get(qid, self.index.position[qid])
+        if i < self.count:
+            self.take(i)
+
+class PaperDraw:
+    """Draws papers from a PoolIndex, each avoiding the questions earlier papers used as far as the bank allows.
+
+    The free ids and their per-pool counts are kept up to date as questions
+    are drawn, so a paper costs O(questions drawn) rather than a pass over
+    the bank or over the questions already used.
+    """
+
+    def __init__(self, index, rng):
+        self.index = index
+        self.rng = rng
+        self.free = {}  # pool key -> FreeIds
+        self.matching = {}  # rule filters -> matching pool keys
+
+    def pools(self, filters):
+        rule = tuple(sorted(filters.items()))
+        if rule not in self.matching:
+            self.matching[rule] = [key for key in self.index.pools if self.index.matches(key, filters)]
+        for key in self.matching[rule]:
+            if key not in self.free:
+                self.free[key] = FreeIds(self.index, key)
+        return [self.free[key] for key in self.matching[rule]]
+
+    def paper(self, rules):
+        """Question ids for one paper, rule by rule; ids used by earlier papers are drawn only if a rule cannot be met without them."""
+        picked = []
+        taken = set()
+        for n, (filters, count) in enumerate(rules, 1):
+            pools = self.pools(filters)
+            if sum(p.count for p in pools) >= count:
+                ids = [self.take_free(pools) for _ in range(count)]
+            else:
+                ids = self.reuse(pools, count, taken, n)
+            picked.extend(ids)
+            taken.update(ids)
+        return picked
+
+    def take_free(self, pools):
+        """A uniformly random free id from the given pools."""
+        i = self.rng.randrange(sum(p.count for p in pools))
+        for p in pools:
+            if i < p.count:
+                return p.take(i)
+            i -= p.count
+
+    def reuse(self, pools, count, taken, n):
+        # The free ids run short: draw from every id this paper has not taken, as if the bank were fresh
+        candidates = [qid for p in pools for qid in p.ids if qid not in taken]
+        if count > len(candidates):
+            raise BlueprintError(f'Blueprint rule {n} needs {count} questions but only {len(candidates)} are available')
+        ids = self.rng.sample(candidates, count)
+        for qid in ids:
+            self.free[self.index.key_of[qid]].discard(qid)
+        return ids
+
+class QuestionPools:
+    """PoolIndex per database; reloaded after invalidate() or QUESTION_POOLS_TTL seconds."""
+
+    def __init__(self):
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.loads = 0
+
+    def get(self, db):
+        db_name = getattr(db, 'db_name', None) or current_app.config.get('DATABASE')
+        ttl = current_app.config.get('QUESTION_POOLS_TTL', DEFAULT_POOLS_TTL)
+        with self._lock:
+            entry = self._indexes.get(db_name)
+            if entry and time.monotonic() - entry[0] < ttl:
+                return entry[1]
+            generation = self._generation
+        index = PoolIndex.load(db)
+        with self._lock:
+            self.loads += 1
+            # Skip caching an index the bank changed under while it loaded
+            if generation == self._generation:
+                self._indexes[db_name] = (time.monotonic(), index)
+        return index
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._indexes.clear()
+
+question_pools = QuestionPools()
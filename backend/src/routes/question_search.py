@@ -0,0 +1,85 @@
+import re
+from storage import backend_of
+
+# --- Full-text search over question content and explanation ---
+# Backed by the questions_fts FTS5 table on SQLite and the search_vector
+# column on PostgreSQL (migration 0004). Scores sort ascending: lower is
+# more relevant on both engines.
+SEARCH_FIELDS = ['relevance', 'snippets']
+
+SNIPPET_START = '<mark>'
+SNIPPET_END = '</mark>'
+SNIPPET_ELLIPSIS = '...'
+SNIPPET_TOKENS = 16
+# SQLite builds before 3.32 cap host parameters at 999 per statement
+SNIPPET_CHUNK_SIZE = 900
+
+# Content matches count double an explanation match
+CONTENT_WEIGHT = 2.0
+EXPLANATION_WEIGHT = 1.0
+
+SQLITE_SEARCH = (
+    'SELECT * FROM (SELECT q.*, bm25(questions_fts, {content}, {explanation}) AS score'
+    ' FROM questions_fts JOIN questions q ON q.rowid = questions_fts.rowid'
+    ' WHERE questions_fts MATCH ?{filters}) WHERE 1=1'
+)
+POSTGRES_SEARCH = (
+    'SELECT * FROM (SELECT q.*, -ts_rank(q.search_vector, query) AS score'
+    ' FROM questions q, to_tsquery(\'simple\', ?) query'
+    ' WHERE q.search_vector @@ query{filters}) AS matches WHERE 1=1'
+)
+
+def search_terms(text):
+    return re.findall(r'\w+', text or '')
+
+def match_expression(db, terms):
+    """Build the engine's query string: every term must match, each as a prefix.
+
+    Terms are reduced to word characters first, so user input can never
+    inject query syntax.
+    """
+    if backend_of(db).name == 'sqlite':
+        return ' '.join(f'"{t}"*' for t in terms)
+    return ' & '.join(f'{t}:*' for t in terms)
+
+def search_query(db, filters):
+    """SELECT of matching questions with a score column; takes the match expression first."""
+    template = SQLITE_SEARCH if backend_of(db).name == 'sqlite' else POSTGRES_SEARCH
+    return template.format(content=CONTENT_WEIGHT, explanation=EXPLANATION_WEIGHT, filters=filters)
+
+def get_snippets(db, match, question_ids):
+    """Highlighted content/explanation excerpts for the given questions only.
+
+    Issues one query per SNIPPET_CHUNK_SIZE ids, so an unpaginated search
+    with many matches stays under the host parameter limit.
+    """
+    question_ids = list(question_ids)
+    snippets = {}
+    for start in range(0, len(question_ids), SNIPPET_CHUNK_SIZE):
+        chunk = question_ids[start:start + SNIPPET_CHUNK_SIZE]
+        placeholders = ', '.join('?' * len(chunk))
+        if backend_of(db).name == 'sqlite':
+            args = f"'{SNIPPET_START}', '{SNIPPET_END}', '{SNIPPET_ELLIPSIS}', {SNIPPET_TOKENS}"
+            rows = db.execute(
+                f'SELECT rowid AS id, snippet(questions_fts, 0, {args}) AS content, snippet(questions_fts, 1, {args}) AS explanation'
+                f' FROM questions_fts WHERE questions_fts MATCH ? AND rowid IN ({placeholders})',
+                [match] + chunk
+            ).fetchall()
+        else:
+            options = f'StartSel={SNIPPET_START}, StopSel={SNIPPET_END}, FragmentDelimiter={SNIPPET_ELLIPSIS}, MaxWords={SNIPPET_TOKENS}, MinWords=1'
+            rows = db.execute(
+                f"SELECT q.id, ts_headline('simple', coalesce(q.content, ''), query, '{options}') AS content,"
+                f" ts_headline('simple', coalesce(q.explanation, ''), query, '{options}') AS explanation"
+                f" FROM questions q, to_tsquery('simple', ?) query WHERE q.id IN ({placeholders})",
+                [match] + chunk
+            ).fetchall()
+        snippets.update({r['id']: {'content': r['content'], 'explanation': r['explanation']} for r in rows})
+    return snippets
+
+def attach_search_results(db, match, question_dicts, rows):
+    """Add relevance and snippets to question dicts built from search rows."""
+    snippets = get_snippets(db, match, [qd['id'] for qd in question_dicts])
+    for qd, row in zip(question_dicts, rows):
+        qd['relevance'] = round(-row['score'], 6)
+        qd['snippets'] = snippets.get(qd['id'], {'content': '', 'explanation': ''})
+    return question_dicts
@@ -0,0 +1,163 @@
+from flask import request, g, current_app
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+# --- Structured, sampled request logging ---
+# One JSON line per sampled request (method, path, endpoint, status,
+# duration, user) instead of DEBUG dumps of every header and body. Records go
+# through a QueueHandler, so request threads never wait on the stream; a
+# QueueListener thread formats and writes them.
+#
+# Nothing is set up at import: the handler is installed by the first request
+# a process serves, so settings made after import (or in a forked worker)
+# apply, and a root logger that already has handlers (a server's or a test
+# runner's logging setup) is left as it is.
+#
+# Settings (app.config):
+#   LOG_LEVEL                 root level when the handler is installed, default INFO
+#   LOG_FORMAT                'json' (default) or 'text'
+#   LOG_REQUESTS              False logs no requests (read per request)
+#   LOG_SAMPLE_RATE           fraction of requests logged, default 0.01
+#   LOG_ROUTE_SAMPLE_RATES    {endpoint: rate} overrides, e.g. {'login': 1.0}
+#   LOG_BODIES                include request/response bodies of sampled requests
+#   LOG_BODY_MAX_BYTES        bodies larger than this are logged by size only
+#   LOG_HOT_ROUTES            False (default) skips @hot_path views entirely
+# Server errors (5xx) are always logged.
+DEFAULT_SAMPLE_RATE = 0.01
+DEFAULT_BODY_MAX_BYTES = 1024
+
+REDACTED = '[REDACTED]'
+SENSITIVE_KEYS = frozenset(('authorization', 'cookie', 'set-cookie', 'password', 'newpassword', 'token',
+                            'resettoken', 'secret', 'secret_key', 'password_hash'))
+
+logger = logging.getLogger('begining.requests')
+
+def hot_path(f):
+    """Mark a view as too hot to log unless LOG_HOT_ROUTES is set; put it right under @route."""
+    f.hot_path = True
+    return f
+
+def redact(value):
+    """Copy of value with sensitive keys masked, at any depth."""
+    if isinstance(value, dict):
+        return {k: REDACTED if str(k).lower() in SENSITIVE_KEYS else redact(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact(v) for v in value]
+    return value
+
+def capped_body(data, content_type, max_bytes):
+    """A redacted JSON body, or just its size when it is too large or not JSON."""
+    if not data:
+        return None
+    if len(data) > max_bytes or 'json' not in (content_type or ''):
+        return {'bytes': len(data)}
+    try:
+        return redact(json.loads(data))
+    except ValueError:
+        return {'bytes': len(data)}
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        fields = getattr(record, 'fields', None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+_install_lock = threading.Lock()
+_installed = {}  # pid -> our QueueHandler
+
+def install_log_handler(app):
+    """Route root logging through a queue to one stream handler, once per process.
+
+    Returns the listener, or None if this process already did it or the root
+    logger was configured by someone else.
+    """
+    pid = os.getpid()
+    if pid in _installed:
+        return None
+    with _install_lock:
+        if pid in _installed:
+            return None
+        root = logging.getLogger()
+        # A handler inherited across fork writes to a queue whose listener thread stayed in the parent
+        inherited = [h for h in root.handlers if h in _installed.values()]
+        for handler in inherited:
+            root.removeHandler(handler)
+        _installed[pid] = None
+        if root.handlers:
+            return None
+        stream = logging.StreamHandler(sys.stderr)
+        if app.config.get('LOG_FORMAT', 'json') == 'json':
+            stream.setFormatter(JsonFormatter())
+        else:
+            stream.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+        records = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(records, stream, respect_handler_level=True)
+        handler = _installed[pid] = logging.handlers.QueueHandler(records)
+        root.addHandler(handler)
+        root.setLevel(app.config.get('LOG_LEVEL', 'INFO'))
+        listener.start()
+        atexit.register(listener.stop)
+        return listener
+
+def configure_logging(app):
+    """Register the request log hooks; the LOG_* settings are read when requests arrive."""
+    app.before_request(start_request_log)
+    app.after_request(finish_request_log)
+
+def start_request_log():
+    config = current_app.config
+    install_log_handler(current_app)
+    g.request_log = None
+    if not config.get('LOG_REQUESTS', True):
+        return
+    view = current_app.view_functions.get(request.endpoint)
+    if getattr(view, 'hot_path', False) and not config.get('LOG_HOT_ROUTES', False):
+        return
+    rate = config.get('LOG_ROUTE_SAMPLE_RATES', {}).get(request.endpoint, config.get('LOG_SAMPLE_RATE', DEFAULT_SAMPLE_RATE))
+    g.request_log = {'started': time.perf_counter(), 'sampled': random.random() < rate}
+
+def finish_request_log(response):
+    entry = g.get('request_log')
+    if entry is None or not (entry['sampled'] or response.status_code >= 500):
+        return response
+    config = current_app.config
+    fields = {
+        'method': request.method,
+        'path': request.path,
+        'endpoint': request.endpoint,
+        'status': response.status_code,
+        'duration_ms': round((time.perf_counter() - entry['started']) * 1000, 3),
+        'user_id': (g.get('user') or {}).get('user_id'),
+    }
+    if config.get('LOG_BODIES', False):
+        max_bytes = config.get('LOG_BODY_MAX_BYTES', DEFAULT_BODY_MAX_BYTES)
+        if (request.content_length or 0) > max_bytes:
+            fields['request_body'] = {'bytes': request.content_length}
+        else:
+            fields['request_body'] = capped_body(request.get_data(cache=True), request.content_type, max_bytes)
+        # Only bodies already in memory and small enough are read back
+        if response.is_streamed or response.content_encoding:
+            fields['response_body'] = None
+        elif (response.content_length or 0) > max_bytes:
+            fields['response_body'] = {'bytes': response.content_length}
+        else:
+            fields['response_body'] = capped_body(response.get_data(), response.content_type, max_bytes)
+    logger.info('%s %s %s', request.method, request.path, response.status_code, extra={'fields': fields})
+    return response
@@ -0,0 +1,327 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from flask import current_app
+from db import insert, insert_many, fill_ids
+from storage import backend_of
+from analytics import StatsDelta, StudentAggregator, rebuild_test_stats, rebuild_student_analytics
+from shuffle import ShuffleMode, question_positions
+
+# --- Automatic scoring of objective questions ---
+# Each correct answer is worth one point. short_answer questions are left
+# ungraded (is_correct NULL) for manual review.
+SELECTION_TYPES = ('mcq_single', 'mcq_multiple', 'true_false')
+TEXT_TYPES = ('fill_blank',)
+
+DEFAULT_KEY_CACHE_SIZE = 256
+DEFAULT_KEY_TTL = 300
+RESCORE_BATCH_SIZE = 500
+
+ANSWER_COLUMNS = ('attempt_id', 'question_id', 'selected_option_ids', 'answer_text', 'is_correct', 'answered_at')
+
+class AnswerError(ValueError):
+    pass
+
+def normalize_text(text):
+    return ' '.join(str(text).split()).casefold()
+
+class QuestionKey:
+    __slots__ = ('question_type', 'subject_id', 'topic_id', 'option_ids', 'correct_ids', 'correct_texts')
+
+    def __init__(self, question_type, subject_id=None, topic_id=None):
+        self.question_type = question_type
+        self.subject_id = subject_id
+        self.topic_id = topic_id
+        self.option_ids = set()
+        self.correct_ids = set()
+        self.correct_texts = set()
+
+    def grade(self, selected, text):
+        """True/False for objective questions, None when a teacher has to review it."""
+        if self.question_type in SELECTION_TYPES:
+            picked = set(selected or ())
+            return bool(picked) and picked == self.correct_ids
+        if self.question_type in TEXT_TYPES:
+            return text is not None and normalize_text(text) in self.correct_texts
+        return None
+
+class AnswerKey:
+    """Correct options and accepted answers for every question of one test."""
+
+    def __init__(self, test_id, questions, shuffle=None):
+        self.test_id = test_id
+        self.questions = questions  # in paper order
+        self.shuffle = shuffle or ShuffleMode()
+
+    @property
+    def max_score(self):
+        return sum(1 for q in self.questions.values() if q.question_type in SELECTION_TYPES + TEXT_TYPES)
+
+    @classmethod
+    def load(cls, db, test_id):
+        questions = {}
+        for r in db.execute('SELECT q.id, q.question_type, q.subject_id, q.topic_id FROM test_questions tq'
+                            ' JOIN questions q ON q.id = tq.question_id WHERE tq.test_id = ? ORDER BY tq.question_order, q.id', (test_id,)):
+            questions[r['id']] = QuestionKey(r['question_type'], r['subject_id'], r['topic_id'])
+        for o in db.execute('SELECT o.id, o.question_id, o.option_text, o.is_correct FROM test_questions tq'
+                            ' JOIN question_options o ON o.question_id = tq.question_id WHERE tq.test_id = ?', (test_id,)):
+            q = questions[o['question_id']]
+            q.option_ids.add(o['id'])
+            if o['is_correct']:
+                q.correct_ids.add(o['id'])
+                q.correct_texts.add(normalize_text(o['option_text']))
+        test = db.execute('SELECT pattern FROM tests WHERE id = ?', (test_id,)).fetchone()
+        return cls(test_id, questions, ShuffleMode.from_pattern(test['pattern'] if test else None))
+
+    def positions(self, seed):
+        """question_id -> position on the paper of the student with this seed."""
+        return question_positions(seed, self.shuffle, list(self.questions))
+
+    def grade(self, answers):
+        """Grade normalized answers; returns ([(question_id, selected, text, is_correct)], score, is_graded)."""
+        graded = []
+        score = 0
+        is_graded = True
+        for question_id, selected, text in answers:
+            question = self.questions.get(question_id)
+            if question is None:
+                continue
+            is_correct = question.grade(selected, text)
+            if is_correct is None:
+                is_graded = False
+            elif is_correct:
+                score += 1
+            graded.append((question_id, selected, text, is_correct))
+        return graded, score, is_graded
+
+class AnswerKeyCache:
+    """Bounded LRU of answer keys per (database, test), so submissions skip the key queries.
+
+    Keys are invalidated in-process when a test or one of its questions
+    changes; DEFAULT_KEY_TTL bounds how long another process can serve a
+    stale key.
+    """
+
+    def __init__(self):
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, db, test_id):
+        cache_key = (getattr(db, 'db_name', None) or current_app.config.get('DATABASE'), test_id)
+        ttl = current_app.config.get('ANSWER_KEY_TTL', DEFAULT_KEY_TTL)
+        with self._lock:
+            entry = self._keys.get(cache_key)
+            if entry and time.monotonic() - entry[0] < ttl:
+                self._keys.move_to_end(cache_key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+        key = AnswerKey.load(db, test_id)
+        with self._lock:
+            # Skip caching a key that was invalidated while it loaded
+            if generation == self._generation:
+                self._keys[cache_key] = (time.monotonic(), key)
+                self._keys.move_to_end(cache_key)
+                while len(self._keys) > current_app.config.get('ANSWER_KEY_CACHE_SIZE', DEFAULT_KEY_CACHE_SIZE):
+                    self._keys.popitem(last=False)
+        return key
+
+    def invalidate(self, test_ids=None):
+        with self._lock:
+            self._generation += 1
+            if test_ids is None:
+                self._keys.clear()
+                return
+            test_ids = set(test_ids)
+            for cache_key in [k for k in self._keys if k[1] in test_ids]:
+                del self._keys[cache_key]
+
+answer_keys = AnswerKeyCache()
+
+def invalidate_question(db, question_id):
+    """Drop cached keys of every test that uses question_id; returns those test ids."""
+    test_ids = [r[0] for r in db.execute('SELECT test_id FROM test_questions WHERE question_id = ?', (question_id,))]
+    answer_keys.invalidate(test_ids)
+    return test_ids
+
+def normalize_answers(answers):
+    """Accept [{question_id, selected_option_ids, answer_text}] or the frontend's [{question_id, answer}].
+
+    Returns [(question_id, selected_option_ids, answer_text)]; a later answer
+    to the same question replaces an earlier one.
+    """
+    if not isinstance(answers, list):
+        raise AnswerError('answers must be a list')
+    normalized = {}
+    for a in answers:
+        try:
+            question_id = int(a['question_id'])
+            selected = a.get('selected_option_ids')
+            text = a.get('answer_text')
+            if selected is None and text is None and 'answer' in a:
+                value = a['answer']
+                if isinstance(value, list):
+                    selected = value
+                elif isinstance(value, int) and not isinstance(value, bool):
+                    selected = [value]
+                elif value is not None:
+                    text = str(value)
+            selected = [int(o) for o in selected] if selected is not None else None
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise AnswerError('Each answer needs a question_id and selected_option_ids or answer_text')
+        normalized[question_id] = (question_id, selected, text)
+    return list(normalized.values())
+
+def find_open_attempt(db, test_id, user_id):
+    """The student's started but not yet submitted attempt, if any."""
+    return db.execute('SELECT id, user_id, started_at FROM test_attempts WHERE test_id = ? AND user_id = ? AND submitted_at IS NULL',
+                      (test_id, user_id)).fetchone()
+
+def open_attempt(db, test_id, user_id):
+    """Return (attempt row, created) for the student's open attempt, starting one if needed."""
+    attempt = find_open_attempt(db, test_id, user_id)
+    if attempt:
+        return attempt, False
+    # Check again holding the write lock, so two first saves or starts cannot both insert one
+    if not db.in_transaction:
+        backend_of(db).begin_write(db)
+    attempt = find_open_attempt(db, test_id, user_id)
+    if attempt:
+        return attempt, False
+    insert(db, 'test_attempts', {'test_id': test_id, 'user_id': user_id, 'started_at': datetime.utcnow()})
+    return find_open_attempt(db, test_id, user_id), True
+
+SAVE_ANSWER = (
+    'INSERT INTO attempt_answers (attempt_id, question_id, selected_option_ids, answer_text, flagged, revision, answered_at)'
+    ' SELECT ?, ?, ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM test_attempts WHERE id = ? AND submitted_at IS NULL)'
+    ' ON CONFLICT (attempt_id, question_id) DO UPDATE SET selected_option_ids = excluded.selected_option_ids,'
+    ' answer_text = excluded.answer_text, flagged = excluded.flagged, revision = excluded.revision, answered_at = excluded.answered_at'
+)
+
+def save_answers(db, rows, force=False):
+    """Upsert [(attempt_id, question_id, selected_option_ids, answer_text, flagged, revision, answered_at)].
+
+    Saving the same answer twice is harmless, a save never overwrites a higher
+    revision unless force is set, and nothing is written to a submitted
+    attempt. The caller commits.
+    """
+    if not rows:
+        return
+    encode = backend_of(db).encode_array
+    sql = SAVE_ANSWER if force else SAVE_ANSWER + ' WHERE excluded.revision >= COALESCE(attempt_answers.revision, 0)'
+    db.executemany(sql, [(a, q, encode(selected), text, flagged, revision, at, a)
+                         for a, q, selected, text, flagged, revision, at in rows])
+    fill_ids(db, 'attempt_answers')
+
+def update_analytics(db, key, user_id, score, started_at, submitted_at, answers):
+    """Fold a scored attempt into the test and student analytics.
+
+    answers: [(question_id, selected_option_ids, is_correct, answered_at)]
+    """
+    delta = StatsDelta(key.test_id)
+    delta.add_attempt(key, score, started_at, answers)
+    delta.apply(db)
+    students = StudentAggregator()
+    students.consume(key, user_id, submitted_at, [(qid, is_correct) for qid, _, is_correct, _ in answers])
+    students.apply(db)
+
+def finalize_attempt(db, test_id, attempt, extra=None):
+    """Submit an open attempt: grade its saved answers and fold it into analytics.
+
+    Returns (attempt_id, score, is_graded, max_score), or None when the
+    attempt was already submitted. The caller commits.
+    """
+    now = datetime.utcnow()
+    values = {'submitted_at': now}
+    values.update(extra or {})
+    claimed = db.execute(f"UPDATE test_attempts SET {', '.join(f'{c} = ?' for c in values)} WHERE id = ? AND submitted_at IS NULL",
+                         list(values.values()) + [attempt['id']]).rowcount
+    if not claimed:
+        return None
+    key = answer_keys.get(db, test_id)
+    decode = backend_of(db).decode_array
+    rows = db.execute('SELECT id, question_id, selected_option_ids, answer_text, answered_at FROM attempt_answers WHERE attempt_id = ?',
+                      (attempt['id'],)).fetchall()
+    saved = {r['question_id']: r for r in rows}
+    graded, score, is_graded = key.grade([(r['question_id'], decode(r['selected_option_ids']), r['answer_text']) for r in rows])
+    db.executemany('UPDATE attempt_answers SET is_correct = ? WHERE id = ?',
+                   [(is_correct, saved[qid]['id']) for qid, _, _, is_correct in graded])
+    db.execute('UPDATE test_attempts SET score = ?, is_graded = ? WHERE id = ?', (score, is_graded, attempt['id']))
+    update_analytics(db, key, attempt['user_id'], score, attempt['started_at'], now,
+                     [(qid, selected, is_correct, saved[qid]['answered_at']) for qid, selected, _, is_correct in graded])
+    return attempt['id'], score, is_graded, key.max_score
+
+def record_attempt(db, test_id, user_id, answers, started_at=None, extra=None):
+    """Grade answers submitted all at once and store the attempt with its answer rows.
+
+    If the student has an open attempt, the answers are saved onto it
+    (replacing autosaved ones) and it is finalized instead.
+    """
+    attempt = find_open_attempt(db, test_id, user_id)
+    if attempt:
+        now = datetime.utcnow()
+        save_answers(db, [(attempt['id'], qid, selected, text, False, 0, now) for qid, selected, text in answers], force=True)
+        return finalize_attempt(db, test_id, attempt, extra)
+    key = answer_keys.get(db, test_id)
+    graded, score, is_graded = key.grade(answers)
+    now = datetime.utcnow()
+    values = {'test_id': test_id, 'user_id': user_id, 'started_at': started_at or now, 'submitted_at': now,
+              'score': score, 'is_graded': is_graded}
+    values.update(extra or {})
+    attempt_id = insert(db, 'test_attempts', values)
+    encode = backend_of(db).encode_array
+    insert_many(db, 'attempt_answers', ANSWER_COLUMNS,
+                [(attempt_id, qid, encode(selected), text, is_correct, now) for qid, selected, text, is_correct in graded])
+    update_analytics(db, key, user_id, score, values['started_at'], now,
+                     [(qid, selected, is_correct, now) for qid, selected, _, is_correct in graded])
+    return attempt_id, score, is_graded, key.max_score
+
+def rescore_test(db, test_id, attempt_id=None, progress=None):
+    """Regrade stored answers of every attempt (or one) with a freshly loaded key.
+
+    Works through attempts in batches of RESCORE_BATCH_SIZE, then rebuilds
+    the test's analytics and those of its students; the caller commits. Returns the number of attempts
+    rescored.
+    """
+    answer_keys.invalidate([test_id])
+    key = answer_keys.get(db, test_id)
+    decode = backend_of(db).decode_array
+    # Open attempts are graded when they are submitted
+    only = ' AND submitted_at IS NOT NULL' + (' AND id = ?' if attempt_id is not None else '')
+    scope = (test_id, attempt_id) if attempt_id is not None else (test_id,)
+    total = db.execute(f'SELECT COUNT(*) FROM test_attempts WHERE test_id = ?{only}', scope).fetchone()[0]
+    done = 0
+    last_id = 0
+    while True:
+        ids = [r[0] for r in db.execute(f'SELECT id FROM test_attempts WHERE test_id = ?{only} AND id > ? ORDER BY id LIMIT ?',
+                                        scope + (last_id, RESCORE_BATCH_SIZE))]
+        if not ids:
+            break
+        rows = db.execute(f"SELECT id, attempt_id, question_id, selected_option_ids, answer_text FROM attempt_answers"
+                          f" WHERE attempt_id IN ({', '.join('?' * len(ids))}) ORDER BY attempt_id, id", ids)
+        answer_updates = []
+        for r in rows:
+            question = key.questions.get(r['question_id'])
+            is_correct = question.grade(decode(r['selected_option_ids']), r['answer_text']) if question else False
+            answer_updates.append((is_correct, r['id'], r['attempt_id']))
+        attempt_scores = {attempt: [0, True] for attempt in ids}
+        for is_correct, _, attempt in answer_updates:
+            if is_correct is None:
+                attempt_scores[attempt][1] = False
+            elif is_correct:
+                attempt_scores[attempt][0] += 1
+        db.executemany('UPDATE attempt_answers SET is_correct = ? WHERE id = ?', [u[:2] for u in answer_updates])
+        db.executemany('UPDATE test_attempts SET score = ?, is_graded = ? WHERE id = ?',
+                       [(score, graded, attempt) for attempt, (score, graded) in attempt_scores.items()])
+        done += len(ids)
+        last_id = ids[-1]
+        if progress:
+            progress(done, total)
+    rebuild_test_stats(db, key)
+    rebuild_student_analytics(db, lambda t: answer_keys.get(db, t), test_id=test_id)
+    return done
@@ -0,0 +1,59 @@
+import hashlib
+import hmac
+import random
+import re
+
+# --- Per-student question and option order ---
+# A test opts in through its pattern: 'shuffle' reorders both questions and
+# options, 'shuffle_questions' / 'shuffle_options' only one of them (e.g.
+# pattern "MCQ, shuffle_options"). Nothing is stored per student: the order
+# is a pure function of a seed derived from the test, the student and the
+# app secret, so the same student always gets the same paper and the order
+# can be recomputed wherever it is needed. Answers carry question and option
+# ids, so grading does not depend on the order at all.
+SHUFFLE_BOTH = 'shuffle'
+SHUFFLE_QUESTIONS = 'shuffle_questions'
+SHUFFLE_OPTIONS = 'shuffle_options'
+
+class ShuffleMode:
+    __slots__ = ('questions', 'options')
+
+    def __init__(self, questions=False, options=False):
+        self.questions = questions
+        self.options = options
+
+    def __bool__(self):
+        return self.questions or self.options
+
+    @classmethod
+    def from_pattern(cls, pattern):
+        tokens = set(re.split(r'[\s,;|+]+', (pattern or '').lower()))
+        both = SHUFFLE_BOTH in tokens
+        return cls(both or SHUFFLE_QUESTIONS in tokens, both or SHUFFLE_OPTIONS in tokens)
+
+def student_seed(secret, test_id, user_id):
+    """Seed of one student's paper; keyed by the app secret so students cannot work out each other's order."""
+    message = f'{test_id}:{user_id}'.encode('utf-8')
+    return hmac.new(str(secret).encode('utf-8'), message, hashlib.sha256).hexdigest()[:16]
+
+def permutation(seed, n, salt=''):
+    """Deterministic Fisher-Yates order of range(n): position -> canonical index."""
+    order = list(range(n))
+    random.Random(f'{seed}:{salt}').shuffle(order)
+    return order
+
+def shuffle_questions(questions, seed, mode):
+    """Copy of a canonical list of question dicts in the student's order."""
+    if mode.questions:
+        questions = [questions[i] for i in permutation(seed, len(questions))]
+    if mode.options:
+        # Salted per question, so editing one question leaves the others' order alone
+        questions = [dict(q, options=[q['options'][i] for i in permutation(seed, len(q['options']), q['id'])])
+                     if q.get('options') else q for q in questions]
+    return questions
+
+def question_positions(seed, mode, question_ids):
+    """question_id -> position on the student's paper (canonical order without a seed)."""
+    if seed is None or not mode.questions:
+        return {qid: i for i, qid in enumerate(question_ids)}
+    return {question_ids[index]: position for position, index in enumerate(permutation(seed, len(question_ids)))}
@@ -0,0 +1,255 @@
+import sqlite3
+import json
+import re
+import time
+from functools import lru_cache
+
+# --- Storage backends: the dialect-specific bits the blueprints go through ---
+# Route code keeps writing '?' placeholders and calling db.execute(); anything
+# that differs between engines (new ids, arrays, write locks) lives here.
+
+POSTGRES_SCHEMES = ('postgres://', 'postgresql://')
+
+def observed(db, method, sql, params):
+    """Run method(sql, params) and report it to db.observer(db, sql, params, seconds)."""
+    observer = db.observer
+    db.observer = None  # so an observer can query the connection itself
+    started = time.perf_counter()
+    try:
+        return method(sql, params)
+    finally:
+        elapsed = time.perf_counter() - started
+        db.observer = observer
+        observer(db, sql, params, elapsed)
+
+class Connection(sqlite3.Connection):
+    """sqlite3 connection that can carry pool bookkeeping attributes.
+
+    Setting observer times every execute()/executemany() (until the first row
+    is ready, not the fetches) and reports it; the pool clears it on release.
+    """
+    pool = None
+    db_name = None
+    observer = None
+
+    def execute(self, sql, params=()):
+        if self.observer is None:
+            return super().execute(sql, params)
+        return observed(self, super().execute, sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        if self.observer is None:
+            return super().executemany(sql, seq_of_params)
+        return observed(self, super().executemany, sql, seq_of_params)
+
+class SQLiteBackend:
+    name = 'sqlite'
+    skip_locked = ''
+
+    def connect(self, db_name, config):
+        busy_ms = config.get('DB_BUSY_TIMEOUT_MS', 5000)
+        db = sqlite3.connect(db_name, detect_types=sqlite3.PARSE_DECLTYPES, timeout=busy_ms / 1000,
+                             check_same_thread=False, factory=Connection)
+        db.row_factory = sqlite3.Row
+        # WAL lets readers run alongside the single writer; NORMAL sync is durable
+        # across application crashes and only risks the last commits on power loss.
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute(f"PRAGMA synchronous={config.get('DB_SYNCHRONOUS', 'NORMAL')}")
+        db.execute(f"PRAGMA cache_size=-{int(config.get('DB_CACHE_SIZE_KB', 20000))}")
+        db.execute(f"PRAGMA mmap_size={int(config.get('DB_MMAP_SIZE', 256 * 1024 * 1024))}")
+        db.execute(f'PRAGMA busy_timeout={int(busy_ms)}')
+        db.execute('PRAGMA temp_store=MEMORY')
+        db.rowid_alias = {}
+        return db
+
+    def id_is_rowid(self, db, table):
+        # Tables created from the PostgreSQL-style schema declare "id SERIAL",
+        # which SQLite does not treat as the rowid, so their id must be filled in.
+        cache = getattr(db, 'rowid_alias', {})
+        if table not in cache:
+            cols = db.execute(f'PRAGMA table_info({table})').fetchall()
+            cache[table] = any(c['name'] == 'id' and c['pk'] == 1 and c['type'].upper() == 'INTEGER' for c in cols)
+        return cache[table]
+
+    def insert(self, db, table, values):
+        """Insert one row and return its id."""
+        cols = list(values)
+        cur = db.execute(f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+                         [values[c] for c in cols])
+        rowid = cur.lastrowid
+        if not self.id_is_rowid(db, table):
+            db.execute(f'UPDATE {table} SET id = ? WHERE rowid = ?', (rowid, rowid))
+        return rowid
+
+    def insert_many(self, db, table, columns, rows):
+        """Insert many rows with executemany and return their ids in order."""
+        if not rows:
+            return []
+        # New rowids are always above the current maximum, so the batch is
+        # found again by rowid range and its ids fixed with one UPDATE. That
+        # only holds if no other connection inserts in between, so the write
+        # lock is taken before the maximum is read. (Inside a transaction that
+        # has only read so far, a concurrent commit makes the INSERT fail with
+        # SQLITE_BUSY_SNAPSHOT rather than shift the range.)
+        if not db.in_transaction:
+            self.begin_write(db)
+        last_rowid = db.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM {table}').fetchone()[0]
+        db.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows)
+        if not self.id_is_rowid(db, table):
+            db.execute(f'UPDATE {table} SET id = rowid WHERE rowid > ?', (last_rowid,))
+        return [r[0] for r in db.execute(f'SELECT rowid FROM {table} WHERE rowid > ? ORDER BY rowid', (last_rowid,))]
+
+    def fill_ids(self, db, table):
+        # For upserts, which cannot go through insert(); the primary key index keeps this cheap
+        if not self.id_is_rowid(db, table):
+            db.execute(f'UPDATE {table} SET id = rowid WHERE id IS NULL')
+
+    def begin_write(self, db):
+        # Take the write lock up front so read-then-update sequences cannot race
+        db.execute('BEGIN IMMEDIATE')
+
+    def is_transient(self, exc):
+        """True for errors worth retrying: the database was locked or busy."""
+        return isinstance(exc, sqlite3.OperationalError) and ('locked' in str(exc) or 'busy' in str(exc))
+
+    def encode_array(self, values):
+        return json.dumps(list(values)) if values is not None else None
+
+    def explain(self, db, sql, params=()):
+        return [r[3] for r in db.execute(f'EXPLAIN QUERY PLAN {sql}', params)]
+
+    def decode_array(self, value):
+        if value is None or isinstance(value, list):
+            return value
+        return json.loads(value)
+
+@lru_cache(maxsize=1024)
+def to_pyformat(sql):
+    """Rewrite '?' placeholders as '%s' (and escape '%') outside string literals."""
+    parts = re.split(r"('(?:[^']|'')*')", sql)
+    for i in range(0, len(parts), 2):
+        parts[i] = parts[i].replace('%', '%%').replace('?', '%s')
+    return ''.join(parts)
+
+class PostgresConnection:
+    """Gives a psycopg2 connection the small sqlite3-style surface the routes use."""
+    pool = None
+    db_name = None
+    observer = None
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.trace = None
+
+    def _cursor(self):
+        from psycopg2.extras import DictCursor
+        return self.raw.cursor(cursor_factory=DictCursor)
+
+    def execute(self, sql, params=()):
+        if self.observer is not None:
+            return observed(self, self._execute, sql, params)
+        return self._execute(sql, params)
+
+    def _execute(self, sql, params):
+        cur = self._cursor()
+        if self.trace:
+            self.trace(sql)
+        if params:
+            cur.execute(to_pyformat(sql), tuple(params))
+        else:
+            # Without parameters psycopg2 does no % interpolation, so send the SQL as is
+            cur.execute(sql)
+        return cur
+
+    def executemany(self, sql, seq_of_params):
+        if self.observer is not None:
+            return observed(self, self._executemany, sql, seq_of_params)
+        return self._executemany(sql, seq_of_params)
+
+    def _executemany(self, sql, seq_of_params):
+        cur = self._cursor()
+        if self.trace:
+            self.trace(sql)
+        cur.executemany(to_pyformat(sql), [tuple(p) for p in seq_of_params])
+        return cur
+
+    def executescript(self, script):
+        self.raw.cursor().execute(script)
+        self.raw.commit()
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def close(self):
+        self.raw.close()
+
+    def set_trace_callback(self, callback):
+        self.trace = callback
+
+    @property
+    def in_transaction(self):
+        from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+        return self.raw.get_transaction_status() != TRANSACTION_STATUS_IDLE
+
+class PostgresBackend:
+    name = 'postgres'
+    skip_locked = ' FOR UPDATE SKIP LOCKED'
+
+    def connect(self, db_name, config):
+        try:
+            import psycopg2
+        except ImportError:
+            raise ImportError("psycopg2 is required for PostgreSQL. Install with 'pip install psycopg2-binary'.")
+        busy_ms = int(config.get('DB_BUSY_TIMEOUT_MS', 5000))
+        raw = psycopg2.connect(db_name, options=f'-c lock_timeout={busy_ms}')
+        return PostgresConnection(raw)
+
+    def insert(self, db, table, values):
+        cols = list(values)
+        cur = db.execute(f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))}) RETURNING id",
+                         [values[c] for c in cols])
+        return cur.fetchone()[0]
+
+    def insert_many(self, db, table, columns, rows):
+        from psycopg2.extras import execute_values
+        if not rows:
+            return []
+        cur = db.raw.cursor()
+        result = execute_values(cur, f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s RETURNING id",
+                                [tuple(r) for r in rows], page_size=len(rows), fetch=True)
+        return [r[0] for r in result]
+
+    def fill_ids(self, db, table):
+        pass
+
+    def begin_write(self, db):
+        # Every statement already runs inside a transaction; row locks come from skip_locked
+        pass
+
+    def is_transient(self, exc):
+        # Serialization failure, deadlock, lock timeout, or a dropped connection
+        import psycopg2
+        return isinstance(exc, psycopg2.OperationalError) or getattr(exc, 'pgcode', None) in ('40001', '40P01', '55P03')
+
+    def encode_array(self, values):
+        return list(values) if values is not None else None
+
+    def explain(self, db, sql, params=()):
+        # Plain EXPLAIN plans without running the statement
+        return [r[0] for r in db.execute(f'EXPLAIN {sql}', params)]
+
+    def decode_array(self, value):
+        return value
+
+SQLITE = SQLiteBackend()
+POSTGRES = PostgresBackend()
+
+def backend_for(db_name):
+    """Pick the backend from the DATABASE setting: a postgres:// URL or a SQLite file path."""
+    return POSTGRES if str(db_name).startswith(POSTGRES_SCHEMES) else SQLITE
+
+def backend_of(db):
+    return POSTGRES if isinstance(db, PostgresConnection) else SQLITE
@@ -0,0 +1,38 @@
+from flask import Response, current_app, g, request, stream_with_context
+from db import release_connection
+
+# --- NDJSON streaming for large exports ---
+NDJSON_MIMETYPE = 'application/x-ndjson'
+STREAM_BATCH_SIZE = 500
+
+def wants_ndjson():
+    """True when the client opted into streaming via ?stream=1 or Accept: application/x-ndjson."""
+    if request.args.get('stream', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return request.accept_mimetypes.best == NDJSON_MIMETYPE
+
+def ndjson_response(cursor, to_dicts=None, fields=None):
+    """Stream a cursor as one JSON document per line.
+
+    Rows are pulled STREAM_BATCH_SIZE at a time, so memory stays flat no
+    matter how many rows the query returns. to_dicts receives each batch
+    of rows and returns the matching list of dicts (defaults to dict(row)).
+    """
+    # The app context is torn down before the body is sent, so take the
+    # request connection away from teardown. The server closes the response
+    # when streaming ends, fails or is abandoned (even before the first
+    # chunk), and that releases the connection.
+    db = g.pop('_database', None)
+    def generate():
+        while True:
+            rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+            if not rows:
+                break
+            items = to_dicts(rows) if to_dicts else [dict(r) for r in rows]
+            if fields is not None:
+                items = [{f: item[f] for f in fields} for item in items]
+            yield ''.join(current_app.json.dumps(item) + '\n' for item in items)
+    response = Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+    if db is not None:
+        response.call_on_close(lambda: release_connection(db))
+    return response
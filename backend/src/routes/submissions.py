@@ -0,0 +1,344 @@
+from flask import current_app
+import atexit
+import glob
+import json
+import os
+import tempfile
+import threading
+import logging
+from datetime import datetime
+from db import connect, DATABASE, PoolTimeout
+from storage import backend_of, backend_for
+from scoring import record_attempt
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# --- Write-behind buffer for exam-end submission bursts ---
+# With SUBMISSION_WRITE_BEHIND on, POST /attempt only validates the answers
+# and appends them to a local journal (fsynced) before answering 202. A
+# committer thread then records queued submissions SUBMISSION_BATCH_SIZE at a
+# time in a single transaction, instead of one transaction per request.
+# Each process writes its own journal (the pid is in the name) and holds an
+# exclusive lock on it while it runs. On start a process adopts the journals
+# whose lock it can take, i.e. those of processes that died: their records
+# are copied into its own journal, then the orphan is deleted. Replay is
+# idempotent because a student has at most one submitted attempt. A batch
+# that hits a transient error (database busy, no pooled connection) is put
+# back and retried; only a submission that cannot be recorded is dropped.
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 200
+DEFAULT_COMMIT_INTERVAL = 0.05
+
+class DuplicateSubmission(Exception):
+    pass
+
+def journal_base(db_name, config):
+    if config.get('SUBMISSION_JOURNAL'):
+        return config['SUBMISSION_JOURNAL']
+    if backend_for(db_name).name == 'sqlite':
+        return f'{db_name}-submissions.journal'
+    return os.path.join(tempfile.gettempdir(), 'begining-submissions.journal')
+
+def journal_path(db_name, config, pid=None):
+    """This process's journal: the base name with the pid before the extension."""
+    root, ext = os.path.splitext(journal_base(db_name, config))
+    return f'{root}.{pid or os.getpid()}{ext}'
+
+def journal_paths(db_name, config):
+    """Every journal for db_name, including the single shared one older versions wrote."""
+    base = journal_base(db_name, config)
+    root, ext = os.path.splitext(base)
+    found = glob.glob(f'{glob.escape(root)}.*{glob.escape(ext)}')
+    return ([base] if os.path.exists(base) else []) + sorted(found)
+
+def lock_file(f):
+    """Take an exclusive lock on an open journal without waiting; False if another process holds it."""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+def owner_alive(path):
+    """Fallback without flock: is the pid in the journal name a running process?"""
+    pid = path.rsplit('.', 2)[-2] if path.count('.') >= 2 else ''
+    if not pid.isdigit():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+def read_records(f):
+    records = []
+    for line in f:
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            break
+    return records
+
+class SubmissionJournal:
+    """Append-only JSON-lines file; a record is durable once append() returns.
+
+    Appends that arrive while another thread is in fsync share the next
+    one, so a burst costs far fewer fsyncs than submissions. The file is
+    truncated whenever every record in it has been committed to the database.
+    """
+
+    def __init__(self, path, fsync=True):
+        self.path = path
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+        if not lock_file(self._file):
+            self._file.close()
+            raise RuntimeError(f'Submission journal {path} is in use by another process')
+        self._written = 0
+        self._synced = 0
+        self._outstanding = 0
+        self.syncs = 0
+
+    def read(self):
+        """Records left from a previous run of this pid; a torn last line is ignored."""
+        with open(self.path, encoding='utf-8') as f:
+            records = read_records(f)
+        with self._lock:
+            self._outstanding += len(records)
+        return records
+
+    def adopt(self, path):
+        """Move the records of a dead process's journal into this one; returns them.
+
+        Nothing is taken while the owner still holds its lock. The orphan is
+        deleted only after its records are durable here.
+        """
+        try:
+            f = open(path, 'r+', encoding='utf-8')
+        except FileNotFoundError:
+            return []
+        with f:
+            if not lock_file(f) or (fcntl is None and owner_alive(path)):
+                return []
+            # Another process may have adopted and deleted it while we waited
+            if os.fstat(f.fileno()).st_nlink == 0:
+                return []
+            records = read_records(f)
+            for record in records:
+                self.append(record)
+            os.remove(path)
+        return records
+
+    def append(self, record):
+        line = json.dumps(record, default=str) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self._written += 1
+            self._outstanding += 1
+            mine = self._written
+        if not self.fsync:
+            return
+        with self._sync_lock:
+            if self._synced >= mine:
+                return
+            with self._lock:
+                target = self._written
+            os.fsync(self._file.fileno())
+            self._synced = target
+            self.syncs += 1
+
+    def committed(self, count):
+        with self._lock:
+            self._outstanding -= count
+            if self._outstanding == 0:
+                self._file.truncate(0)
+                self._file.seek(0)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+class SubmissionBuffer:
+    """Queue of journaled submissions, committed in batches by one thread per process."""
+
+    def __init__(self):
+        self._queue = []
+        self._cond = threading.Condition()
+        self._inflight = set()  # (db_name, test_id, user_id)
+        self._journals = {}
+        self._thread = None
+        self._app = None
+        self._pid = os.getpid()
+        self._stopping = False
+        self.received = 0
+        self.committed = 0
+        self.batches = 0
+
+    def journal(self, db_name):
+        with self._cond:
+            journal = self._journals.get(db_name)
+            if journal is None:
+                config = self._app.config
+                journal = self._journals[db_name] = SubmissionJournal(journal_path(db_name, config),
+                                                                      config.get('SUBMISSION_FSYNC', True))
+                # Anything already in our file, or in a dead process's, did not
+                # make it to the database before a crash
+                records = journal.read()
+                for path in journal_paths(db_name, config):
+                    if path != journal.path:
+                        records += journal.adopt(path)
+                for record in records:
+                    self._inflight.add((db_name, record['test_id'], record['user_id']))
+                    self._queue.append(record)
+                if records:
+                    logger.warning('Replaying %d journaled submissions for %s', len(records), db_name)
+                    self._cond.notify()
+            return journal
+
+    def start(self, app=None):
+        """Start the committer (and replay the journal) if it is not running yet."""
+        app = app or current_app._get_current_object()
+        with self._cond:
+            if self._pid != os.getpid():
+                # Forked from a process that had started: its thread and journals are not ours
+                self._thread, self._journals, self._queue, self._inflight = None, {}, [], set()
+                self._pid = os.getpid()
+            if self._thread is not None:
+                return self
+            self._app = app
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='submission-committer', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+        self.journal(app.config.get('DATABASE', DATABASE))
+        return self
+
+    def is_pending(self, test_id, user_id):
+        with self._cond:
+            return (current_app.config.get('DATABASE', DATABASE), test_id, user_id) in self._inflight
+
+    def submit(self, test_id, user_id, answers, raw_answers):
+        """Journal a submission and queue it; raises DuplicateSubmission if one is already queued."""
+        self.start()
+        db_name = current_app.config.get('DATABASE', DATABASE)
+        key = (db_name, test_id, user_id)
+        with self._cond:
+            if key in self._inflight:
+                raise DuplicateSubmission()
+            self._inflight.add(key)
+        record = {'db': db_name, 'test_id': test_id, 'user_id': user_id, 'answers': answers,
+                  'raw': raw_answers, 'received_at': datetime.utcnow().isoformat()}
+        try:
+            self.journal(db_name).append(record)
+        except Exception:
+            with self._cond:
+                self._inflight.discard(key)
+            raise
+        with self._cond:
+            self._queue.append(record)
+            self.received += 1
+            if len(self._queue) >= self._app.config.get('SUBMISSION_BATCH_SIZE', DEFAULT_BATCH_SIZE):
+                self._cond.notify()
+
+    def drain(self):
+        """Commit everything queued now, on the calling thread."""
+        while self._commit_next():
+            pass
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+            # Release the journals; whatever was not committed stays in them for the next start
+            with self._cond:
+                for journal in self._journals.values():
+                    journal.close()
+                self._journals, self._queue, self._inflight = {}, [], set()
+
+    def _run(self):
+        interval = self._app.config.get('SUBMISSION_COMMIT_INTERVAL', DEFAULT_COMMIT_INTERVAL)
+        while True:
+            with self._cond:
+                if not self._queue and not self._stopping:
+                    self._cond.wait(interval)
+                stopping = self._stopping
+            try:
+                self.drain()
+            except Exception:
+                logger.exception('Submission commit failed; will retry')
+                if not stopping:
+                    with self._cond:
+                        self._cond.wait(interval)
+                    continue
+            if stopping:
+                with self._cond:
+                    self._thread = None
+                return
+
+    def _commit_next(self):
+        with self._app.app_context():
+            batch_size = self._app.config.get('SUBMISSION_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+            with self._cond:
+                if not self._queue:
+                    return False
+                db_name = self._queue[0]['db']
+                batch = [r for r in self._queue if r['db'] == db_name][:batch_size]
+                for record in batch:
+                    self._queue.remove(record)
+            try:
+                commit_batch(db_name, self._app.config, batch)
+            except Exception:
+                with self._cond:
+                    self._queue[:0] = batch
+                raise
+            with self._cond:
+                for record in batch:
+                    self._inflight.discard((db_name, record['test_id'], record['user_id']))
+                self.committed += len(batch)
+                self.batches += 1
+            self._journals[db_name].committed(len(batch))
+            return True
+
+def commit_batch(db_name, config, batch):
+    """Record a batch of submissions in one transaction; a bad one is logged and dropped.
+
+    A transient error aborts the whole batch, which the caller puts back.
+    """
+    db = connect(db_name, config)
+    backend = backend_of(db)
+    try:
+        backend.begin_write(db)
+        for record in batch:
+            db.execute('SAVEPOINT submission')
+            try:
+                done = db.execute('SELECT id FROM test_attempts WHERE test_id = ? AND user_id = ? AND submitted_at IS NOT NULL',
+                                  (record['test_id'], record['user_id'])).fetchone()
+                if not done:
+                    answers = [(qid, selected, text) for qid, selected, text in record['answers']]
+                    record_attempt(db, record['test_id'], record['user_id'], answers,
+                                   extra={'answers': json.dumps(record['raw'])})
+            except Exception as e:
+                if isinstance(e, PoolTimeout) or backend.is_transient(e):
+                    raise
+                db.execute('ROLLBACK TO submission')
+                logger.exception('Dropping submission of user %s for test %s', record['user_id'], record['test_id'])
+            db.execute('RELEASE submission')
+        db.commit()
+    finally:
+        db.close()
+
+submission_buffer = SubmissionBuffer()
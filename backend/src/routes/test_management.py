@@ -1,43 +1,37 @@
 from flask import Blueprint, request, jsonify, g, current_app
-from functools import wraps
-import sqlite3
 from datetime import datetime
+import json
+from db import get_db, insert
+from auth import login_required, role_required
+from request_logging import hot_path
+from storage import backend_of
+from pagination import Page, PaginationError
+from streaming import wants_ndjson, ndjson_response
+from jobs import job_handler, enqueue_job, job_accepted, wants_async
+from analytics import read_test_stats, clear_test_stats, read_student_analytics, rebuild_student_analytics
+from scoring import (answer_keys, normalize_answers, record_attempt, rescore_test, AnswerError,
+                     find_open_attempt, open_attempt, finalize_attempt)
+from autosave import autosave_buffer
+from submissions import submission_buffer, DuplicateSubmission
+from papers import test_papers, mark_changed, paper_response, paper_variant, strip_answers
+from shuffle import ShuffleMode, student_seed
+from question_pools import question_pools, parse_blueprint, BlueprintError
+from assignments import assign_test_to, parse_ids, AssignmentError, UnknownGroups
+import random
+
+TEST_FIELDS = ['id', 'name', 'subject_id', 'pattern', 'duration_minutes', 'start_time', 'end_time', 'attempt_limit', 'created_by', 'is_published', 'created_at']
 
 # --- Blueprint ---
 test_management = Blueprint('test_management', __name__)
 
-# --- DB Helper ---
-def get_db():
-    db = getattr(g, '_database', None)
-    if db is None:
-        db_name = current_app.config.get('DATABASE', 'user_management.db')
-        db = g._database = sqlite3.connect(db_name, detect_types=sqlite3.PARSE_DECLTYPES)
-        db.row_factory = sqlite3.Row
-    return db
-
-# --- Auth Decorators (reuse from user_management) ---
-def login_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        auth = request.headers.get('Authorization', None)
-        if not auth or not auth.startswith('Bearer '):
-            return jsonify({'message': 'Unauthorized'}), 401
-        token = auth.split(' ')[1]
-        from user_management import decode_jwt
-        payload = decode_jwt(token)
-        if not payload:
-            return jsonify({'message': 'Unauthorized'}), 401
-        g.user = payload
-        return f(*args, **kwargs)
-    return decorated
-
-def admin_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        if not hasattr(g, 'user') or g.user.get('role') not in ['admin', 'teacher']:
-            return jsonify({'message': 'Unauthorized'}), 401
-        return f(*args, **kwargs)
-    return decorated
+# --- Auth Decorators ---
+admin_required = role_required('admin', 'teacher')
+
+def paper_seed(test_id):
+    """Shuffle seed of the current user's paper; staff always see the canonical order."""
+    if paper_variant(g.user.get('role')) == 'full':
+        return None
+    return student_seed(current_app.config['SECRET_KEY'], test_id, g.user['user_id'])
 
 # --- API Endpoints ---
 # 1. Create Test
@@ -47,64 +41,123 @@ def admin_required(f):
 def create_test():
     data = request.get_json()
     db = get_db()
+    test_id = insert_test(db, data, data.get('question_ids', []))
+    db.commit()
+    test_papers.invalidate([test_id])
+    return jsonify({'id': test_id, 'message': 'Test created successfully'}), 201
+
+def insert_test(db, data, question_ids):
+    """Insert a test and its questions (in the given order); the caller commits."""
     now = datetime.utcnow()
-    cur = db.execute(
-        'INSERT INTO tests (name, subject_id, pattern, duration_minutes, start_time, end_time, attempt_limit, is_published, created_by, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
-        (
-            data.get('name'),
-            data.get('subject_id'),
-            data.get('pattern'),
-            data.get('duration_minutes'),
-            data.get('start_time'),
-            data.get('end_time'),
-            data.get('attempt_limit'),
-            data.get('is_published', False),
-            g.user['user_id'],
-            now
-        )
-    )
-    test_id = cur.lastrowid
-    db.execute('UPDATE tests SET id = ? WHERE rowid = ?', (test_id, test_id))
+    test_id = insert(db, 'tests', {
+        'name': data.get('name'),
+        'subject_id': data.get('subject_id'),
+        'pattern': data.get('pattern'),
+        'duration_minutes': data.get('duration_minutes'),
+        'start_time': data.get('start_time'),
+        'end_time': data.get('end_time'),
+        'attempt_limit': data.get('attempt_limit'),
+        'is_published': data.get('is_published', False),
+        'created_by': g.user['user_id'],
+        'created_at': now,
+    })
     # Insert test_questions
-    for qid in data.get('question_ids', []):
-        cur_q = db.execute('INSERT INTO test_questions (test_id, question_id) VALUES (?, ?)', (test_id, qid))
-        tq_id = cur_q.lastrowid
-        #db.execute('UPDATE test_questions SET id = ? WHERE rowid = ?', (tq_id, tq_id))
+    db.executemany('INSERT INTO test_questions (test_id, question_id, question_order) VALUES (?, ?, ?)',
+                   [(test_id, qid, i) for i, qid in enumerate(question_ids)])
+    return test_id
+
+# 1a. Generate Test from a blueprint
+@test_management.route('/api/v1/tests/generate', methods=['POST'])
+@login_required
+@admin_required
+def generate_test():
+    """Sample questions per blueprint rule; with per_student, every user in user_ids gets a paper of their own.
+
+    Papers generated together avoid sharing questions as far as the bank allows.
+    preview returns the sampled question_ids without creating anything.
+    """
+    data = request.get_json() or {}
+    try:
+        rules = parse_blueprint(data.get('blueprint'))
+    except BlueprintError as e:
+        return jsonify({'message': str(e)}), 400
+    user_ids = data.get('user_ids') or []
+    per_student = bool(data.get('per_student'))
+    if per_student and not user_ids:
+        return jsonify({'message': 'per_student needs user_ids'}), 400
+    db = get_db()
+    index = question_pools.get(db)
+    rng = random.Random(data['seed']) if data.get('seed') is not None else random.Random()
+    draw = index.draw(rng)
+    papers = []
+    try:
+        for user_id in (user_ids if per_student else [None]):
+            papers.append((user_id, draw.paper(rules)))
+    except BlueprintError as e:
+        return jsonify({'message': str(e)}), 400
+    if data.get('preview'):
+        if per_student:
+            return jsonify({'papers': [{'user_id': u, 'question_ids': q} for u, q in papers]}), 200
+        return jsonify({'question_ids': papers[0][1]}), 200
+    tests = []
+    for user_id, question_ids in papers:
+        test_id = insert_test(db, data, question_ids)
+        assignees = [user_id] if per_student else user_ids
+        if assignees:
+            assign_users(db, test_id, dict(data, user_ids=assignees))
+        tests.append({'id': test_id, 'user_id': user_id, 'question_ids': question_ids})
     db.commit()
-    return jsonify({'id': test_id, 'message': 'Test created successfully'}), 201
+    test_papers.invalidate([t['id'] for t in tests])
+    if per_student:
+        return jsonify({'tests': tests, 'message': 'Tests generated successfully'}), 201
+    return jsonify({'id': tests[0]['id'], 'question_ids': tests[0]['question_ids'],
+                    'message': 'Test generated successfully'}), 201
 
 # 2. Get All Tests
 @test_management.route('/api/v1/tests', methods=['GET'])
 @login_required
 def get_tests():
+    try:
+        page = Page(request.args, TEST_FIELDS)
+    except PaginationError as e:
+        return jsonify({'message': str(e)}), 400
     db = get_db()
     role = g.user.get('role')
     user_id = g.user.get('user_id')
     if role in ['admin', 'teacher']:
-        tests = db.execute('SELECT * FROM tests').fetchall()
+        keyset, keyset_params = page.sql()
+        tests = db.execute('SELECT * FROM tests WHERE 1=1' + keyset, keyset_params).fetchall()
     else:
         # For students, only assigned/available tests
+        keyset, keyset_params = page.sql('t.id')
         tests = db.execute('''SELECT t.* FROM tests t
             JOIN test_assignments ta ON t.id = ta.test_id
-            WHERE ta.user_id = ?''', (user_id,)).fetchall()
-    result = [dict(row) for row in tests]
-    return jsonify(result), 200
+            WHERE ta.user_id = ?''' + keyset, [user_id] + keyset_params).fetchall()
+    return page.response(tests, lambda rows: [dict(row) for row in rows])
 
 # 3. Get Test Details
 @test_management.route('/api/v1/tests/<int:test_id>', methods=['GET'])
+@hot_path
 @login_required
 def get_test(test_id):
     db = get_db()
-    test = db.execute('SELECT * FROM tests WHERE id = ?', (test_id,)).fetchone()
-    if not test:
+
+    def build():
+        test = db.execute('SELECT * FROM tests WHERE id = ?', (test_id,)).fetchone()
+        if not test:
+            return None
+        # Get questions
+        questions = db.execute('''SELECT q.* FROM questions q
+            JOIN test_questions tq ON q.id = tq.question_id
+            WHERE tq.test_id = ? ORDER BY tq.question_order, q.id''', (test_id,)).fetchall()
+        test_dict = dict(test)
+        test_dict['questions'] = [dict(q) for q in questions]
+        return test_dict, ShuffleMode.from_pattern(test['pattern'])
+
+    paper = test_papers.get(db, test_id, 'test', paper_variant(g.user.get('role')), build)
+    if paper is None:
         return jsonify({'message': 'Test not found'}), 404
-    # Get questions
-    questions = db.execute('''SELECT q.* FROM questions q
-        JOIN test_questions tq ON q.id = tq.question_id
-        WHERE tq.test_id = ?''', (test_id,)).fetchall()
-    test_dict = dict(test)
-    test_dict['questions'] = [dict(q) for q in questions]
-    return jsonify(test_dict), 200
+    return paper_response(paper, paper_seed(test_id))
 
 # 4. Update Test
 @test_management.route('/api/v1/tests/<int:test_id>', methods=['PUT'])
@@ -128,11 +181,13 @@ def update_test(test_id):
     # Update questions if provided
     if 'question_ids' in data:
         db.execute('DELETE FROM test_questions WHERE test_id = ?', (test_id,))
-        for qid in data['question_ids']:
-            cur_q = db.execute('INSERT INTO test_questions (test_id, question_id) VALUES (?, ?)', (test_id, qid))
-            tq_id = cur_q.lastrowid
-            #db.execute('UPDATE test_questions SET id = ? WHERE rowid = ?', (tq_id, tq_id))
+        db.executemany('INSERT INTO test_questions (test_id, question_id, question_order) VALUES (?, ?, ?)',
+                       [(test_id, qid, i) for i, qid in enumerate(data['question_ids'])])
+    mark_changed(db, [test_id])
     db.commit()
+    test_papers.invalidate([test_id])
+    if 'question_ids' in data or 'pattern' in data:
+        answer_keys.invalidate([test_id])
     return jsonify({'message': 'Test updated successfully'}), 200
 
 # 5. Delete Test
@@ -146,8 +201,10 @@ def delete_test(test_id):
         return jsonify({'message': 'Test not found'}), 404
     db.execute('DELETE FROM test_questions WHERE test_id = ?', (test_id,))
     db.execute('DELETE FROM test_assignments WHERE test_id = ?', (test_id,))
+    clear_test_stats(db, test_id)
     db.execute('DELETE FROM tests WHERE id = ?', (test_id,))
     db.commit()
+    test_papers.invalidate([test_id])
     return '', 204
 
 # 6. Assign Test
@@ -160,64 +217,194 @@ def assign_test(test_id):
     test = db.execute('SELECT * FROM tests WHERE id = ?', (test_id,)).fetchone()
     if not test:
         return jsonify({'message': 'Test not found'}), 404
-    # Assign to users
-    for uid in data.get('user_ids', []): 
-        cur_a = db.execute('INSERT INTO test_assignments (test_id, user_id, start_time, end_time, attempt_limit) VALUES (?, ?, ?, ?, ?)',
-                   (test_id, uid, data.get('start_time'), data.get('end_time'), data.get('attempt_limit')))
-        assign_id = cur_a.lastrowid
-        db.execute('UPDATE test_assignments SET id = ? WHERE rowid = ?', (assign_id, assign_id))
-    # Assign to groups (not implemented, placeholder)
-    # for gid in data.get('group_ids', []): ...
+    try:
+        user_ids = parse_ids(data.get('user_ids'), 'user_ids')
+        group_ids = parse_ids(data.get('group_ids'), 'group_ids')
+    except AssignmentError as e:
+        return jsonify({'message': str(e)}), 400
+    if wants_async():
+        job_id = enqueue_job(db, 'assign_test', {'test_id': test_id, 'data': data}, g.user['user_id'])
+        return job_accepted(job_id)
+    try:
+        assigned, targeted = assign_users(db, test_id, dict(data, user_ids=user_ids, group_ids=group_ids))
+    except UnknownGroups as e:
+        return jsonify({'message': str(e)}), 404
+    db.commit()
+    return jsonify({'message': 'Test assigned successfully', 'assigned_count': assigned,
+                    'already_assigned': targeted - assigned}), 200
+
+def assign_users(db, test_id, data):
+    """(newly assigned, targeted) for data's user_ids and group_ids; existing assignments are kept."""
+    return assign_test_to(db, test_id, data.get('user_ids') or [], data.get('group_ids') or [],
+                          start_time=data.get('start_time'), end_time=data.get('end_time'),
+                          attempt_limit=data.get('attempt_limit'))
+
+# Re-running is safe: students assigned by an earlier attempt are skipped
+@job_handler('assign_test')
+def run_assign_job(db, job):
+    assigned, targeted = assign_users(db, job.payload['test_id'], job.payload['data'])
     db.commit()
-    return jsonify({'message': 'Test assigned successfully'}), 200
+    return {'assigned_count': assigned, 'already_assigned': targeted - assigned}
 
 # 7. Get Questions for Test
 @test_management.route('/api/v1/tests/<int:test_id>/questions', methods=['GET'])
+@hot_path
 @login_required
 def get_test_questions(test_id):
-    from question_bank import get_options_for_question
-    db = get_db()
-    questions = db.execute('''SELECT q.* FROM questions q
-        JOIN test_questions tq ON q.id = tq.question_id
-        WHERE tq.test_id = ?''', (test_id,)).fetchall()
-    result = []
-    for q in questions:
-        qd = dict(q)
-        qd['options'] = get_options_for_question(db, q['id'])
-        result.append(qd)
-    return jsonify(result), 200
+    from question_bank import attach_options
+    db = get_db()
+    variant = paper_variant(g.user.get('role'))
+
+    def build():
+        test = db.execute('SELECT pattern FROM tests WHERE id = ?', (test_id,)).fetchone()
+        questions = db.execute('''SELECT q.* FROM questions q
+            JOIN test_questions tq ON q.id = tq.question_id
+            WHERE tq.test_id = ? ORDER BY tq.question_order, q.id''', (test_id,)).fetchall()
+        result = attach_options(db, [dict(q) for q in questions])
+        shuffle = ShuffleMode.from_pattern(test['pattern'] if test else None)
+        return (result if variant == 'full' else strip_answers(result)), shuffle
+
+    return paper_response(test_papers.get(db, test_id, 'questions', variant, build), paper_seed(test_id))
 
 # 8. Start/Submit Test Attempt
 @test_management.route('/api/v1/tests/<int:test_id>/attempt', methods=['POST'])
+@hot_path
 @login_required
 def attempt_test(test_id):
     data = request.get_json() or {}
     db = get_db()
     user_id = g.user['user_id']
     # Check if already attempted (enforce attempt_limit elsewhere)
-    attempt = db.execute('SELECT * FROM test_attempts WHERE test_id = ? AND user_id = ?', (test_id, user_id)).fetchone()
-    if attempt:
+    if submitted_attempt(db, test_id, user_id):
         return jsonify({'message': 'Already attempted'}), 400
-    now = datetime.utcnow()
     answers = data.get('answers', [])
-    cur = db.execute('INSERT INTO test_attempts (test_id, user_id, started_at, submitted_at, answers) VALUES (?, ?, ?, ?, ?)',
-                     (test_id, user_id, now, now, str(answers)))
-    attempt_id = cur.lastrowid
-    db.execute('UPDATE test_attempts SET id = ? WHERE rowid = ?', (attempt_id, attempt_id))
-    # Scoring logic placeholder
+    try:
+        normalized = normalize_answers(answers)
+    except AnswerError as e:
+        return jsonify({'message': str(e)}), 400
+    attempt = find_open_attempt(db, test_id, user_id)
+    if attempt:
+        autosave_buffer.flush_attempt(db, attempt['id'])
+    if current_app.config.get('SUBMISSION_WRITE_BEHIND'):
+        # Acknowledge once journaled; the committer records it with the next batch
+        db.commit()
+        try:
+            submission_buffer.submit(test_id, user_id, normalized, answers)
+        except DuplicateSubmission:
+            return jsonify({'message': 'Already attempted'}), 400
+        return jsonify({'message': 'Attempt received', 'status': 'queued'}), 202
+    result = record_attempt(db, test_id, user_id, normalized, extra={'answers': json.dumps(answers)})
+    if result is None:
+        return jsonify({'message': 'Already attempted'}), 400
+    db.commit()
+    attempt_id, score, is_graded, max_score = result
+    return jsonify({'attempt_id': attempt_id, 'score': score, 'max_score': max_score, 'is_graded': is_graded,
+                    'message': 'Attempt submitted successfully'}), 200
+
+def submitted_attempt(db, test_id, user_id):
+    return db.execute('SELECT id FROM test_attempts WHERE test_id = ? AND user_id = ? AND submitted_at IS NOT NULL',
+                      (test_id, user_id)).fetchone()
+
+# 8a. Start (or resume) a Test Attempt
+@test_management.route('/api/v1/tests/<int:test_id>/start', methods=['POST'])
+@hot_path
+@login_required
+def start_test(test_id):
+    body, status = start_attempt(get_db(), test_id, g.user['user_id'])
+    return jsonify(body), status
+
+# The test-taking views are split into (body, status) functions of the
+# connection and the user, so the ASGI mode (asgi.py) serves the same logic.
+def start_attempt(db, test_id, user_id):
+    test = db.execute('SELECT id FROM tests WHERE id = ?', (test_id,)).fetchone()
+    if not test:
+        return {'message': 'Test not found'}, 404
+    if submitted_attempt(db, test_id, user_id):
+        return {'message': 'Already attempted'}, 400
+    attempt, created = open_attempt(db, test_id, user_id)
+    db.commit()
+    return {'attempt_id': attempt['id'], 'test_id': test_id, 'started_at': attempt['started_at']}, 201 if created else 200
+
+# 8b. Autosave one Answer
+@test_management.route('/api/v1/tests/<int:test_id>/answer', methods=['POST'])
+@hot_path
+@login_required
+def save_answer(test_id):
+    body, status = autosave_answer(get_db(), test_id, g.user['user_id'], request.get_json(silent=True))
+    return jsonify(body), status
+
+def autosave_answer(db, test_id, user_id, data):
+    if not isinstance(data, dict):
+        return {'message': 'Invalid input'}, 400
+    try:
+        [(question_id, selected, text)] = normalize_answers([data])
+        revision = int(data.get('revision', 0))
+    except (AnswerError, TypeError, ValueError) as e:
+        return {'message': str(e) if isinstance(e, AnswerError) else 'revision must be an integer'}, 400
+    question = answer_keys.get(db, test_id).questions.get(question_id)
+    if question is None:
+        return {'message': 'Question is not part of this test'}, 400
+    if selected and not set(selected) <= question.option_ids:
+        return {'message': 'Invalid option for this question'}, 400
+    attempt = find_open_attempt(db, test_id, user_id)
+    if not attempt:
+        if submitted_attempt(db, test_id, user_id):
+            return {'message': 'Attempt already submitted'}, 409
+        attempt, _ = open_attempt(db, test_id, user_id)
+        db.commit()
+    saved = autosave_buffer.save(db, (attempt['id'], question_id, selected, text, bool(data.get('flagged')), revision,
+                                      datetime.utcnow()))
+    return {'message': 'Answer saved successfully' if saved else 'Answer accepted and will be saved shortly',
+            'attempt_id': attempt['id'], 'question_id': question_id, 'revision': revision}, 200 if saved else 202
+
+# 8c. Submit the autosaved Attempt
+@test_management.route('/api/v1/tests/<int:test_id>/submit', methods=['POST'])
+@hot_path
+@login_required
+def submit_test(test_id):
+    body, status = submit_attempt(get_db(), test_id, g.user['user_id'])
+    return jsonify(body), status
+
+def submit_attempt(db, test_id, user_id):
+    attempt = find_open_attempt(db, test_id, user_id)
+    if not attempt:
+        return {'message': 'No attempt in progress'}, 400
+    autosave_buffer.flush_attempt(db, attempt['id'])
+    result = finalize_attempt(db, test_id, attempt)
+    if result is None:
+        return {'message': 'Already attempted'}, 400
     db.commit()
-    return jsonify({'attempt_id': attempt_id, 'message': 'Attempt submitted successfully'}), 200
+    attempt_id, score, is_graded, max_score = result
+    submitted_at = db.execute('SELECT submitted_at FROM test_attempts WHERE id = ?', (attempt_id,)).fetchone()['submitted_at']
+    return {'message': 'Test submitted successfully', 'attempt_id': attempt_id, 'submitted_at': submitted_at,
+            'score': score, 'max_score': max_score, 'is_graded': is_graded}, 200
 
 # 9. Get Student's Attempt for Test
 @test_management.route('/api/v1/tests/<int:test_id>/attempt', methods=['GET'])
+@hot_path
 @login_required
 def get_test_attempt(test_id):
     db = get_db()
     user_id = g.user['user_id']
-    attempt = db.execute('SELECT * FROM test_attempts WHERE test_id = ? AND user_id = ?', (test_id, user_id)).fetchone()
+    if submission_buffer.is_pending(test_id, user_id):
+        return jsonify({'message': 'Submission is being processed', 'status': 'processing'}), 202
+    attempt = db.execute('SELECT * FROM test_attempts WHERE test_id = ? AND user_id = ? ORDER BY id DESC LIMIT 1',
+                         (test_id, user_id)).fetchone()
     if not attempt:
         return jsonify({'message': 'No attempt found'}), 404
-    return jsonify(dict(attempt)), 200
+    if attempt['submitted_at'] is None:
+        # Resuming: include saves still waiting in the autosave buffer
+        autosave_buffer.flush_attempt(db, attempt['id'])
+        db.commit()
+    result = dict(attempt)
+    decode = backend_of(db).decode_array
+    result['answers'] = [{'question_id': a['question_id'], 'selected_option_ids': decode(a['selected_option_ids']),
+                          'answer_text': a['answer_text'], 'flagged': bool(a['flagged']), 'is_correct': a['is_correct']}
+                         for a in db.execute('SELECT * FROM attempt_answers WHERE attempt_id = ? ORDER BY id', (attempt['id'],))]
+    # In the order the student saw the questions
+    positions = answer_keys.get(db, test_id).positions(paper_seed(test_id))
+    result['answers'].sort(key=lambda a: positions.get(a['question_id'], len(positions)))
+    return jsonify(result), 200
 
 # 10. Get Test Results
 @test_management.route('/api/v1/tests/<int:test_id>/results', methods=['GET'])
@@ -227,10 +414,69 @@ def get_test_results(test_id):
     role = g.user.get('role')
     user_id = g.user.get('user_id')
     if role in ['admin', 'teacher']:
-        results = db.execute('SELECT * FROM test_attempts WHERE test_id = ?', (test_id,)).fetchall()
+        cursor = db.execute('SELECT * FROM test_attempts WHERE test_id = ?', (test_id,))
     else:
-        results = db.execute('SELECT * FROM test_attempts WHERE test_id = ? AND user_id = ?', (test_id, user_id)).fetchall()
-    return jsonify([dict(r) for r in results]), 200
+        cursor = db.execute('SELECT * FROM test_attempts WHERE test_id = ? AND user_id = ?', (test_id, user_id))
+    if wants_ndjson():
+        return ndjson_response(cursor)
+    return jsonify([dict(r) for r in cursor.fetchall()]), 200
+
+# 10a. Re-score attempts after an answer key change
+@test_management.route('/api/v1/tests/<int:test_id>/score', methods=['POST'])
+@login_required
+@admin_required
+def score_test(test_id):
+    data = request.get_json(silent=True) or {}
+    db = get_db()
+    test = db.execute('SELECT id FROM tests WHERE id = ?', (test_id,)).fetchone()
+    if not test:
+        return jsonify({'message': 'Test not found'}), 404
+    attempt_id = data.get('attempt_id')
+    if attempt_id is not None:
+        attempt = db.execute('SELECT id FROM test_attempts WHERE id = ? AND test_id = ?', (attempt_id, test_id)).fetchone()
+        if not attempt:
+            return jsonify({'message': 'Attempt not found'}), 404
+    elif wants_async():
+        job_id = enqueue_job(db, 'rescore_test', {'test_id': test_id}, g.user['user_id'])
+        return job_accepted(job_id)
+    count = rescore_test(db, test_id, attempt_id)
+    db.commit()
+    return jsonify({'test_id': test_id, 'rescored_count': count}), 200
+
+@job_handler('rescore_test')
+def run_rescore_job(db, job):
+    count = rescore_test(db, job.payload['test_id'], progress=job.progress)
+    db.commit()
+    return {'rescored_count': count}
+
+# 10b. Export Test Results in the background
+@test_management.route('/api/v1/tests/<int:test_id>/results/export', methods=['POST'])
+@login_required
+@admin_required
+def export_test_results(test_id):
+    db = get_db()
+    test = db.execute('SELECT id FROM tests WHERE id = ?', (test_id,)).fetchone()
+    if not test:
+        return jsonify({'message': 'Test not found'}), 404
+    job_id = enqueue_job(db, 'export_results', {'test_id': test_id}, g.user['user_id'])
+    return job_accepted(job_id)
+
+@job_handler('export_results')
+def run_export_job(db, job):
+    path = job.output_path('.ndjson')
+    test_id = job.payload['test_id']
+    total = db.execute('SELECT COUNT(*) FROM test_attempts WHERE test_id = ?', (test_id,)).fetchone()[0]
+    cursor = db.execute('SELECT * FROM test_attempts WHERE test_id = ?', (test_id,))
+    rows = 0
+    with open(path, 'w', encoding='utf-8') as out:
+        while True:
+            batch = cursor.fetchmany(1000)
+            if not batch:
+                break
+            out.writelines(current_app.json.dumps(dict(r)) + '\n' for r in batch)
+            rows += len(batch)
+            job.progress(rows, total)
+    return {'file': path, 'mimetype': 'application/x-ndjson', 'rows': rows}
 
 # 11. Get Test Analytics
 @test_management.route('/api/v1/tests/<int:test_id>/analytics', methods=['GET'])
@@ -238,15 +484,35 @@ def get_test_results(test_id):
 @admin_required
 def get_test_analytics(test_id):
     db = get_db()
-    # Basic analytics: avg, min, max, total attempts
-    stats = db.execute('SELECT AVG(score) as avg_score, MAX(score) as max_score, MIN(score) as min_score, COUNT(*) as total_attempts FROM test_attempts WHERE test_id = ?', (test_id,)).fetchone()
-    # Per-question stats placeholder
-    return jsonify({
-        'test_id': test_id,
-        'average_score': stats['avg_score'],
-        'highest_score': stats['max_score'],
-        'lowest_score': stats['min_score'],
-        'total_attempts': stats['total_attempts'],
-        'question_stats': [],
-        'topic_stats': []
-    }), 200
+    return jsonify(read_test_stats(db, test_id)), 200
+
+# 12. Get Analytics for a Student's Attempt
+@test_management.route('/api/v1/tests/<int:test_id>/analytics/student', methods=['GET'])
+@login_required
+def get_student_analytics(test_id):
+    db = get_db()
+    user_id = g.user['user_id']
+    # Teachers and admins may look at any student's attempt
+    if g.user.get('role') in ['admin', 'teacher'] and request.args.get('user_id'):
+        user_id = request.args.get('user_id', type=int)
+    attempt = db.execute('SELECT * FROM test_attempts WHERE test_id = ? AND user_id = ? AND submitted_at IS NOT NULL ORDER BY id DESC LIMIT 1',
+                         (test_id, user_id)).fetchone()
+    if not attempt:
+        return jsonify({'message': 'No attempt found'}), 404
+    key = answer_keys.get(db, test_id)
+    return jsonify(read_student_analytics(db, key, attempt, key.max_score)), 200
+
+# 13. Rebuild Student Analytics from stored attempts (backfill)
+@test_management.route('/api/v1/analytics/rebuild', methods=['POST'])
+@login_required
+@admin_required
+def rebuild_analytics():
+    db = get_db()
+    job_id = enqueue_job(db, 'rebuild_analytics', {}, g.user['user_id'])
+    return job_accepted(job_id)
+
+@job_handler('rebuild_analytics')
+def run_rebuild_analytics_job(db, job):
+    count = rebuild_student_analytics(db, lambda t: answer_keys.get(db, t), progress=job.progress)
+    db.commit()
+    return {'attempts_replayed': count}
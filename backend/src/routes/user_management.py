@@ -1,24 +1,28 @@
 from flask import Flask, request, jsonify, g, current_app
-from werkzeug.security import generate_password_hash, check_password_hash
-import sqlite3
+import click
 import datetime
 import base64
 import os
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from functools import wraps
-import logging
+from pagination import Page, PaginationError
+from db import get_db as get_pooled_db, release_db, pool_stats, PoolTimeout
+from migrate import migrate
+from auth import login_required, role_required, verify_token, revoke_token, bearer_token
+from request_logging import configure_logging
+from metrics import configure_metrics
+from passwords import hash_password, check_password, PasswordHashBusy, DEFAULT_RETRY_AFTER
 
 try:
     import jwt  # PyJWT
 except ImportError:
     raise ImportError("PyJWT is required. Install with 'pip install PyJWT'.")
 
-logging.basicConfig(level=logging.DEBUG)
-
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your_secret_key'
+configure_logging(app)
+configure_metrics(app)
 DATABASE = 'user_management.db'
 
 from question_bank import question_bank
@@ -27,46 +31,45 @@ app.register_blueprint(question_bank)
 from test_management import test_management
 app.register_blueprint(test_management)
 
-@app.before_request
-def log_request_info():
-    app.logger.debug(f'Request: {request.method} {request.url}')
-    app.logger.debug(f'Headers: {dict(request.headers)}')
-    app.logger.debug(f'Body: {request.get_data()}')
+from jobs import jobs
+app.register_blueprint(jobs)
+
+from groups import groups
+app.register_blueprint(groups)
 
-@app.after_request
-def log_response_info(response):
-    app.logger.debug(f'Response status: {response.status}')
-    app.logger.debug(f'Response data: {response.get_data(as_text=True)}')
-    return response
+from profiling import profiling
+app.register_blueprint(profiling)
 
 # --- DB UTILS ---
+def database_name():
+    # current_app.config['DATABASE'] if set, else this module's DATABASE (read late so it can be patched)
+    return current_app.config.get('DATABASE', DATABASE)
+
+# Blueprints resolve the database through the app rather than importing this module
+app.extensions['database'] = database_name
+
 def get_db():
-    db = getattr(g, '_database', None)
-    if db is None:
-        # Set the database name from current_app.config['DATABASE'] if available, else fallback
-        db_name = current_app.config.get('DATABASE', DATABASE)
-        db = g._database = sqlite3.connect(db_name, detect_types=sqlite3.PARSE_DECLTYPES)
-        db.row_factory = sqlite3.Row
-    return db
+    return get_pooled_db(database_name())
 
 @app.teardown_appcontext
 def close_connection(exception):
-    db = getattr(g, '_database', None)
-    if db is not None:
-        db.close()
+    release_db(exception)
+
+@app.errorhandler(PoolTimeout)
+def handle_pool_timeout(e):
+    return jsonify({'message': 'Server busy, please retry'}), 503
+
+@app.errorhandler(PasswordHashBusy)
+def handle_password_hash_busy(e):
+    response = jsonify({'message': 'Too many sign-in requests, please retry'})
+    response.headers['Retry-After'] = str(app.config.get('PASSWORD_HASH_RETRY_AFTER', DEFAULT_RETRY_AFTER))
+    return response, 429
 
 def init_db():
+    """Bring the database up to the latest schema version; returns the versions applied."""
     with app.app_context():
         db = get_db()
-        try:
-            with open('/Users/mihirjha/Documents/coding/begining/dbSchema.sql', 'r') as f:
-                db.executescript(f.read())
-            db.commit()
-        except sqlite3.OperationalError as e:
-            if "already exists" in str(e):
-                pass  # Ignore if tables already exist
-            else:
-                raise
+        return migrate(db)
 
 # --- JWT UTILS ---
 def generate_jwt(user):
@@ -82,32 +85,9 @@ def generate_jwt(user):
     return token
 
 def decode_jwt(token):
-    try:
-        return jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-    except Exception:
-        return None
-
-def login_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        auth = request.headers.get('Authorization', None)
-        if not auth or not auth.startswith('Bearer '):
-            return jsonify({'message': 'Unauthorized'}), 401
-        token = auth.split(' ')[1]
-        payload = decode_jwt(token)
-        if not payload:
-            return jsonify({'message': 'Unauthorized'}), 401
-        g.user = payload
-        return f(*args, **kwargs)
-    return decorated
-
-def admin_required(f):
-    @wraps(f)
-    def decorated(*args, **kwargs):
-        if not hasattr(g, 'user') or g.user.get('role') != 'admin':
-            return jsonify({'message': 'Unauthorized'}), 401
-        return f(*args, **kwargs)
-    return decorated
+    return verify_token(token)
+
+admin_required = role_required('admin')
 
 # --- EMAIL UTILS (MOCK) ---
 def send_verification_email(email, token):
@@ -119,6 +99,8 @@ def send_password_reset_email(email, token):
     print(f"[MOCK] Password reset email to {email}: {reset_link}")
 
 # --- HELPERS ---
+USER_FIELDS = ['id', 'email', 'name', 'role', 'is_email_verified', 'created_at', 'updated_at']
+
 def user_row_to_dict(row):
     return {
         'id': row['id'],
@@ -143,7 +125,7 @@ def register():
     db = get_db()
     if db.execute('SELECT id FROM users WHERE email = ?', (email,)).fetchone():
         return jsonify({'message': 'User already exists'}), 400
-    hashed_password = generate_password_hash(password, method="pbkdf2:sha256")
+    hashed_password = hash_password(password)
     now = datetime.datetime.utcnow()
     db.execute(
         'INSERT INTO users (email, password_hash, role, is_email_verified, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
@@ -184,12 +166,32 @@ def login():
         return jsonify({'message': 'Missing required fields'}), 400
     db = get_db()
     user = db.execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
-    if not user or not check_password_hash(user['password_hash'], password):
+    if not user:
         return jsonify({'message': 'Invalid credentials'}), 401
+    ok, rehashed = check_password(user['password_hash'], password)
+    body, status = complete_login(db, user, ok, rehashed)
+    return jsonify(body), status
+
+def complete_login(db, user, ok, rehashed):
+    """(body, status) once the password was checked; shared with the ASGI login."""
+    if not ok:
+        return {'message': 'Invalid credentials'}, 401
+    if rehashed:
+        # Hashed under older settings; unless the password changed meanwhile, store the new hash
+        db.execute('UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?',
+                   (rehashed, user['id'], user['password_hash']))
+        db.commit()
     if not user['is_email_verified']:
-        return jsonify({'message': 'Please verify your email'}), 401
-    token = generate_jwt(user)
-    return jsonify({'token': token}), 200
+        return {'message': 'Please verify your email'}, 401
+    return {'token': generate_jwt(user)}, 200
+
+@app.route('/auth/logout', methods=['POST'])
+@login_required
+def logout():
+    db = get_db()
+    revoke_token(db, bearer_token(), g.user)
+    db.commit()
+    return jsonify({'message': 'Logged out successfully'}), 200
 
 @app.route('/auth/login', methods=['OPTIONS'])
 def login_options():
@@ -232,7 +234,7 @@ def reset_password():
     user = db.execute('SELECT * FROM users WHERE id = ?', (reset['user_id'],)).fetchone()
     if not user:
         return jsonify({'message': 'User not found'}), 404
-    hashed_password = generate_password_hash(new_password, method="pbkdf2:sha256")
+    hashed_password = hash_password(new_password)
     db.execute('UPDATE users SET password_hash = ?, updated_at = ? WHERE id = ?', (hashed_password, datetime.datetime.utcnow(), user['id']))
     db.execute('DELETE FROM password_resets WHERE id = ?', (reset['id'],))
     db.commit()
@@ -264,7 +266,7 @@ def update_profile():
         params.append(name)
     if password:
         updates.append('password_hash = ?')
-        params.append(generate_password_hash(password, method="pbkdf2:sha256"))
+        params.append(hash_password(password))
     if not updates:
         return jsonify({'message': 'No fields to update'}), 400
     updates.append('updated_at = ?')
@@ -289,9 +291,20 @@ def delete_profile():
 @login_required
 @admin_required
 def list_users():
+    try:
+        page = Page(request.args, USER_FIELDS)
+    except PaginationError as e:
+        return jsonify({'message': str(e)}), 400
     db = get_db()
-    users = db.execute('SELECT * FROM users').fetchall()
-    return jsonify([user_row_to_dict(u) for u in users]), 200
+    keyset, keyset_params = page.sql()
+    users = db.execute('SELECT * FROM users WHERE 1=1' + keyset, keyset_params).fetchall()
+    return page.response(users, lambda rows: [user_row_to_dict(u) for u in rows])
+
+@app.route('/admin/db/pool', methods=['GET'])
+@login_required
+@admin_required
+def get_db_pool_stats():
+    return jsonify(pool_stats()), 200
 
 @app.route('/users/<int:user_id>', methods=['GET'])
 @login_required
@@ -321,7 +334,7 @@ def update_user_by_id(user_id):
         params.append(name)
     if password:
         updates.append('password_hash = ?')
-        params.append(generate_password_hash(password, method="pbkdf2:sha256"))
+        params.append(hash_password(password))
     if not updates:
         return jsonify({'message': 'No fields to update'}), 400
     updates.append('updated_at = ?')
@@ -347,5 +360,24 @@ def delete_user_by_id(user_id):
 # --- INIT DB (for development only) ---
 @app.cli.command('init-db')
 def cli_init_db():
-    init_db()
-    print("Database initialized.")
\ No newline at end of file
+    applied = init_db()
+    print(f"Database initialized. Applied migrations: {applied or 'none'}")
+
+@app.cli.command('replay-submissions')
+def cli_replay_submissions():
+    # Commit submissions left in the journal by a crashed process
+    from submissions import submission_buffer
+    submission_buffer.start(app)
+    submission_buffer.stop()
+    print(f'Replayed submissions: {submission_buffer.committed}')
+
+@app.cli.command('serve-asgi')
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=8000, type=int)
+@click.option('--workers', default=1, type=int, help='Worker processes')
+def cli_serve_asgi(host, port, workers):
+    # Serve through asgi.py (needs uvicorn)
+    if workers > 1 and app.config.get('AUTOSAVE_FLUSH_INTERVAL'):
+        raise click.UsageError('AUTOSAVE_FLUSH_INTERVAL buffers answers per process; leave it unset with several workers')
+    from asgi import serve
+    serve(host, port, workers)
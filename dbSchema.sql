@@ -20,13 +20,13 @@ CREATE TABLE IF NOT EXISTS password_resets (
 );
 
 -- SUBJECTS TABLE
-CREATE TABLE subjects (
+CREATE TABLE IF NOT EXISTS subjects (
     id SERIAL PRIMARY KEY,
     name VARCHAR(100) UNIQUE NOT NULL
 );
 
 -- TOPICS TABLE
-CREATE TABLE topics (
+CREATE TABLE IF NOT EXISTS topics (
     id SERIAL PRIMARY KEY,
     subject_id INTEGER NOT NULL REFERENCES subjects(id) ON DELETE CASCADE,
     name VARCHAR(100) NOT NULL,
@@ -49,7 +49,7 @@ CREATE TABLE IF NOT EXISTS tests (
 );
 
 -- QUESTIONS TABLE
-CREATE TABLE questions (
+CREATE TABLE IF NOT EXISTS questions (
     id SERIAL PRIMARY KEY,
     subject_id INTEGER REFERENCES subjects(id) ON DELETE SET NULL,
     topic_id INTEGER REFERENCES topics(id) ON DELETE SET NULL,
@@ -70,7 +70,7 @@ CREATE TABLE IF NOT EXISTS test_questions (
 );
 
 -- QUESTION_OPTIONS (FOR MCQ/TRUE_FALSE)
-CREATE TABLE question_options (
+CREATE TABLE IF NOT EXISTS question_options (
     id SERIAL PRIMARY KEY,
     question_id INTEGER REFERENCES questions(id) ON DELETE CASCADE,
     option_text TEXT NOT NULL,
@@ -92,7 +92,7 @@ CREATE TABLE IF NOT EXISTS test_assignments (
 -- TEST_ATTEMPTS (EACH STUDENT'S ATTEMPT)
 CREATE TABLE IF NOT EXISTS test_attempts (
     id SERIAL PRIMARY KEY,
-    assignment_id INTEGER REFERENCES assignments(id) ON DELETE CASCADE,
+    assignment_id INTEGER REFERENCES test_assignments(id) ON DELETE CASCADE,
     started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     submitted_at TIMESTAMP,
     score NUMERIC,